@@ -0,0 +1,236 @@
+"""Scaling benchmarks: times the app's hot paths against synthetic WA patients at several sizes
+
+    python benchmarks/run.py                          # 1k and 10k patients
+    python benchmarks/run.py --scales 100000 1000000  # production sizes (slow)
+
+Each benchmark reports the best of --repeat runs, in seconds. Results are written as JSON to
+--output and compared with the per-scale limits in benchmarks/thresholds.json; the run exits
+non-zero when any benchmark exceeds its limit. A startup check also times the login screen's
+cold start in a fresh interpreter and fails if it imports any of LAZY_MODULES.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(ROOT, 'reimbursedv7.py')
+THRESHOLDS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'thresholds.json')
+
+# Invoice rendering is per claim, so it is timed on a fixed-size sample at every scale
+INVOICE_SAMPLE = 20
+SEARCH_QUERIES = ['sarah', 'mitchell', 'PT1', 'cardiac prevention', 'diabetes 12']
+CSV_CHUNK_SIZE = 5000
+
+# Dashboards rendered headlessly: (name, role, admin section)
+DASHBOARDS = [
+    ('login', None, None),
+    ('participant', 'participant', None),
+    ('coordinator', 'coordinator', None),
+    ('admin_patients', 'admin', 'Patient Management'),
+    ('admin_reimbursement', 'admin', 'Reimbursement Management'),
+    ('admin_analytics', 'admin', 'Analytics'),
+    ('admin_banking', 'admin', 'Banking'),
+]
+
+# Only needed once a user opens an invoice or a chart, so the app must not load them for the login
+# screen (Streamlit itself imports the base plotly package, so plotly.express is what is checked)
+LAZY_MODULES = ['reportlab', 'plotly.express', 'webbrowser']
+
+# Run in a fresh interpreter: the first paint of the login screen, with Streamlit itself already imported
+STARTUP_SCRIPT = """
+import json, sys, time
+from streamlit.testing.v1 import AppTest
+preloaded = set(sys.modules)
+start = time.perf_counter()
+at = AppTest.from_file(sys.argv[1], default_timeout=120)
+at.run()
+elapsed = time.perf_counter() - start
+lazy = json.loads(sys.argv[2])
+imported = set(sys.modules) - preloaded
+loaded = sorted(name for name in lazy if any(m == name or m.startswith(name + '.') for m in imported))
+print(json.dumps({'seconds': elapsed, 'loaded': loaded, 'exception': bool(at.exception)}))
+"""
+
+def timed(fn, repeat):
+    """Best wall time of repeat calls to fn, and its last result"""
+    best, result = float('inf'), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def bench_core(n, repeat, log):
+    from reimbursed.reimbursement import calculate_reimbursements
+    from reimbursed.search import PatientSearchIndex
+    from reimbursed.summary import PatientSummary
+    from reimbursed.analytics import AnalyticsCube
+    from reimbursed.exports import iter_payment_csv, iter_visit_ics
+    from reimbursed.schedule import VisitSchedule
+    from reimbursed.invoices import generate_invoices
+    from reimbursed.synthetic import generate_patients
+
+    results = {}
+    def record(name, fn, times=repeat):
+        results[name], result = timed(fn, times)
+        log(f"  {name:<30} {results[name] * 1000:10.1f} ms")
+        return result
+
+    df = record('generate_patients', lambda: generate_patients(n, today='2026-01-01'), times=1)
+    # The first calculation loads the rate-rules CSV; time the calculation, not the load
+    calculate_reimbursements(df.head(1))
+    record('reimbursement_totals', lambda: calculate_reimbursements(df)['total'].sum())
+    record('summary_build', lambda: PatientSummary(df))
+    record('analytics_cube_build', lambda: AnalyticsCube(df))
+    index = record('search_index_build', lambda: PatientSearchIndex(df), times=1)
+    record('search_query', lambda: [index.search(query, limit=100) for query in SEARCH_QUERIES])
+    schedule = record('visit_schedule_build', lambda: VisitSchedule(df), times=1)
+    record('visit_schedule_next', lambda: schedule.next(10, after='2026-01-01'))
+    record('ics_export', lambda: sum(len(block) for block in iter_visit_ics(schedule.iter_between(), 'All visits')))
+
+    approved = df[df['status'] == 'approved']
+    chunks = lambda: (approved.iloc[i:i + CSV_CHUNK_SIZE] for i in range(0, len(approved), CSV_CHUNK_SIZE))
+    record('csv_export', lambda: sum(len(block) for block in iter_payment_csv(chunks())))
+
+    # A fresh invoice cache per scale, so every render is a miss
+    sample = approved.head(INVOICE_SAMPLE)
+    record('invoice_generation', lambda: list(generate_invoices(sample)), times=1)
+    return results
+
+def bench_dashboards(n, repeat, workdir, log):
+    import streamlit as st
+    from streamlit.testing.v1 import AppTest
+
+    from reimbursed.store import PatientStore
+
+    # The app seeds its store from the synthetic generator on first run
+    db_path = os.path.join(workdir, f'patients_{n}.db')
+    os.environ['REIMBURSED_DB'] = db_path
+    os.environ['REIMBURSED_SYNTHETIC_PATIENTS'] = str(n)
+    st.cache_data.clear()
+    st.cache_resource.clear()
+
+    results = {}
+    def render(role, section):
+        at = AppTest.from_file(APP_PATH, default_timeout=3600)
+        if role:
+            at.session_state['current_user'] = role
+        if section:
+            at.session_state['admin_section'] = section
+        at.run()
+        if at.exception:
+            raise RuntimeError(f"{role or 'login'} dashboard failed: {at.exception[0].message}")
+        return at
+
+    # The login screen never opens the store, so the first dashboard render is what seeds it
+    results['store_seed'], _ = timed(lambda: render('participant', None), 1)
+    log(f"  {'store_seed':<30} {results['store_seed'] * 1000:10.1f} ms")
+    # Guard against timing some other database, which would make every dashboard figure meaningless
+    seeded = PatientStore(db_path).count() if os.path.exists(db_path) else 0
+    if seeded != n:
+        raise RuntimeError(f"dashboards rendered {db_path} with {seeded} patients, expected {n}")
+    for name, role, section in DASHBOARDS:
+        key = f'dashboard_{name}'
+        results[key], _ = timed(lambda: render(role, section), repeat)
+        log(f"  {key:<30} {results[key] * 1000:10.1f} ms")
+    return results
+
+def bench_startup(repeat, log):
+    """Best cold-start time of the login screen, and any lazy modules it loaded"""
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, '-c', STARTUP_SCRIPT, APP_PATH, json.dumps(LAZY_MODULES)],
+            capture_output=True, text=True, check=True, cwd=ROOT
+        ).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+    if any(run['exception'] for run in runs):
+        raise RuntimeError("login screen failed to render")
+    results = {'cold_start_login': min(run['seconds'] for run in runs), 'lazy_modules_loaded': runs[0]['loaded']}
+    log(f"  {'cold_start_login':<30} {results['cold_start_login'] * 1000:10.1f} ms")
+    if results['lazy_modules_loaded']:
+        log(f"  loaded at startup: {', '.join(results['lazy_modules_loaded'])}")
+    return results
+
+def check_thresholds(scales, thresholds):
+    regressions = []
+    for scale, results in scales.items():
+        for name, seconds in results.items():
+            limit = thresholds.get(scale, {}).get(name)
+            if limit is not None and seconds > limit:
+                regressions.append({'scale': int(scale), 'benchmark': name, 'seconds': seconds, 'threshold': limit})
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scales', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', default='benchmark-results.json')
+    parser.add_argument('--thresholds', default=THRESHOLDS_PATH)
+    parser.add_argument('--skip-dashboards', action='store_true', help="skip the headless AppTest renders")
+    parser.add_argument('--skip-startup', action='store_true', help="skip the cold-start import check")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='reimbursed-bench-')
+    # Keep the benchmark's database, invoice cache and receipts out of the working tree
+    os.environ['REIMBURSED_INVOICE_CACHE'] = os.path.join(workdir, 'invoice_cache')
+    os.environ['REIMBURSED_RECEIPTS'] = os.path.join(workdir, 'receipts')
+    sys.path.insert(0, ROOT)
+    log = lambda line: print(line, file=sys.stderr)
+
+    startup = None
+    if not args.skip_startup:
+        log("Startup")
+        startup = bench_startup(args.repeat, log)
+
+    scales = {}
+    for n in args.scales:
+        log(f"{n:,} patients")
+        scales[str(n)] = bench_core(n, args.repeat, log)
+        if not args.skip_dashboards:
+            scales[str(n)].update(bench_dashboards(n, args.repeat, workdir, log))
+
+    thresholds = {}
+    if os.path.exists(args.thresholds):
+        with open(args.thresholds) as f:
+            thresholds = json.load(f)
+    regressions = check_thresholds(scales, thresholds)
+    if startup:
+        limit = thresholds.get('startup', {}).get('cold_start_login')
+        if limit is not None and startup['cold_start_login'] > limit:
+            regressions.append({'benchmark': 'cold_start_login', 'seconds': startup['cold_start_login'], 'threshold': limit})
+        for module in startup['lazy_modules_loaded']:
+            regressions.append({'benchmark': 'lazy_imports', 'module': module})
+
+    report = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'repeat': args.repeat,
+        'startup': startup,
+        'scales': scales,
+        'regressions': regressions,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    log(f"Results written to {args.output}")
+
+    for regression in regressions:
+        if 'module' in regression:
+            log(f"REGRESSION {regression['module']} is imported before the login screen renders")
+        elif 'scale' in regression:
+            log(f"REGRESSION {regression['benchmark']} at {regression['scale']:,}: "
+                f"{regression['seconds']:.3f}s > {regression['threshold']:.3f}s")
+        else:
+            log(f"REGRESSION {regression['benchmark']}: {regression['seconds']:.3f}s > {regression['threshold']:.3f}s")
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,14 @@
+"""Headless core of the clinical trial reimbursement app
+
+Everything here runs without Streamlit: the patient store, reimbursement rules, invoices, payment
+exports, search and aggregates. reimbursedv7.py is the Streamlit UI on top of it, and
+`python -m reimbursed` runs batch payment jobs from the command line.
+"""
+import os
+
+# The database, invoice cache and receipt store default to the project directory, next to the app
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+from .reimbursement import calculate_reimbursement, calculate_reimbursements
+from .store import PatientStore
+from .invoices import generate_invoice_pdf
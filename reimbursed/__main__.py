@@ -0,0 +1,7 @@
+import sys
+
+from .cli import main
+
+# Guarded: process-pool workers for bulk invoices re-import the main module
+if __name__ == '__main__':
+    sys.exit(main())
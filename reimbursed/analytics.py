@@ -0,0 +1,86 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+CUBE_DIMENSIONS = ['study_name', 'hospital', 'transport_method', 'status', 'week']
+
+# Fixed server-side distance bins so histogram counts can be added incrementally
+DISTANCE_BIN_EDGES = np.arange(0, 210, 10)
+
+class AnalyticsCube:
+    """Patient counts and distance histograms pre-aggregated over (study, hospital, transport, status, week)
+
+    Both aggregates are sparse Series on a MultiIndex of the cube dimensions; adds and status
+    changes merge a small grouped delta in, so chart queries never touch patient rows.
+    """
+
+    def __init__(self, patients=None):
+        self._lock = threading.Lock()
+        self._counts = pd.Series(dtype='int64')
+        self._histogram = pd.Series(dtype='int64')
+        if patients is not None:
+            self.add(patients)
+
+    @staticmethod
+    def _keys(patients, status=None):
+        keys = pd.DataFrame({
+            'study_name': patients['study_name'],
+            'hospital': patients['hospital'],
+            'transport_method': patients['transport_method'],
+            'status': patients['status'] if status is None else status,
+            'week': pd.to_datetime(patients['upcoming_visit']).dt.to_period('W').dt.start_time
+        }, index=patients.index)
+        return keys
+
+    def _apply(self, patients, sign, status=None):
+        if patients.empty:
+            return
+        keys = self._keys(patients, status)
+        counts = keys.groupby(CUBE_DIMENSIONS, observed=True).size() * sign
+        
+        distance = patients['distance'].to_numpy(dtype=float)
+        bins = np.clip(np.digitize(distance, DISTANCE_BIN_EDGES) - 1, 0, len(DISTANCE_BIN_EDGES) - 2)
+        histogram = keys.assign(bin=bins).groupby(CUBE_DIMENSIONS + ['bin'], observed=True).size() * sign
+        
+        with self._lock:
+            self._counts = self._merge(self._counts, counts)
+            self._histogram = self._merge(self._histogram, histogram)
+
+    @staticmethod
+    def _merge(current, delta):
+        merged = delta if current.empty else current.add(delta, fill_value=0).astype('int64')
+        return merged[merged != 0]
+
+    def add(self, patients):
+        self._apply(patients, 1)
+
+    def remove(self, patients):
+        self._apply(patients, -1)
+
+    def update_status(self, patients, new_status):
+        """Move patients (as they were before the change) to new_status"""
+        self._apply(patients, -1)
+        self._apply(patients, 1, status=new_status)
+
+    def totals(self, by, **filters):
+        """Patient counts grouped by one cube dimension, optionally restricted with dimension=value filters"""
+        with self._lock:
+            counts = self._counts
+        if counts.empty:
+            return pd.Series(dtype='int64')
+        for dimension, value in filters.items():
+            counts = counts[counts.index.get_level_values(dimension) == value]
+        return counts.groupby(level=by).sum().sort_values(ascending=False)
+
+    def distance_histogram(self, exclude_transport='public'):
+        """(bin_edges, counts) over all patients, excluding the given transport method"""
+        with self._lock:
+            histogram = self._histogram
+        counts = np.zeros(len(DISTANCE_BIN_EDGES) - 1, dtype='int64')
+        if not histogram.empty:
+            if exclude_transport is not None:
+                histogram = histogram[histogram.index.get_level_values('transport_method') != exclude_transport]
+            per_bin = histogram.groupby(level='bin').sum()
+            counts[per_bin.index.to_numpy(dtype=int)] = per_bin.to_numpy()
+        return DISTANCE_BIN_EDGES, counts
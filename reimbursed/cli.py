@@ -0,0 +1,195 @@
+"""Command-line batch jobs, for schedulers rather than people
+
+    python -m reimbursed pay-run --from 2026-01-01 --to 2026-01-31 --output-dir payments/2026-01 --aba
+
+A payment run covers claims whose visit falls in the date range (both ends inclusive) and writes
+the payment CSV, the invoices and, with --aba, the bank file (marking its claims paid), plus
+summary.json with the totals.
+ABA payer settings default to the same ABA_* environment variables as the admin portal.
+
+    python -m reimbursed calendars --output-dir calendars
+
+writes an iCalendar feed of upcoming visits for every hospital and every study, for coordinators
+to subscribe to.
+"""
+import argparse
+import json
+import os
+import re
+import sys
+from collections import Counter
+from datetime import datetime
+
+import pandas as pd
+
+from .exports import iter_payment_csv, iter_visit_ics, write_aba_file
+from .invoices import write_invoices_zip, write_merged_invoice_pdf
+from .reimbursement import calculate_reimbursements
+from .schedule import VisitSchedule
+from .store import PatientStore, default_db_path
+
+ABA_SETTINGS = {
+    'user_name': 'ABA_USER_NAME',
+    'apca_id': 'ABA_APCA_ID',
+    'bank_code': 'ABA_BANK_CODE',
+    'remitter': 'ABA_REMITTER',
+    'trace_bsb': 'ABA_TRACE_BSB',
+    'trace_account': 'ABA_TRACE_ACCOUNT',
+}
+
+def parse_date(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected YYYY-MM-DD, got {value!r}")
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='python -m reimbursed', description="Clinical trial reimbursement batch jobs")
+    parser.add_argument('--db', default=default_db_path(), help="patient database (default: %(default)s)")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    pay_run = commands.add_parser('pay-run', help="totals, invoices and payment files for a visit date range")
+    pay_run.add_argument('--from', dest='date_from', type=parse_date, required=True, help="first visit date, YYYY-MM-DD")
+    pay_run.add_argument('--to', dest='date_to', type=parse_date, required=True, help="last visit date, YYYY-MM-DD")
+    pay_run.add_argument('--output-dir', required=True)
+    pay_run.add_argument('--status', action='append', help="claim status to pay, repeatable (default: approved)")
+    pay_run.add_argument('--invoices', choices=['zip', 'merged', 'none'], default='zip',
+                         help="a ZIP of per-claim PDFs, one merged PDF, or no invoices (default: %(default)s)")
+    pay_run.add_argument('--aba', action='store_true', help="also write an ABA direct-entry file")
+    pay_run.add_argument('--processing-date', type=parse_date, help="ABA processing date (default: today)")
+    for setting, variable in ABA_SETTINGS.items():
+        pay_run.add_argument(f"--{setting.replace('_', '-')}", dest=setting, default=os.environ.get(variable),
+                             help=f"ABA payer setting (default: ${variable})")
+
+    calendars = commands.add_parser('calendars', help="iCalendar feeds of upcoming visits per hospital and per study")
+    calendars.add_argument('--output-dir', required=True)
+    calendars.add_argument('--from', dest='date_from', type=parse_date, help="first visit date, YYYY-MM-DD (default: today)")
+    return parser
+
+def pay_run(store, args, log):
+    statuses = args.status or ['approved']
+    filters = {
+        'status': statuses,
+        'visit_from': pd.Timestamp(args.date_from),
+        # The store's upper bound is exclusive, the command's is inclusive
+        'visit_to': pd.Timestamp(args.date_to) + pd.Timedelta(days=1),
+    }
+    stamp = f"{args.date_from:%Y%m%d}_{args.date_to:%Y%m%d}"
+    os.makedirs(args.output_dir, exist_ok=True)
+    output = lambda name: os.path.join(args.output_dir, name)
+
+    summary = {
+        'from': args.date_from.isoformat(),
+        'to': args.date_to.isoformat(),
+        'statuses': statuses,
+        'claims': 0,
+        'total': 0.0,
+        'by_study': {},
+        'files': {},
+    }
+    by_study = Counter()
+
+    # Totals and the CSV stream over the store in chunks, so the run's memory stays flat
+    csv_path = output(f"payments_{stamp}.csv")
+    with open(csv_path, 'wb') as f:
+        def counted_chunks():
+            for chunk in store.iter_chunks(**filters):
+                totals = calculate_reimbursements(chunk)['total']
+                summary['claims'] += len(chunk)
+                by_study.update(totals.groupby(chunk['study_id'], observed=True).sum().to_dict())
+                yield chunk
+        for block in iter_payment_csv(counted_chunks()):
+            f.write(block)
+    summary['files']['payments'] = csv_path
+    summary['by_study'] = {study: round(total, 2) for study, total in sorted(by_study.items())}
+    summary['total'] = round(sum(by_study.values()), 2)
+    log(f"{summary['claims']} claim(s) totalling ${summary['total']:.2f}")
+
+    if args.invoices != 'none' and summary['claims']:
+        claims = store.select(**filters)
+        if args.invoices == 'zip':
+            invoice_path = output(f"invoices_{stamp}.zip")
+            with open(invoice_path, 'wb') as f:
+                write_invoices_zip(claims, f)
+        else:
+            invoice_path = output(f"invoices_{stamp}.pdf")
+            with open(invoice_path, 'wb') as f:
+                write_merged_invoice_pdf(claims, f)
+        summary['files']['invoices'] = invoice_path
+        log(f"Invoices written to {invoice_path}")
+
+    if args.aba:
+        settings = {setting: getattr(args, setting) for setting in ABA_SETTINGS}
+        processing_date = args.processing_date or datetime.now().date()
+        aba_path = output(f"payments_{stamp}.aba")
+        with open(aba_path, 'wb') as f:
+            # Only approved claims are paid, whatever the CSV and invoices cover
+            count, total_cents, rejects, paid_ids = write_aba_file(
+                store.iter_chunks(**{**filters, 'status': 'approved'}), f, processing_date=processing_date, **settings
+            )
+        # Claims in a bank file are paid, so a second run cannot pay them again; only claims still
+        # approved are marked, so a change made meanwhile is not overwritten
+        marked = store.update_status(paid_ids, 'paid', from_status='approved')
+        summary['files']['aba'] = aba_path
+        summary['aba'] = {'payments': count, 'total': total_cents / 100, 'rejected': len(rejects), 'marked_paid': len(marked)}
+        log(f"ABA file with {count} payment(s) totalling ${total_cents / 100:.2f} written to {aba_path}; claims marked paid")
+        if not rejects.empty:
+            rejects_path = output(f"rejected_{stamp}.csv")
+            rejects.to_csv(rejects_path, index=False)
+            summary['files']['rejected'] = rejects_path
+            log(f"{len(rejects)} claim(s) rejected, see {rejects_path}")
+
+    summary_path = output('summary.json')
+    with open(summary_path, 'w') as f:
+        json.dump(summary, f, indent=2)
+    log(f"Summary written to {summary_path}")
+    return summary
+
+def calendar_feeds(store, args, log):
+    schedule = VisitSchedule()
+    for chunk in store.iter_chunks(status='upcoming'):
+        schedule.add(chunk)
+    start = pd.Timestamp(args.date_from or datetime.now().date())
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    feeds = {}
+    for field, kind in (('hospital', 'hospital'), ('study_id', 'study')):
+        for value in schedule.values(field):
+            slug = re.sub(r'[^A-Za-z0-9]+', '_', value).strip('_').lower()
+            path = os.path.join(args.output_dir, f"{kind}_{slug}.ics")
+            visits = schedule.iter_between(start=start, **{field: value})
+            with open(path, 'wb') as f:
+                for block in iter_visit_ics(visits, f"Study visits - {value}"):
+                    f.write(block)
+            feeds[path] = value
+    log(f"{len(feeds)} calendar(s) of visits from {start:%Y-%m-%d} written to {args.output_dir}")
+    return feeds
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    log = lambda line: print(line, file=sys.stderr)
+
+    # Opening a missing database would create one seeded with mock patients
+    if not os.path.exists(args.db):
+        parser.error(f"no patient database at {args.db}")
+    if args.command == 'pay-run' and args.date_to < args.date_from:
+        parser.error("--to is before --from")
+    if args.command == 'pay-run' and args.aba and set(args.status or ['approved']) != {'approved'}:
+        parser.error("--aba pays approved claims only; drop --status or use --status approved")
+    if args.command == 'pay-run' and args.aba:
+        missing = [f"--{setting.replace('_', '-')}" for setting in ABA_SETTINGS if not getattr(args, setting)]
+        if missing:
+            parser.error(f"--aba needs {', '.join(missing)} (or the matching ABA_* environment variables)")
+
+    store = PatientStore(args.db)
+    if args.command == 'calendars':
+        calendar_feeds(store, args, log)
+        return 0
+    try:
+        pay_run(store, args, log)
+    except ValueError as e:
+        # Invalid payer details or a batch too large for one ABA file
+        log(f"error: {e}")
+        return 1
+    return 0
@@ -0,0 +1,89 @@
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+POSTCODE_TABLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'wa_postcodes.csv')
+
+HOSPITALS = {
+    "Royal Perth Hospital": {"address": "197 Wellington Street, Perth WA 6000", "latitude": -31.9540, "longitude": 115.8660},
+    "Sir Charles Gairdner Hospital": {"address": "Hospital Avenue, Nedlands WA 6009", "latitude": -31.9670, "longitude": 115.8170},
+    "Fiona Stanley Hospital": {"address": "11 Robin Warren Drive, Murdoch WA 6150", "latitude": -32.0700, "longitude": 115.8470},
+    "Fremantle Hospital": {"address": "Alma Street, Fremantle WA 6160", "latitude": -32.0560, "longitude": 115.7520},
+    "Princess Margaret Hospital": {"address": "Roberts Road, Subiaco WA 6008", "latitude": -31.9480, "longitude": 115.8170},
+}
+
+EARTH_RADIUS_KM = 6371.0088
+# Straight-line distance understates the drive; 1.3 is a typical metropolitan road circuity
+ROAD_DISTANCE_FACTOR = 1.3
+
+# A claimed distance is flagged when it differs from the estimate by more than both of these
+DISTANCE_TOLERANCE_KM = 5
+DISTANCE_TOLERANCE_RATIO = 0.3
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance in km; arguments are broadcastable arrays in degrees"""
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+def extract_postcodes(addresses):
+    """WA postcode from the end of each address ("... Nedlands WA 6009"), as a string Series; NaN if absent"""
+    addresses = pd.Series(addresses).fillna('').astype(str)
+    postcode = addresses.str.extract(r'\bWA\s*(6\d{3})\b', expand=False)
+    return postcode.fillna(addresses.str.extract(r'\b(6\d{3})\s*$', expand=False))
+
+class DistanceEngine:
+    """Offline patient-to-hospital distances from bundled WA postcode centroids
+
+    The postcode x hospital distance matrix is computed once; estimating a whole DataFrame is a
+    postcode lookup plus one fancy-index into the matrix.
+    """
+
+    def __init__(self, postcode_table=POSTCODE_TABLE_PATH, hospitals=HOSPITALS):
+        postcodes = pd.read_csv(postcode_table, dtype={'postcode': str})
+        self.postcodes = postcodes.set_index('postcode')
+        self.hospital_names = list(hospitals)
+        self._postcode_index = pd.Index(self.postcodes.index)
+        self._hospital_index = pd.Index(self.hospital_names)
+        hospital_lat = np.array([hospitals[h]['latitude'] for h in self.hospital_names])
+        hospital_lon = np.array([hospitals[h]['longitude'] for h in self.hospital_names])
+        straight = haversine_km(
+            self.postcodes['latitude'].to_numpy()[:, None], self.postcodes['longitude'].to_numpy()[:, None],
+            hospital_lat[None, :], hospital_lon[None, :]
+        )
+        self.matrix = np.round(straight * ROAD_DISTANCE_FACTOR, 1)
+
+    def estimate(self, addresses, hospitals):
+        """Estimated road km for each (address, hospital) pair; NaN where the postcode or hospital is unknown"""
+        # Households and repeat visits share addresses; parse each distinct address once
+        codes, unique_addresses = pd.factorize(pd.Series(addresses).fillna(''))
+        rows = self._postcode_index.get_indexer(extract_postcodes(unique_addresses))[codes]
+        cols = self._hospital_index.get_indexer(pd.Series(hospitals).astype(str))
+        known = (rows >= 0) & (cols >= 0)
+        km = np.full(len(rows), np.nan)
+        km[known] = self.matrix[rows[known], cols[known]]
+        return km
+
+    def estimate_patients(self, patients):
+        return pd.Series(self.estimate(patients['address'].to_numpy(), patients['hospital'].to_numpy()),
+                         index=patients.index, name='estimated_distance')
+
+    def check_claimed(self, patients):
+        """Boolean Series: True where a car/taxi claim's distance is implausible against the estimate"""
+        estimate = self.estimate_patients(patients)
+        claimed = patients['distance'].astype(float)
+        difference = (claimed - estimate).abs()
+        flagged = (difference > DISTANCE_TOLERANCE_KM) & (difference > DISTANCE_TOLERANCE_RATIO * estimate)
+        return flagged & (patients['transport_method'] != 'public') & estimate.notna()
+
+_engine = None
+_engine_lock = threading.Lock()
+
+def get_distance_engine():
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = DistanceEngine()
+    return _engine
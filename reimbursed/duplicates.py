@@ -0,0 +1,106 @@
+import io
+import itertools
+import threading
+from collections import defaultdict
+
+import numpy as np
+from PIL import Image
+
+HASH_BITS = 64
+# Hashes this close are treated as the same receipt photographed or scanned again
+DUPLICATE_MAX_DISTANCE = 8
+
+_DCT_SIZE = 32
+_DCT_KEEP = 8
+
+def _dct_matrix(n):
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    matrix = np.sqrt(2 / n) * np.cos(np.pi * (2 * i + 1) * k / (2 * n))
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+_DCT = _dct_matrix(_DCT_SIZE)
+
+def perceptual_hash(data):
+    """64-bit DCT perceptual hash of an image's bytes; None if the bytes are not an image"""
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            # draft() lets JPEG decode at reduced scale, so large scans hash quickly
+            image.draft('L', (_DCT_SIZE * 4, _DCT_SIZE * 4))
+            pixels = np.asarray(image.convert('L').resize((_DCT_SIZE, _DCT_SIZE), Image.LANCZOS), dtype=float)
+    except Exception:
+        return None
+    low = (_DCT @ pixels @ _DCT.T)[:_DCT_KEEP, :_DCT_KEEP].flatten()
+    bits = low > np.median(low[1:])
+    return int(np.packbits(bits).view('>u8')[0])
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+class ReceiptHashIndex:
+    """Multi-index hashing over 64-bit perceptual hashes for Hamming-radius lookups
+
+    Each hash is split into four 16-bit chunks, each with its own exact-match table. Two hashes
+    within distance r agree on at least one chunk to within r // 4 bits, so a query probes each
+    table with every chunk value at that radius and verifies the few candidates it finds.
+    """
+
+    CHUNKS = 4
+    CHUNK_BITS = HASH_BITS // CHUNKS
+
+    def __init__(self, entries=()):
+        self._tables = [defaultdict(list) for _ in range(self.CHUNKS)]
+        self._entries = []
+        self._by_digest = {}
+        self._lock = threading.Lock()
+        for entry in entries:
+            self.add(*entry)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _chunks(self, phash):
+        mask = (1 << self.CHUNK_BITS) - 1
+        return [(phash >> (i * self.CHUNK_BITS)) & mask for i in range(self.CHUNKS)]
+
+    def _neighbours(self, chunk, radius):
+        yield chunk
+        for r in range(1, radius + 1):
+            for bits in itertools.combinations(range(self.CHUNK_BITS), r):
+                flipped = chunk
+                for bit in bits:
+                    flipped ^= 1 << bit
+                yield flipped
+
+    def add(self, phash, digest, patient_id):
+        with self._lock:
+            position = len(self._entries)
+            self._entries.append((phash, digest, patient_id))
+            self._by_digest[digest] = phash
+            for table, chunk in zip(self._tables, self._chunks(phash)):
+                table[chunk].append(position)
+
+    def hash_for(self, digest):
+        return self._by_digest.get(digest)
+
+    def query(self, phash, max_distance=DUPLICATE_MAX_DISTANCE):
+        """[(distance, digest, patient_id)] for every indexed hash within max_distance, closest first"""
+        radius = max_distance // self.CHUNKS
+        candidates = set()
+        with self._lock:
+            for table, chunk in zip(self._tables, self._chunks(phash)):
+                for key in self._neighbours(chunk, radius):
+                    candidates.update(table.get(key, ()))
+            entries = [self._entries[position] for position in candidates]
+        matches = []
+        for other, digest, patient_id in entries:
+            distance = hamming(phash, other)
+            if distance <= max_distance:
+                matches.append((distance, digest, patient_id))
+        return sorted(matches)
+
+    def find_duplicates(self, phash, digest, patient_id, max_distance=DUPLICATE_MAX_DISTANCE):
+        """Matches for a receipt other than its own entry on the same claim"""
+        return [match for match in self.query(phash, max_distance)
+                if not (match[1] == digest and match[2] == patient_id)]
@@ -0,0 +1,238 @@
+import tempfile
+
+import pandas as pd
+
+from .reimbursement import calculate_reimbursements
+from .schema import kilometres
+
+PAYMENT_EXPORT_COLUMNS = [
+    'Patient ID', 'Name', 'Study', 'Transport', 'Distance (km)', 'Duration (hrs)', 'KM Cost',
+    'Meal Allowance', 'Fare', 'Total Reimbursement', 'BSB', 'Account', 'Hospital', 'Patient Address',
+    'Hospital Address', 'Receipts'
+]
+
+def payment_export_frame(patients):
+    """Payment rows for approved claims, with amounts left numeric"""
+    reimbursements = calculate_reimbursements(patients)
+    return pd.DataFrame({
+        'Patient ID': patients['patient_id'],
+        'Name': patients['name'],
+        'Study': patients['study_name'],
+        'Transport': patients['transport_method'].str.title(),
+        'Distance (km)': kilometres(patients['distance']),
+        'Duration (hrs)': patients['visit_duration'],
+        'KM Cost': reimbursements['km_cost'].round(2),
+        'Meal Allowance': reimbursements['meal_allowance'].round(2),
+        'Fare': reimbursements['fare_cost'].round(2),
+        'Total Reimbursement': reimbursements['total'].round(2),
+        'BSB': patients['bsb'],
+        'Account': patients['account_number'],
+        'Hospital': patients['hospital'],
+        'Patient Address': patients['address'],
+        'Hospital Address': patients['hospital_address'],
+        'Receipts': patients['receipts'].str.len()
+    })
+
+def iter_payment_csv(chunks):
+    """Yield UTF-8 CSV bytes, one block per DataFrame chunk of patients, header first"""
+    header = True
+    for patients in chunks:
+        if patients.empty:
+            continue
+        yield payment_export_frame(patients).to_csv(index=False, header=header).encode('utf-8')
+        header = False
+    if header:
+        yield pd.DataFrame(columns=PAYMENT_EXPORT_COLUMNS).to_csv(index=False).encode('utf-8')
+
+def spool(blocks):
+    """The bytes of an export written block by block through a temporary file
+
+    Only one block and the finished export are held at once, rather than every block plus their
+    join. Bytes are what st.download_button serves, and the file is closed before returning.
+    """
+    with tempfile.TemporaryFile(suffix='.export') as f:
+        for block in blocks:
+            f.write(block)
+        f.seek(0)
+        return f.read()
+
+# Australian direct-entry (ABA / CEMTEX) payment files
+ABA_RECORD_LENGTH = 120
+ABA_CREDIT_CODE = '50'
+ABA_BSB_RE = r'\d{3}-?\d{3}'
+ABA_ACCOUNT_RE = r'\d{5,9}'
+
+def _aba_text(series, width):
+    # Direct-entry files are restricted to upper-case-safe ASCII
+    text = series.fillna('').astype(str).str.encode('ascii', 'replace').str.decode('ascii')
+    return text.str.replace(r'[\r\n]', ' ', regex=True).str.slice(0, width).str.ljust(width)
+
+def validate_payments(patients):
+    """Split patients into (payable, rejects); rejects carry a 'Reason' column. All checks are vectorised."""
+    bsb = patients['bsb'].fillna('').astype(str).str.strip()
+    account = patients['account_number'].fillna('').astype(str).str.replace(r'[\s-]', '', regex=True)
+    amount_cents = (calculate_reimbursements(patients)['total'] * 100).round().astype('int64')
+    checks = [
+        (~bsb.str.fullmatch(ABA_BSB_RE), 'Invalid BSB'),
+        (~account.str.fullmatch(ABA_ACCOUNT_RE), 'Invalid account number'),
+        (patients['name'].fillna('').astype(str).str.strip() == '', 'Missing account name'),
+        (amount_cents <= 0, 'Nothing to pay'),
+        (amount_cents >= 10 ** 10, 'Amount too large'),
+    ]
+    reason = pd.Series('', index=patients.index)
+    for failed, message in reversed(checks):
+        reason = reason.mask(failed, message)
+    ok = reason == ''
+    payable = patients[ok].assign(
+        aba_bsb=bsb[ok].str.replace('-', '').str.replace(r'^(\d{3})(\d{3})$', r'\1-\2', regex=True),
+        aba_account=account[ok],
+        aba_cents=amount_cents[ok]
+    )
+    rejects = pd.DataFrame({
+        'Patient ID': patients['patient_id'],
+        'Name': patients['name'],
+        'BSB': patients['bsb'],
+        'Account': patients['account_number'],
+        'Reason': reason
+    })[~ok]
+    return payable, rejects
+
+def aba_detail_records(payable, trace_bsb, trace_account, remitter, reference_prefix='REIMB'):
+    """Type 1 credit records for validated payments, built column-wise"""
+    n = len(payable)
+    return (
+        '1'
+        + payable['aba_bsb']
+        + payable['aba_account'].str.rjust(9)
+        + ' '
+        + ABA_CREDIT_CODE
+        + payable['aba_cents'].astype(str).str.zfill(10)
+        + _aba_text(payable['name'].str.upper(), 32)
+        + _aba_text(reference_prefix + ' ' + payable['patient_id'], 18)
+        + trace_bsb
+        + trace_account.rjust(9)
+        + _aba_text(pd.Series([remitter] * n, index=payable.index), 16)
+        + '0' * 8
+    )
+
+def write_aba_file(chunks, fileobj, user_name, apca_id, bank_code, trace_bsb, trace_account,
+                   remitter, description='REIMBURSE', processing_date=None, reference_prefix='REIMB'):
+    """Stream an ABA file for every payable patient in chunks; returns (count, total_cents, rejects, paid_ids)
+
+    paid_ids are the patients with a payment in the file, for the caller to mark paid once it is kept.
+    """
+    if not pd.Series([trace_bsb]).str.fullmatch(ABA_BSB_RE).iloc[0] or not str(trace_account).isdigit():
+        raise ValueError("Trace BSB and account must be the payer's own valid account")
+    trace_bsb = trace_bsb.replace('-', '')
+    trace_bsb = f"{trace_bsb[:3]}-{trace_bsb[3:]}"
+    processing_date = pd.Timestamp(processing_date or pd.Timestamp.now())
+    
+    header = (
+        '0' + ' ' * 17 + '01'
+        + str(bank_code)[:3].upper().ljust(3) + ' ' * 7
+        + str(user_name)[:26].ljust(26)
+        + str(apca_id)[:6].zfill(6)
+        + str(description)[:12].ljust(12)
+        + processing_date.strftime('%d%m%y')
+        + ' ' * 40
+    )
+    fileobj.write((header + '\r\n').encode('ascii'))
+    
+    count, total_cents, rejects, paid_ids = 0, 0, [], []
+    for patients in chunks:
+        payable, chunk_rejects = validate_payments(patients)
+        rejects.append(chunk_rejects)
+        if payable.empty:
+            continue
+        records = aba_detail_records(payable, trace_bsb, str(trace_account), remitter, reference_prefix)
+        fileobj.write(('\r\n'.join(records) + '\r\n').encode('ascii'))
+        count += len(payable)
+        total_cents += int(payable['aba_cents'].sum())
+        paid_ids.extend(payable['patient_id'])
+    
+    if total_cents >= 10 ** 10:
+        raise ValueError("Batch total exceeds the ABA file limit; split the payment run")
+    footer = (
+        '7' + '999-999' + ' ' * 12
+        + str(total_cents).zfill(10)
+        + str(total_cents).zfill(10)
+        + '0' * 10
+        + ' ' * 24
+        + str(count).zfill(6)
+        + ' ' * 40
+    )
+    fileobj.write((footer + '\r\n').encode('ascii'))
+    rejects = pd.concat(rejects, ignore_index=True) if rejects else pd.DataFrame(columns=['Patient ID', 'Name', 'BSB', 'Account', 'Reason'])
+    return count, total_cents, rejects, paid_ids
+
+# iCalendar (RFC 5545) visit feeds; visit times are Perth local time, which has no daylight saving
+ICS_TIMEZONE = 'Australia/Perth'
+ICS_EVENTS_PER_BLOCK = 500
+ICS_LINE_OCTETS = 75
+
+def _ics_escape(value):
+    return (str(value).replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+            .replace('\r\n', '\\n').replace('\n', '\\n'))
+
+def _ics_line(line):
+    """One content line, folded at 75 octets without splitting a UTF-8 character"""
+    data = line.encode('utf-8')
+    if len(data) <= ICS_LINE_OCTETS:
+        return data + b'\r\n'
+    parts, current, limit = [], b'', ICS_LINE_OCTETS
+    for char in line:
+        encoded = char.encode('utf-8')
+        if len(current) + len(encoded) > limit:
+            parts.append(current)
+            # Continuation lines start with a space, which counts towards their 75
+            current, limit = b'', ICS_LINE_OCTETS - 1
+        current += encoded
+    parts.append(current)
+    return b'\r\n '.join(parts) + b'\r\n'
+
+def _ics_event(visit, stamp):
+    start = pd.Timestamp(visit['upcoming_visit'])
+    end = start + pd.Timedelta(hours=float(visit['visit_duration'] or 1))
+    lines = [
+        'BEGIN:VEVENT',
+        f"UID:{visit['patient_id']}-{start:%Y%m%dT%H%M%S}@reimbursed",
+        f"DTSTAMP:{stamp}",
+        f"DTSTART;TZID={ICS_TIMEZONE}:{start:%Y%m%dT%H%M%S}",
+        f"DTEND;TZID={ICS_TIMEZONE}:{end:%Y%m%dT%H%M%S}",
+        'SUMMARY:' + _ics_escape(f"Study visit: {visit['name']} ({visit['patient_id']})"),
+        'LOCATION:' + _ics_escape(f"{visit['hospital']}, {visit['hospital_address']}"),
+        'DESCRIPTION:' + _ics_escape(f"{visit['study_name']} ({visit['study_id']})"),
+        'END:VEVENT',
+    ]
+    return b''.join(_ics_line(line) for line in lines)
+
+def iter_visit_ics(visits, calendar_name):
+    """Yield an iCalendar feed as UTF-8 byte blocks for an iterable of visit dicts, header first"""
+    stamp = pd.Timestamp.now(tz='UTC').strftime('%Y%m%dT%H%M%SZ')
+    header = [
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        'PRODID:-//ARA//Clinical Trial Reimbursement//EN',
+        'CALSCALE:GREGORIAN',
+        'METHOD:PUBLISH',
+        f"X-WR-CALNAME:{_ics_escape(calendar_name)}",
+        f"X-WR-TIMEZONE:{ICS_TIMEZONE}",
+        'BEGIN:VTIMEZONE',
+        f"TZID:{ICS_TIMEZONE}",
+        'BEGIN:STANDARD',
+        'DTSTART:19700101T000000',
+        'TZOFFSETFROM:+0800',
+        'TZOFFSETTO:+0800',
+        'TZNAME:AWST',
+        'END:STANDARD',
+        'END:VTIMEZONE',
+    ]
+    yield b''.join(_ics_line(line) for line in header)
+    block = []
+    for visit in visits:
+        block.append(_ics_event(visit, stamp))
+        if len(block) == ICS_EVENTS_PER_BLOCK:
+            yield b''.join(block)
+            block = []
+    block.append(_ics_line('END:VCALENDAR'))
+    yield b''.join(block)
@@ -0,0 +1,195 @@
+"""Visit history: every visit a participant makes, in month partitions, with running totals
+
+The patients table holds each participant's current visit. Every visit written there is also
+written to visits_YYYY_MM, the partition for its month, and stays there once the participant
+moves on to their next visit. Visits, kilometres and reimbursement per patient, per study and
+per month, by claim status, are kept in visit_rollups and adjusted in the same transaction as
+each visit write, so dashboards read a few rollup rows instead of scanning history.
+
+Visits are priced when they are written, with the rates in effect on the visit date.
+"""
+import json
+
+import pandas as pd
+
+from .reimbursement import calculate_reimbursements
+from .schema import VISIT_SCHEMA, apply_schema, kilometres
+
+VISIT_COLUMNS = [
+    'patient_id', 'study_id', 'visit_date', 'visit_duration', 'hospital', 'transport_method',
+    'distance', 'fare', 'status', 'receipts', 'amount'
+]
+# Rollup scope -> the visit column it totals by
+ROLLUP_SCOPES = {'patient': 'patient_id', 'study': 'study_id', 'month': 'month'}
+# Visits without a date still need a partition
+UNDATED = 'undated'
+
+def _partition_table(month):
+    return f"visits_{month.replace('-', '_')}"
+
+class VisitHistory:
+    """Month-partitioned visits and their rollups, on a connection owned by PatientStore
+
+    Writes expect to run inside the store's transaction and under its lock; they take patient
+    frames as returned by PatientStore.select.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS visit_partitions (month TEXT PRIMARY KEY);
+    CREATE TABLE IF NOT EXISTS visit_rollups (
+        scope TEXT NOT NULL,
+        key TEXT NOT NULL,
+        status TEXT NOT NULL,
+        visits INTEGER NOT NULL,
+        km REAL NOT NULL,
+        amount REAL NOT NULL,
+        PRIMARY KEY (scope, key, status)
+    );
+    """
+
+    PARTITION_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS {table} (
+        patient_id TEXT NOT NULL,
+        study_id TEXT,
+        visit_date TEXT NOT NULL,
+        visit_duration INTEGER,
+        hospital TEXT,
+        transport_method TEXT,
+        distance REAL,
+        fare REAL NOT NULL DEFAULT 0,
+        status TEXT NOT NULL,
+        receipts TEXT NOT NULL DEFAULT '[]',
+        amount REAL NOT NULL,
+        PRIMARY KEY (patient_id, visit_date)
+    )
+    """
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def partitions(self):
+        """Months with a partition, oldest first ('undated' last)"""
+        # Read each time rather than cached: another process may have opened a new month
+        months = [row[0] for row in self._conn.execute("SELECT month FROM visit_partitions ORDER BY month")]
+        return sorted(months, key=lambda month: (month == UNDATED, month))
+
+    def _ensure_partition(self, month):
+        # Plain execute, not executescript, which would commit the caller's transaction
+        table = _partition_table(month)
+        self._conn.execute(self.PARTITION_SCHEMA.format(table=table))
+        self._conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_study_id ON {table} (study_id)")
+        self._conn.execute("INSERT OR IGNORE INTO visit_partitions (month) VALUES (?)", (month,))
+
+    @staticmethod
+    def _visits(patients):
+        """One visit row per patient, priced, with the month it is partitioned under"""
+        visit_date = pd.to_datetime(patients['upcoming_visit'])
+        return pd.DataFrame({
+            'patient_id': patients['patient_id'],
+            'study_id': patients['study_id'],
+            'visit_date': visit_date.dt.strftime('%Y-%m-%d %H:%M:%S').fillna(''),
+            'visit_duration': patients['visit_duration'],
+            'hospital': patients['hospital'],
+            'transport_method': patients['transport_method'],
+            'distance': kilometres(patients['distance']),
+            'fare': patients['fare'].astype(float),
+            'status': patients['status'],
+            'receipts': patients['receipts'].map(lambda receipts: json.dumps(list(receipts))),
+            'amount': calculate_reimbursements(patients)['total'].round(2),
+            'month': visit_date.dt.strftime('%Y-%m').fillna(UNDATED),
+        }, index=patients.index)
+
+    def _roll_up(self, visits, sign):
+        deltas = [
+            visits.groupby([column, 'status'], observed=True).agg(
+                visits=('patient_id', 'size'), km=('distance', 'sum'), amount=('amount', 'sum')
+            ).reset_index().rename(columns={column: 'key'}).assign(scope=scope)
+            for scope, column in ROLLUP_SCOPES.items()
+        ]
+        delta = pd.concat(deltas, ignore_index=True)
+        self._conn.executemany(
+            """INSERT INTO visit_rollups (scope, key, status, visits, km, amount) VALUES (?, ?, ?, ?, ?, ?)
+               ON CONFLICT (scope, key, status) DO UPDATE SET
+                   visits = visits + excluded.visits, km = km + excluded.km, amount = amount + excluded.amount""",
+            zip(delta['scope'], delta['key'], delta['status'], (delta['visits'] * sign).tolist(),
+                (delta['km'] * sign).tolist(), (delta['amount'] * sign).tolist())
+        )
+        self._conn.execute("DELETE FROM visit_rollups WHERE visits = 0")
+
+    def record(self, patients):
+        """Add the current visit of each patient"""
+        if patients.empty:
+            return
+        visits = self._visits(patients)
+        for month, rows in visits.groupby('month'):
+            self._ensure_partition(month)
+            table = _partition_table(month)
+            self._conn.executemany(
+                f"INSERT INTO {table} ({', '.join(VISIT_COLUMNS)}) VALUES ({', '.join('?' * len(VISIT_COLUMNS))})",
+                rows[VISIT_COLUMNS].itertuples(index=False, name=None)
+            )
+        self._roll_up(visits, 1)
+
+    def remove(self, patients):
+        """Drop the current visit of each patient (as it was before any change)"""
+        if patients.empty:
+            return
+        visits = self._visits(patients)
+        for month, rows in visits.groupby('month'):
+            self._conn.executemany(
+                f"DELETE FROM {_partition_table(month)} WHERE patient_id = ? AND visit_date = ?",
+                zip(rows['patient_id'], rows['visit_date'])
+            )
+        self._roll_up(visits, -1)
+
+    def replace(self, before, after):
+        """Rewrite visits that changed: before and after are the same patients' rows either side of the change"""
+        self.remove(before)
+        self.record(after)
+
+    def rebuild(self, chunks):
+        """Drop every partition and rollup and record the current visits in chunks (a patient frame iterator)"""
+        for month in self.partitions():
+            self._conn.execute(f"DROP TABLE IF EXISTS {_partition_table(month)}")
+        self._conn.execute("DELETE FROM visit_partitions")
+        self._conn.execute("DELETE FROM visit_rollups")
+        for chunk in chunks:
+            self.record(chunk)
+
+    def select(self, patient_id=None, visit_from=None, visit_to=None):
+        """Visits across the partitions the date range touches, oldest first; visit_to is exclusive"""
+        months = self.partitions()
+        if visit_from is not None or visit_to is not None:
+            first = pd.Timestamp(visit_from).strftime('%Y-%m') if visit_from is not None else ''
+            last = pd.Timestamp(visit_to).strftime('%Y-%m') if visit_to is not None else '9999-12'
+            months = [month for month in months if month != UNDATED and first <= month <= last]
+        clauses, params = [], []
+        if patient_id is not None:
+            clauses.append("patient_id = ?")
+            params.append(patient_id)
+        if visit_from is not None:
+            clauses.append("visit_date >= ?")
+            params.append(pd.Timestamp(visit_from).strftime('%Y-%m-%d %H:%M:%S'))
+        if visit_to is not None:
+            clauses.append("visit_date < ?")
+            params.append(pd.Timestamp(visit_to).strftime('%Y-%m-%d %H:%M:%S'))
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = []
+        for month in months:
+            rows.extend(self._conn.execute(
+                f"SELECT {', '.join(VISIT_COLUMNS)} FROM {_partition_table(month)}{where} ORDER BY visit_date", params
+            ).fetchall())
+        visits = pd.DataFrame(rows, columns=VISIT_COLUMNS)
+        visits['visit_date'] = visits['visit_date'].mask(visits['visit_date'] == '')
+        return apply_schema(visits, VISIT_SCHEMA)
+
+    def rollups(self, scope, key=None):
+        """Totals for one scope ('patient', 'study' or 'month'): key, status, visits, km, amount"""
+        if scope not in ROLLUP_SCOPES:
+            raise ValueError(f"unknown rollup scope {scope!r}")
+        sql, params = "SELECT key, status, visits, km, amount FROM visit_rollups WHERE scope = ?", [scope]
+        if key is not None:
+            sql += " AND key = ?"
+            params.append(key)
+        rows = self._conn.execute(sql + " ORDER BY key, status", params).fetchall()
+        return pd.DataFrame(rows, columns=['key', 'status', 'visits', 'km', 'amount'])
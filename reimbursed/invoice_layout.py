@@ -0,0 +1,164 @@
+from xml.sax.saxutils import escape
+
+import pandas as pd
+from reportlab.lib.pagesizes import letter
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, PageBreak, Image, Flowable
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.units import inch
+from reportlab.lib import colors
+
+from .rates import get_rate_rules
+from .reimbursement import calculate_reimbursements
+from .receipts import get_receipt_store, receipt_name
+from .schema import format_km
+
+# Styles are built once per process and shared by every invoice
+STYLES = getSampleStyleSheet()
+
+TITLE_STYLE = ParagraphStyle(
+    'CustomTitle',
+    parent=STYLES['Heading1'],
+    fontSize=24,
+    textColor=colors.purple,
+    alignment=1
+)
+
+PATIENT_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (0, -1), colors.lightgrey),
+    ('TEXTCOLOR', (0, 0), (-1, -1), colors.black),
+    ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+    ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
+    ('FONTSIZE', (0, 0), (-1, -1), 10),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 12),
+    ('BACKGROUND', (1, 0), (1, -1), colors.beige),
+    ('GRID', (0, 0), (-1, -1), 1, colors.black)
+])
+
+REIMBURSEMENT_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (0, -1), colors.lightgrey),
+    ('BACKGROUND', (0, -1), (-1, -1), colors.purple),
+    ('TEXTCOLOR', (0, -1), (-1, -1), colors.white),
+    ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
+    ('ALIGN', (1, 0), (1, -1), 'RIGHT'),
+    ('FONTNAME', (0, 0), (-1, -2), 'Helvetica'),
+    ('FONTSIZE', (0, 0), (-1, -1), 10),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 12),
+    ('GRID', (0, 0), (-1, -1), 1, colors.black)
+])
+
+BANKING_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (0, -1), colors.lightgrey),
+    ('GRID', (0, 0), (-1, -1), 1, colors.black),
+    ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
+    ('FONTSIZE', (0, 0), (-1, -1), 10),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 12)
+])
+
+RECEIPT_IMAGE_WIDTH = 3 * inch
+RECEIPT_IMAGE_HEIGHT = 4 * inch
+
+def build_invoice_story(patient_data):
+    """Flowables for one patient's invoice page"""
+    story = []
+    
+    # Title
+    story.append(Paragraph("CLINICAL TRIAL REIMBURSEMENT INVOICE", TITLE_STYLE))
+    story.append(Spacer(1, 12))
+    
+    # Patient details
+    patient_info = [
+        ['Patient ID:', patient_data['patient_id']],
+        ['Patient Name:', patient_data['name']],
+        ['Study:', patient_data['study_name']],
+        ['Visit Date:', patient_data['upcoming_visit'].strftime('%Y-%m-%d')],
+        ['Transport Method:', patient_data['transport_method'].title()],
+        ['Distance:', f"{format_km(patient_data['distance'])}km"],
+        ['Duration:', f"{patient_data['visit_duration']} hours"]
+    ]
+    
+    patient_table = Table(patient_info, colWidths=[2*inch, 4*inch])
+    patient_table.setStyle(PATIENT_TABLE_STYLE)
+    
+    story.append(patient_table)
+    story.append(Spacer(1, 12))
+    
+    # Reimbursement calculation
+    claim = pd.DataFrame([patient_data])
+    reimbursement = calculate_reimbursements(claim).iloc[0]
+    rates = get_rate_rules().rates_for(claim).fillna(0).iloc[0]
+    
+    reimbursement_info = [
+        [f"KM Reimbursement ({rates['km_rate'] * 100:.0f}¢/km):", f"${reimbursement['km_cost']:.2f}"],
+        [f"Meal Allowance (>{rates['meal_min_hours']:g}hrs):", f"${reimbursement['meal_allowance']:.2f}"]
+    ]
+    if rates['fare_at_cost']:
+        reimbursement_info.append(['Fare (at cost):', f"${reimbursement['fare_cost']:.2f}"])
+    reimbursement_info.append(['TOTAL REIMBURSEMENT:', f"${reimbursement['total']:.2f}"])
+    
+    reimbursement_table = Table(reimbursement_info, colWidths=[3*inch, 2*inch])
+    reimbursement_table.setStyle(REIMBURSEMENT_TABLE_STYLE)
+    
+    story.append(reimbursement_table)
+    story.append(Spacer(1, 12))
+    
+    # Banking details
+    story.append(Paragraph("BANKING DETAILS", STYLES['Heading2']))
+    banking_info = [
+        ['BSB:', patient_data['bsb']],
+        ['Account Number:', patient_data['account_number']],
+        ['Account Name:', patient_data['name']]
+    ]
+    
+    banking_table = Table(banking_info, colWidths=[2*inch, 4*inch])
+    banking_table.setStyle(BANKING_TABLE_STYLE)
+    
+    story.append(banking_table)
+    
+    # Receipts section
+    story.append(Spacer(1, 12))
+    story.append(Paragraph("ATTACHED RECEIPTS", STYLES['Heading2']))
+    if patient_data['receipts']:
+        receipt_store = get_receipt_store()
+        for receipt in patient_data['receipts']:
+            # Paragraph text is markup; an uploaded file name such as 'a<b>.png' must not be parsed as tags
+            story.append(Paragraph(f"• {escape(receipt_name(receipt))}", STYLES['Normal']))
+            # Image receipts are embedded from their downscaled JPEG rendition
+            image_path = receipt_store.rendition_path(receipt)
+            if image_path:
+                story.append(Image(image_path, width=RECEIPT_IMAGE_WIDTH, height=RECEIPT_IMAGE_HEIGHT, kind='proportional'))
+                story.append(Spacer(1, 6))
+    else:
+        story.append(Paragraph("No receipts attached", STYLES['Normal']))
+    
+    return story
+
+def build_invoice_document(story, fileobj):
+    SimpleDocTemplate(fileobj, pagesize=letter).build(story)
+
+class _StoryDrawn(Flowable):
+    """Zero-size marker after a story that calls on_drawn(number) once the build has laid it out"""
+
+    def __init__(self, number, on_drawn):
+        super().__init__()
+        self.number = number
+        self.on_drawn = on_drawn
+
+    def wrap(self, available_width, available_height):
+        return 0, 0
+
+    def draw(self):
+        self.on_drawn(self.number)
+
+def build_merged_document(stories, fileobj, on_story_drawn=None):
+    """One document with each story on its own page, built in a single pass
+
+    on_story_drawn(n) is called as the build finishes the nth story (from 1), so a long build can report progress.
+    """
+    merged = []
+    for number, story in enumerate(stories, start=1):
+        if merged:
+            merged.append(PageBreak())
+        merged.extend(story)
+        if on_story_drawn:
+            merged.append(_StoryDrawn(number, on_story_drawn))
+    build_invoice_document(merged, fileobj)
@@ -0,0 +1,167 @@
+import hashlib
+import io
+import json
+import os
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
+from . import PROJECT_DIR
+from .metrics import get_metrics
+from .rates import get_rate_rules
+from .schema import format_km
+
+# Batches smaller than this are rendered in-process; starting workers costs more than it saves
+PARALLEL_MIN_INVOICES = 16
+
+# Bump when the page layout changes so previously cached PDFs are not served
+INVOICE_LAYOUT_VERSION = 3
+INVOICE_CACHE_DIR = os.environ.get('REIMBURSED_INVOICE_CACHE', os.path.join(PROJECT_DIR, '.invoice_cache'))
+INVOICE_CACHE_MAX_BYTES = int(os.environ.get('REIMBURSED_INVOICE_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+
+def invoice_cache_key(patient_data):
+    """Hash of every field that appears on the invoice, plus the rate rules and layout version"""
+    fields = {
+        'layout': INVOICE_LAYOUT_VERSION,
+        'rates': get_rate_rules().fingerprint,
+        'patient_id': patient_data['patient_id'],
+        'study_id': patient_data.get('study_id'),
+        'name': patient_data['name'],
+        'study_name': patient_data['study_name'],
+        'visit_date': patient_data['upcoming_visit'].strftime('%Y-%m-%d'),
+        'transport_method': patient_data['transport_method'],
+        'distance': format_km(patient_data['distance']),
+        'visit_duration': str(patient_data['visit_duration']),
+        'fare': str(patient_data.get('fare', 0)),
+        'bsb': patient_data['bsb'],
+        'account_number': patient_data['account_number'],
+        'receipts': list(patient_data['receipts'])
+    }
+    return hashlib.sha256(json.dumps(fields, sort_keys=True).encode('utf-8')).hexdigest()
+
+class InvoiceCache:
+    """On-disk PDF cache keyed by content hash, evicting least recently used files past max_bytes"""
+
+    def __init__(self, directory=INVOICE_CACHE_DIR, max_bytes=INVOICE_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._size = sum(entry.stat().st_size for entry in os.scandir(directory) if entry.name.endswith('.pdf'))
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.pdf")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        # Access time drives LRU eviction; touch explicitly as many filesystems mount noatime
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return data
+
+    def put(self, key, data):
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._size += len(data)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        entries = sorted(
+            (entry for entry in os.scandir(self.directory) if entry.name.endswith('.pdf')),
+            key=lambda entry: entry.stat().st_mtime
+        )
+        self._size = sum(entry.stat().st_size for entry in entries)
+        for entry in entries:
+            if self._size <= self.max_bytes:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+                self._size -= size
+            except FileNotFoundError:
+                pass
+
+_invoice_cache = None
+
+def get_invoice_cache():
+    global _invoice_cache
+    if _invoice_cache is None:
+        _invoice_cache = InvoiceCache()
+    return _invoice_cache
+
+def render_invoice_pdf(patient_data):
+    # ReportLab is loaded with the first invoice rather than at app startup
+    from .invoice_layout import build_invoice_document, build_invoice_story
+    buffer = io.BytesIO()
+    with get_metrics().span('invoice_build'):
+        build_invoice_document(build_invoice_story(patient_data), buffer)
+    get_metrics().increment('pdfs_generated_total', kind='invoice')
+    return buffer.getvalue()
+
+def generate_invoice_pdf(patient_data):
+    """Invoice PDF for one patient, served from the on-disk cache when the invoice fields are unchanged"""
+    cache = get_invoice_cache()
+    key = invoice_cache_key(patient_data)
+    pdf_bytes = cache.get(key)
+    get_metrics().increment('cache_requests_total', cache='invoice_pdf')
+    if pdf_bytes is None:
+        get_metrics().increment('cache_misses_total', cache='invoice_pdf')
+        pdf_bytes = render_invoice_pdf(patient_data)
+        cache.put(key, pdf_bytes)
+    return io.BytesIO(pdf_bytes)
+
+def invoice_filename(patient_data):
+    return f"invoice_{patient_data['patient_id']}_{patient_data['name'].replace(' ', '_')}.pdf"
+
+def _render_invoice(patient_data):
+    return invoice_filename(patient_data), generate_invoice_pdf(patient_data).getvalue()
+
+def generate_invoices(patients, max_workers=None):
+    """Yield (filename, pdf_bytes) for every row of patients, in order, rendering across a process pool"""
+    records = patients.to_dict('records')
+    max_workers = max_workers or min(len(records) // PARALLEL_MIN_INVOICES, os.cpu_count() or 1)
+    if max_workers <= 1:
+        for record in records:
+            yield _render_invoice(record)
+        return
+    chunksize = max(1, len(records) // (max_workers * 4))
+    # spawn rather than fork: the Streamlit server process is multi-threaded
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        yield from pool.map(_render_invoice, records, chunksize=chunksize)
+
+def write_invoices_zip(patients, fileobj, progress=None):
+    """Stream every invoice into a ZIP archive written to fileobj; progress(done, total) is called per invoice"""
+    total = len(patients)
+    with zipfile.ZipFile(fileobj, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for done, (filename, pdf_bytes) in enumerate(generate_invoices(patients), start=1):
+            archive.writestr(filename, pdf_bytes)
+            if progress:
+                progress(done, total)
+    return fileobj
+
+def write_merged_invoice_pdf(patients, fileobj, progress=None):
+    """Write every invoice into one multi-page PDF, one invoice per page, with a single document build
+
+    Laying out the pages is the slow part, so progress(done, total) is reported as the build finishes each invoice.
+    """
+    from .invoice_layout import build_invoice_story, build_merged_document
+    total = len(patients)
+    stories = [build_invoice_story(patient) for _, patient in patients.iterrows()]
+    on_story_drawn = (lambda done: progress(done, total)) if progress else None
+    with get_metrics().span('merged_invoice_build'):
+        build_merged_document(stories, fileobj, on_story_drawn=on_story_drawn)
+    get_metrics().increment('pdfs_generated_total', kind='merged')
+    return fileobj
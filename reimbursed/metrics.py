@@ -0,0 +1,124 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+METRIC_PREFIX = 'reimbursed'
+
+class Metrics:
+    """Process-wide timing spans and labelled counters, exportable as Prometheus text or JSON
+
+    A span keeps its call count, total, maximum and most recent duration; counters are plain sums
+    keyed by name and labels. Everything is cheap enough to leave on in production.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last_export = 0.0
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._spans = {}
+            self._counters = {}
+            self.started = time.time()
+
+    @contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def observe(self, name, seconds):
+        with self._lock:
+            stats = self._spans.get(name)
+            if stats is None:
+                self._spans[name] = [1, seconds, seconds, seconds]
+            else:
+                stats[0] += 1
+                stats[1] += seconds
+                stats[2] = max(stats[2], seconds)
+                stats[3] = seconds
+
+    def increment(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def spans(self):
+        """One dict per span: name, count, total, mean, max and last duration in seconds"""
+        with self._lock:
+            return [
+                {'name': name, 'count': count, 'total': total, 'mean': total / count, 'max': longest, 'last': last}
+                for name, (count, total, longest, last) in sorted(self._spans.items())
+            ]
+
+    def counters(self):
+        """One dict per counter: name, labels and value"""
+        with self._lock:
+            return [
+                {'name': name, 'labels': dict(labels), 'value': value}
+                for (name, labels), value in sorted(self._counters.items())
+            ]
+
+    def to_json(self):
+        return json.dumps({
+            'started': self.started,
+            'exported': time.time(),
+            'spans': self.spans(),
+            'counters': self.counters()
+        }, indent=2)
+
+    def to_prometheus(self):
+        lines = []
+        spans = self.spans()
+        if spans:
+            lines.append(f"# TYPE {METRIC_PREFIX}_span_seconds summary")
+            for span in spans:
+                label = _prometheus_labels({'span': span['name']})
+                lines.append(f"{METRIC_PREFIX}_span_seconds_count{label} {span['count']}")
+                lines.append(f"{METRIC_PREFIX}_span_seconds_sum{label} {span['total']:.6f}")
+            lines.append(f"# TYPE {METRIC_PREFIX}_span_seconds_max gauge")
+            for span in spans:
+                lines.append(f"{METRIC_PREFIX}_span_seconds_max{_prometheus_labels({'span': span['name']})} {span['max']:.6f}")
+        declared = set()
+        for counter in self.counters():
+            name = f"{METRIC_PREFIX}_{counter['name']}"
+            if name not in declared:
+                lines.append(f"# TYPE {name} counter")
+                declared.add(name)
+            lines.append(f"{name}{_prometheus_labels(counter['labels'])} {counter['value']}")
+        return '\n'.join(lines) + '\n'
+
+    def export(self, path, min_interval=0):
+        """Write the metrics to path, as JSON for a .json path and Prometheus text otherwise
+
+        Skipped if the last export was less than min_interval seconds ago. The file is replaced
+        atomically so a scraper never reads a partial write.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_export < min_interval:
+                return False
+            self._last_export = now
+        text = self.to_json() if path.endswith('.json') else self.to_prometheus()
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+        return True
+
+def _prometheus_labels(labels):
+    if not labels:
+        return ''
+    escape = lambda value: str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{key}="{escape(value)}"' for key, value in sorted(labels.items())) + '}'
+
+# Created at import so every thread and module shares the one instance
+_metrics = Metrics()
+
+def get_metrics():
+    return _metrics
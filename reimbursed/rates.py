@@ -0,0 +1,165 @@
+"""Reimbursement rate rules, per study and transport method, by effective date
+
+Rules are rows of data/rate_rules.csv, or of the file named by REIMBURSED_RATE_RULES:
+
+    study_id,transport_method,effective_from,km_rate,meal_allowance,meal_min_hours,fare_at_cost
+    *,*,2000-01-01,0.44,25,3,false
+    ONCOLOGY-2024-007,taxi,2026-07-01,0,30,3,true
+
+A claim is priced by the latest rule in effect on its visit date, trying in turn its study and
+transport method, the default ('*') study's rule for its transport method, its study's '*' rule,
+then the '*','*' default, which is required. So a study-wide rate does not start paying public
+transport unless the study also has a public rule. Claims with no rule in effect yet on their visit date are
+priced at zero. With fare_at_cost the claim's recorded fare is reimbursed on top of any km rate.
+"""
+import hashlib
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from .schema import kilometres
+
+RATE_RULES_PATH = os.environ.get(
+    'REIMBURSED_RATE_RULES', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'rate_rules.csv')
+)
+RATE_COLUMNS = ['km_rate', 'meal_allowance', 'meal_min_hours']
+RULE_COLUMNS = ['study_id', 'transport_method', 'effective_from'] + RATE_COLUMNS + ['fare_at_cost']
+WILDCARD = '*'
+
+# Rules are searched on one integer key per (group, day); days are offset so the key stays non-negative
+DAY_SPAN = 1 << 20
+DAY_OFFSET = DAY_SPAN // 2
+
+def _codes(index, values, size):
+    """Position of each value in index, -1 where absent; each distinct value is looked up once"""
+    if values is None:
+        return np.full(size, -1)
+    codes, uniques = pd.factorize(values)
+    # A trailing -1 so missing values (code -1) map to -1 too
+    positions = np.append(index.get_indexer(uniques), -1)
+    return positions[codes]
+
+def _days(dates):
+    """Days since the epoch, offset into [0, DAY_SPAN); missing dates sort after every rule"""
+    days = pd.to_datetime(pd.Series(dates)).to_numpy(dtype='datetime64[D]')
+    missing = np.isnat(days)
+    days = np.clip(days.astype(np.int64) + DAY_OFFSET, 0, DAY_SPAN - 1)
+    days[missing] = DAY_SPAN - 1
+    return days
+
+class RateRules:
+    """Rate rules compiled for vectorised pricing
+
+    Every (study, transport method) pair is a group. Rules are sorted into one array of integer
+    keys, group then effective day, so finding the rule for a whole DataFrame of claims is one
+    binary search per fallback level.
+    """
+
+    def __init__(self, rules):
+        rules = self.validate(rules)
+        self._studies = pd.Index(sorted(rules['study_id'].unique()))
+        self._transports = pd.Index(sorted(rules['transport_method'].unique()))
+        groups = self._group(self._studies.get_indexer(rules['study_id']),
+                             self._transports.get_indexer(rules['transport_method']))
+        keys = groups * DAY_SPAN + _days(rules['effective_from'])
+        order = np.argsort(keys, kind='stable')
+        self.rules = rules.iloc[order].reset_index(drop=True)
+        self._keys = keys[order]
+        self._groups = groups[order]
+        self._rates = self.rules[RATE_COLUMNS].to_numpy(dtype=float)
+        self._fare_at_cost = self.rules['fare_at_cost'].to_numpy(dtype=bool)
+        self.fingerprint = hashlib.sha256(self.rules.to_csv(index=False).encode('utf-8')).hexdigest()
+
+    @classmethod
+    def from_csv(cls, path=RATE_RULES_PATH):
+        return cls(pd.read_csv(path, dtype={'study_id': str, 'transport_method': str}))
+
+    @staticmethod
+    def validate(rules):
+        missing = [column for column in RULE_COLUMNS if column not in rules]
+        if missing:
+            raise ValueError(f"rate rules are missing column(s): {', '.join(missing)}")
+        rules = rules[RULE_COLUMNS].copy()
+        rules['study_id'] = rules['study_id'].astype(str).str.strip()
+        rules['transport_method'] = rules['transport_method'].astype(str).str.strip().str.lower()
+        rules['effective_from'] = pd.to_datetime(rules['effective_from'], format='%Y-%m-%d', errors='coerce')
+        if rules['effective_from'].isna().any():
+            raise ValueError("rate rules need an effective_from date (YYYY-MM-DD) on every rule")
+        for column in RATE_COLUMNS:
+            rules[column] = pd.to_numeric(rules[column], errors='coerce')
+            if rules[column].isna().any() or (rules[column] < 0).any():
+                raise ValueError(f"rate rule {column} must be a non-negative number")
+        at_cost = rules['fare_at_cost'].astype(str).str.strip().str.lower()
+        if not at_cost.isin(['true', 'false', '1', '0']).all():
+            raise ValueError("rate rule fare_at_cost must be true or false")
+        rules['fare_at_cost'] = at_cost.isin(['true', '1'])
+        if rules.duplicated(['study_id', 'transport_method', 'effective_from']).any():
+            raise ValueError("rate rules have more than one rule for a study, transport method and date")
+        if not ((rules['study_id'] == WILDCARD) & (rules['transport_method'] == WILDCARD)).any():
+            raise ValueError("rate rules need a default rule for study '*' and transport method '*'")
+        return rules
+
+    def _group(self, study_codes, transport_codes):
+        return study_codes * len(self._transports) + transport_codes
+
+    def lookup(self, claims):
+        """Position in self.rules of the rule pricing each claim, -1 where none is in effect"""
+        size = len(claims)
+        studies = _codes(self._studies, claims.get('study_id'), size)
+        transports = _codes(self._transports, claims.get('transport_method'), size)
+        days = _days(claims['upcoming_visit']) if 'upcoming_visit' in claims else np.full(size, DAY_SPAN - 1)
+        any_study = np.full(size, self._studies.get_loc(WILDCARD))
+        any_transport = np.full(size, self._transports.get_loc(WILDCARD))
+
+        rule = np.full(size, -1)
+        for study, transport in ((studies, transports), (any_study, transports),
+                                 (studies, any_transport), (any_study, any_transport)):
+            pending = np.flatnonzero((rule < 0) & (study >= 0) & (transport >= 0))
+            if pending.size == 0:
+                continue
+            groups = self._group(study[pending], transport[pending])
+            found = np.searchsorted(self._keys, groups * DAY_SPAN + days[pending], side='right') - 1
+            matched = (found >= 0) & (self._groups[np.maximum(found, 0)] == groups)
+            rule[pending[matched]] = found[matched]
+        return rule
+
+    def rates_for(self, claims):
+        """The rates applied to each claim, index-aligned with claims; NaN where no rule is in effect"""
+        rule = self.lookup(claims)
+        rates = self.rules.reindex(rule)
+        rates.index = claims.index
+        return rates
+
+    def price(self, claims):
+        """km_cost, meal_allowance, fare_cost and total for every row of claims"""
+        rule = self.lookup(claims)
+        known = rule >= 0
+        rates = np.where(known[:, None], self._rates[np.maximum(rule, 0)], 0.0)
+        km_rate, meal_allowance, meal_min_hours = rates.T
+        fare_at_cost = known & self._fare_at_cost[np.maximum(rule, 0)]
+
+        distance = kilometres(claims['distance'])
+        duration = claims['visit_duration'].to_numpy(dtype=float)
+        fare = np.nan_to_num(claims['fare'].to_numpy(dtype=float)) if 'fare' in claims else np.zeros(len(claims))
+        km_cost = distance * km_rate
+        meal = np.where(duration > meal_min_hours, meal_allowance, 0.0)
+        fare_cost = np.where(fare_at_cost, fare, 0.0)
+        return pd.DataFrame({
+            'km_cost': km_cost,
+            'meal_allowance': meal,
+            'fare_cost': fare_cost,
+            'total': km_cost + meal + fare_cost
+        }, index=claims.index)
+
+_rate_rules = None
+_rate_rules_lock = threading.Lock()
+
+def get_rate_rules():
+    """The process's compiled rate rules; the rules file is read once, on first use"""
+    global _rate_rules
+    with _rate_rules_lock:
+        if _rate_rules is None:
+            _rate_rules = RateRules.from_csv()
+    return _rate_rules
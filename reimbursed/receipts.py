@@ -0,0 +1,136 @@
+import hashlib
+import io
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageOps
+
+from . import PROJECT_DIR
+
+RECEIPT_STORE_DIR = os.environ.get('REIMBURSED_RECEIPTS', os.path.join(PROJECT_DIR, 'receipt_store'))
+
+# Renditions kept for every image receipt: (longest side in px, JPEG quality)
+DISPLAY_SIZE = (1200, 75)
+THUMBNAIL_SIZE = (256, 70)
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tif', '.tiff', '.webp'}
+
+def receipt_ref(digest, filename):
+    return f"{digest}/{filename}"
+
+def parse_receipt(ref):
+    """(digest, filename) for a stored receipt reference; digest is None for legacy filename-only receipts"""
+    digest, sep, filename = str(ref).partition('/')
+    if sep and len(digest) == 64 and all(c in '0123456789abcdef' for c in digest):
+        return digest, filename
+    return None, str(ref)
+
+def receipt_name(ref):
+    return parse_receipt(ref)[1]
+
+class ReceiptStore:
+    """Content-addressed receipt files on local disk
+
+    Originals are stored under their SHA-256, so the same file uploaded twice is kept once. Image
+    receipts are downscaled to a display rendition and a thumbnail on a background thread pool;
+    readers load renditions lazily and can wait for one still being processed.
+    """
+
+    def __init__(self, root=RECEIPT_STORE_DIR, max_workers=2):
+        self.root = root
+        for sub in ('original', 'display', 'thumb'):
+            os.makedirs(os.path.join(root, sub), exist_ok=True)
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='receipts')
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def _path(self, kind, digest, ext='.jpg'):
+        return os.path.join(self.root, kind, digest[:2], digest + ext)
+
+    def _original_path(self, digest):
+        directory = os.path.join(self.root, 'original', digest[:2])
+        if os.path.isdir(directory):
+            for name in os.listdir(directory):
+                if name.startswith(digest):
+                    return os.path.join(directory, name)
+        return None
+
+    @staticmethod
+    def _write(path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def put(self, data, filename):
+        """Store an upload and queue its renditions; returns the receipt reference"""
+        digest = hashlib.sha256(data).hexdigest()
+        ext = os.path.splitext(filename)[1].lower()
+        if self._original_path(digest) is None:
+            self._write(self._path('original', digest, ext), data)
+        if ext in IMAGE_EXTENSIONS and not os.path.exists(self._path('thumb', digest)):
+            with self._lock:
+                if digest not in self._pending:
+                    self._pending[digest] = self._pool.submit(self._render, digest, data)
+        return receipt_ref(digest, filename)
+
+    def _render(self, digest, data):
+        try:
+            with Image.open(io.BytesIO(data)) as image:
+                image = ImageOps.exif_transpose(image).convert('RGB')
+                for kind, (size, quality) in (('display', DISPLAY_SIZE), ('thumb', THUMBNAIL_SIZE)):
+                    rendition = image.copy()
+                    rendition.thumbnail((size, size))
+                    buffer = io.BytesIO()
+                    rendition.save(buffer, format='JPEG', quality=quality, optimize=True)
+                    self._write(self._path(kind, digest), buffer.getvalue())
+        finally:
+            with self._lock:
+                self._pending.pop(digest, None)
+
+    def wait(self, digest, timeout=None):
+        with self._lock:
+            future = self._pending.get(digest)
+        if future is not None:
+            future.result(timeout=timeout)
+
+    def rendition_path(self, ref, kind='display', wait=True):
+        """Path to a receipt's JPEG rendition, or None for legacy or non-image receipts"""
+        digest, _ = parse_receipt(ref)
+        if digest is None:
+            return None
+        if wait:
+            try:
+                self.wait(digest)
+            except Exception:
+                return None
+        path = self._path(kind, digest)
+        return path if os.path.exists(path) else None
+
+    def thumbnail(self, ref, wait=False):
+        """Thumbnail JPEG bytes, or None if there is none (yet)"""
+        path = self.rendition_path(ref, kind='thumb', wait=wait)
+        if path is None:
+            return None
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def original(self, ref):
+        digest, _ = parse_receipt(ref)
+        path = self._original_path(digest) if digest else None
+        if path is None:
+            return None
+        with open(path, 'rb') as f:
+            return f.read()
+
+_receipt_store = None
+_receipt_store_lock = threading.Lock()
+
+def get_receipt_store():
+    global _receipt_store
+    with _receipt_store_lock:
+        if _receipt_store is None:
+            _receipt_store = ReceiptStore()
+    return _receipt_store
@@ -0,0 +1,19 @@
+import pandas as pd
+
+from .metrics import get_metrics
+from .rates import get_rate_rules
+
+def calculate_reimbursements(df):
+    """Vectorised reimbursement breakdown (km_cost, meal_allowance, fare_cost, total) for every row of df
+
+    Rates come from the study's rate rules in effect on each visit date; see rates.py.
+    """
+    with get_metrics().span('reimbursement_calc'):
+        return get_rate_rules().price(df)
+
+def calculate_reimbursement(transport_method, distance, duration, study_id=None, visit_date=None, fare=0):
+    row = pd.DataFrame({
+        'study_id': [study_id], 'upcoming_visit': [visit_date], 'transport_method': [transport_method],
+        'distance': [distance], 'visit_duration': [duration], 'fare': [fare]
+    })
+    return float(calculate_reimbursements(row)['total'].iloc[0])
@@ -0,0 +1,109 @@
+import bisect
+import threading
+
+import pandas as pd
+
+SCHEDULE_FIELDS = [
+    'patient_id', 'name', 'study_id', 'study_name', 'hospital', 'hospital_address', 'upcoming_visit', 'visit_duration'
+]
+
+class VisitSchedule:
+    """Upcoming visits in time order, maintained as patients are added, change status or book their next visit
+
+    Keys are (visit time in ns, patient_id) tuples held in a sorted list, so next-N and date-range
+    queries are a bisection plus a slice; the visit details are kept per patient beside them.
+    Only patients with status 'upcoming' and a visit date are scheduled.
+    """
+
+    def __init__(self, patients=None):
+        self._lock = threading.Lock()
+        self._keys = []
+        self._visits = {}
+        if patients is not None:
+            self.add(patients)
+
+    def __len__(self):
+        return len(self._keys)
+
+    @staticmethod
+    def _upcoming(patients):
+        return patients[(patients['status'] == 'upcoming') & patients['upcoming_visit'].notna()]
+
+    @staticmethod
+    def _time(value):
+        return pd.Timestamp(value).value
+
+    def add(self, patients):
+        upcoming = self._upcoming(patients)
+        if upcoming.empty:
+            return
+        records = upcoming[SCHEDULE_FIELDS].to_dict('records')
+        keys = [(self._time(record['upcoming_visit']), record['patient_id']) for record in records]
+        with self._lock:
+            for key, record in zip(keys, records):
+                self._remove_locked(record['patient_id'])
+                self._visits[record['patient_id']] = (key, record)
+            if len(keys) > 64:
+                # Timsort merges the new run into the sorted list in near-linear time
+                self._keys.extend(keys)
+                self._keys.sort()
+            else:
+                for key in keys:
+                    bisect.insort(self._keys, key)
+
+    def _remove_locked(self, patient_id):
+        entry = self._visits.pop(patient_id, None)
+        if entry is not None:
+            position = bisect.bisect_left(self._keys, entry[0])
+            del self._keys[position]
+
+    def remove(self, patients):
+        with self._lock:
+            for patient_id in patients['patient_id']:
+                self._remove_locked(patient_id)
+
+    def update_status(self, patients, new_status):
+        """Apply a status change to patients (as they were before it)"""
+        if new_status == 'upcoming':
+            self.add(patients.assign(status=new_status))
+        else:
+            self.remove(patients)
+
+    def _scan(self, start, end, filters, batch_size=256):
+        # Walks the index a batch at a time, resuming after the last key seen, so a long scan
+        # holds the lock only briefly and writes between batches cannot shift its position
+        after = None if start is None else (self._time(start), '')
+        end = None if end is None else (self._time(end), '')
+        while True:
+            with self._lock:
+                first = 0 if after is None else bisect.bisect_right(self._keys, after)
+                last = len(self._keys) if end is None else bisect.bisect_left(self._keys, end)
+                keys = self._keys[first:min(first + batch_size, last)]
+                visits = [self._visits[patient_id][1] for _, patient_id in keys]
+            if not keys:
+                return
+            after = keys[-1]
+            for visit in visits:
+                if all(visit[field] == value for field, value in filters.items()):
+                    yield visit
+
+    def iter_between(self, start=None, end=None, **filters):
+        """Visit dicts from start (inclusive) to end (exclusive) in time order; filters are field=value"""
+        return self._scan(start, end, filters)
+
+    def between(self, start=None, end=None, **filters):
+        return pd.DataFrame(list(self._scan(start, end, filters)), columns=SCHEDULE_FIELDS)
+
+    def next(self, n=1, after=None, **filters):
+        """The first n visits at or after after (every upcoming visit when None), as a DataFrame"""
+        visits = []
+        for visit in self._scan(after, None, filters):
+            visits.append(visit)
+            if len(visits) == n:
+                break
+        return pd.DataFrame(visits, columns=SCHEDULE_FIELDS)
+
+    def values(self, field):
+        """Distinct values of field across scheduled visits, sorted"""
+        with self._lock:
+            return sorted({record[field] for _, record in self._visits.values()})
@@ -0,0 +1,126 @@
+"""Declared dtypes for patient and visit frames, applied and checked wherever rows are loaded
+
+Statuses and transport methods are categoricals over fixed vocabularies; hospitals and studies
+are categoricals over whatever values the rows hold, so each distinct name is stored once and a
+filter compares small integer codes. Ages and visit hours are whole numbers held in int8, and
+kilometres are float32 (offline estimates are fractional). Receipts are tuples, with every claim
+that has none sharing the one empty tuple.
+
+Loading rows that do not fit the schema raises SchemaError rather than quietly widening a dtype.
+"""
+import json
+
+import numpy as np
+import pandas as pd
+
+STATUSES = ['upcoming', 'completed', 'approved', 'paid', 'rejected']
+TRANSPORT_METHODS = ['car', 'taxi', 'public']
+
+# column -> dtype; a list is a categorical over exactly those values, 'category' one over the values present
+PATIENT_SCHEMA = {
+    'study_id': 'category',
+    'study_name': 'category',
+    'age': 'int8',
+    'upcoming_visit': 'datetime64[us]',
+    'visit_duration': 'int8',
+    'hospital': 'category',
+    'hospital_address': 'category',
+    'transport_method': TRANSPORT_METHODS,
+    'distance': 'float32',
+    'status': STATUSES,
+    'receipts': 'receipts',
+    'fare': 'float64',
+}
+VISIT_SCHEMA = {
+    'study_id': 'category',
+    'visit_date': 'datetime64[us]',
+    'visit_duration': 'int8',
+    'hospital': 'category',
+    'transport_method': TRANSPORT_METHODS,
+    'distance': 'float32',
+    'status': STATUSES,
+    'receipts': 'receipts',
+    'amount': 'float64',
+}
+# Columns that may not be missing
+REQUIRED = {'patient_id', 'name', 'status', 'age', 'visit_duration', 'distance', 'receipts', 'fare', 'amount'}
+
+NO_RECEIPTS = ()
+
+# float32 holds a distance to about 7 significant figures; rounding to the metre recovers the value written
+DISTANCE_DECIMALS = 3
+
+class SchemaError(ValueError):
+    """Rows that do not match the declared schema"""
+
+def _examples(values):
+    return ', '.join(repr(value) for value in values.drop_duplicates().head(3).tolist())
+
+def decode_receipts(text):
+    """A stored JSON receipt list as a tuple; claims without receipts share NO_RECEIPTS"""
+    if not text or text == '[]':
+        return NO_RECEIPTS
+    return tuple(json.loads(text))
+
+def kilometres(values):
+    """Distances as float64 for pricing, totals and export, without float32 representation error"""
+    return np.round(np.asarray(values, dtype='float64'), DISTANCE_DECIMALS)
+
+def format_km(value):
+    """One distance as text, e.g. 8.2 rather than 8.199999809265137"""
+    return f"{round(float(value), DISTANCE_DECIMALS):g}"
+
+def _receipt_tuple(value):
+    if isinstance(value, tuple):
+        return value
+    if isinstance(value, str):
+        # Stored JSON, as read from SQLite
+        return decode_receipts(value)
+    return tuple(value) if len(value) else NO_RECEIPTS
+
+def _receipts(values):
+    return values.map(_receipt_tuple).astype(object)
+
+def _small_int(values, column, dtype):
+    numbers = pd.to_numeric(values, errors='coerce')
+    info = np.iinfo(dtype)
+    bad = values.notna() & (numbers.isna() | (numbers % 1 != 0) | (numbers < info.min) | (numbers > info.max))
+    if bad.any():
+        raise SchemaError(f"{column} must be whole numbers from {info.min} to {info.max}, got {_examples(values[bad])}")
+    return numbers.astype(dtype)
+
+def _category(values, column, categories):
+    if categories is None:
+        return values.astype('category')
+    categorical = pd.Categorical(values, categories=categories)
+    bad = values.notna() & (categorical.codes == -1)
+    if bad.any():
+        raise SchemaError(f"{column} must be one of {', '.join(categories)}, got {_examples(values[bad])}")
+    return pd.Series(categorical, index=values.index, name=values.name)
+
+def apply_schema(frame, schema=PATIENT_SCHEMA):
+    """Cast frame's columns to schema in place and return it; raises SchemaError on values that do not fit"""
+    missing = [column for column in schema if column not in frame]
+    if missing:
+        raise SchemaError(f"missing column(s): {', '.join(missing)}")
+    for column in REQUIRED.intersection(frame.columns):
+        if frame[column].isna().any():
+            raise SchemaError(f"{column} has missing values")
+    for column, dtype in schema.items():
+        values = frame[column]
+        if isinstance(dtype, list):
+            frame[column] = _category(values, column, dtype)
+        elif dtype == 'category':
+            frame[column] = _category(values, column, None)
+        elif dtype == 'receipts':
+            frame[column] = _receipts(values)
+        elif dtype.startswith('int'):
+            frame[column] = _small_int(values, column, dtype)
+        elif dtype.startswith('datetime64'):
+            frame[column] = pd.to_datetime(values, format='ISO8601').astype(dtype)
+        else:
+            numbers = pd.to_numeric(values, errors='coerce')
+            if (numbers.isna() & values.notna()).any():
+                raise SchemaError(f"{column} must be numeric, got {_examples(values[numbers.isna() & values.notna()])}")
+            frame[column] = numbers.astype(dtype)
+    return frame
@@ -0,0 +1,143 @@
+import bisect
+import functools
+import re
+import threading
+
+import numpy as np
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+_RUN_RE = re.compile(r"[a-z]+|[0-9]+")
+
+def tokenize(text):
+    return _WORD_RE.findall(str(text).lower())
+
+# Study and hospital names repeat across thousands of patients
+@functools.lru_cache(maxsize=65536)
+def index_tokens(text):
+    """Words, plus the letter/digit runs inside them so "001" and "1" both find "PT001" """
+    tokens = set()
+    for word in tokenize(text):
+        tokens.add(word)
+        runs = _RUN_RE.findall(word)
+        if len(runs) > 1:
+            tokens.update(runs)
+        tokens.update(run.lstrip('0') for run in runs if run.isdigit() and run.lstrip('0'))
+    return frozenset(tokens)
+
+class PatientSearchIndex:
+    """Token-prefix index over patient name, ID and study name with ranked, limited results
+
+    Each token keeps a postings list of (doc, weight); distinct tokens are held in a sorted list
+    so a query term's prefix range is found by bisection. Postings are materialised as NumPy
+    arrays on first use, so scoring a term is a few array operations however many patients
+    match. Every query term must match; exact token matches and matches on more important
+    fields rank higher.
+    """
+
+    FIELD_WEIGHTS = {'patient_id': 3, 'name': 2, 'study_name': 1}
+
+    def __init__(self, patients=None):
+        self._lock = threading.Lock()
+        self._clear()
+        if patients is not None:
+            self.add(patients)
+
+    def _clear(self):
+        self._tokens = []
+        self._postings = {}
+        self._arrays = {}
+        self._doc_ids = {}
+        self._patient_ids = []
+        self._removed = []
+
+    def __len__(self):
+        return len(self._doc_ids)
+
+    def _weights_for(self, patient):
+        weights = {}
+        for field, weight in self.FIELD_WEIGHTS.items():
+            for token in index_tokens(str(patient[field])):
+                weights[token] = max(weight, weights.get(token, 0))
+        return weights
+
+    def rebuild(self, patients):
+        with self._lock:
+            self._clear()
+        self.add(patients)
+
+    def add(self, patients):
+        """Index new or changed patients (a DataFrame or iterable of dicts) incrementally"""
+        records = patients.to_dict('records') if hasattr(patients, 'to_dict') else patients
+        new_tokens, touched = set(), set()
+        with self._lock:
+            for patient in records:
+                self._remove_locked(patient['patient_id'])
+                doc = len(self._patient_ids)
+                self._patient_ids.append(patient['patient_id'])
+                self._doc_ids[patient['patient_id']] = doc
+                for token, weight in self._weights_for(patient).items():
+                    posting = self._postings.get(token)
+                    if posting is None:
+                        posting = self._postings[token] = ([], [])
+                        new_tokens.add(token)
+                    posting[0].append(doc)
+                    posting[1].append(weight)
+                    touched.add(token)
+            for token in touched:
+                self._arrays.pop(token, None)
+            if new_tokens:
+                if len(new_tokens) > len(self._tokens) // 8:
+                    self._tokens = sorted(self._postings)
+                else:
+                    for token in new_tokens:
+                        bisect.insort(self._tokens, token)
+
+    def remove(self, patient_id):
+        with self._lock:
+            self._remove_locked(patient_id)
+
+    def _remove_locked(self, patient_id):
+        # Postings keep the stale doc; it is masked out at query time
+        doc = self._doc_ids.pop(patient_id, None)
+        if doc is not None:
+            self._removed.append(doc)
+
+    def _posting_arrays(self, token):
+        arrays = self._arrays.get(token)
+        if arrays is None:
+            docs, weights = self._postings[token]
+            arrays = self._arrays[token] = (np.asarray(docs, dtype=np.int64), np.asarray(weights, dtype=np.int32))
+        return arrays
+
+    def search(self, query, limit=50):
+        """Patient IDs matching every term of query, best first"""
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms or limit <= 0:
+            return []
+        with self._lock:
+            n_docs = len(self._patient_ids)
+            scores = None
+            for term in terms:
+                lo = bisect.bisect_left(self._tokens, term)
+                hi = bisect.bisect_left(self._tokens, term + '\uffff', lo)
+                if lo == hi:
+                    return []
+                term_scores = np.zeros(n_docs, dtype=np.int32)
+                for token in self._tokens[lo:hi]:
+                    docs, weights = self._posting_arrays(token)
+                    if token == term:
+                        weights = weights * 2
+                    term_scores[docs] = np.maximum(term_scores[docs], weights)
+                if scores is None:
+                    scores = term_scores
+                else:
+                    scores = np.where((scores > 0) & (term_scores > 0), scores + term_scores, 0)
+            if self._removed:
+                scores[self._removed] = 0
+            candidates = np.flatnonzero(scores)
+            # Rank by score, then by insertion order
+            keys = candidates - scores[candidates].astype(np.int64) * n_docs
+            if len(candidates) > limit:
+                top = np.argpartition(keys, limit - 1)[:limit]
+                candidates, keys = candidates[top], keys[top]
+            return [self._patient_ids[doc] for doc in candidates[np.argsort(keys)]]
@@ -0,0 +1,516 @@
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from . import PROJECT_DIR
+from .history import VisitHistory
+from .metrics import get_metrics
+from .receipts import parse_receipt
+from .schema import NO_RECEIPTS, apply_schema
+from .synthetic import iter_patient_chunks
+
+# Mock data for Western Australian patients, used to seed an empty store
+def seed_patient_data():
+    return [
+        {
+            'patient_id': 'PT001',
+            'name': 'Sarah Mitchell',
+            'account_number': '123456789',
+            'bsb': '036-012',
+            'address': '45 Stirling Highway, Nedlands WA 6009',
+            'study_id': 'CARDIO-2024-001',
+            'study_name': 'Cardiac Prevention Study',
+            'age': 34,
+            'phone': '(08) 9123-4567',
+            'email': 'sarah.mitchell@email.com',
+            'upcoming_visit': datetime.now() + timedelta(days=2),
+            'visit_duration': 4,
+            'hospital': 'Royal Perth Hospital',
+            'hospital_address': '197 Wellington Street, Perth WA 6000',
+            'transport_method': 'car',
+            'distance': 12,
+            'status': 'upcoming',
+            'receipts': ['parking-receipt-001.pdf', 'meal-receipt-001.pdf']
+        },
+        {
+            'patient_id': 'PT002',
+            'name': 'James Wilson',
+            'account_number': '987654321',
+            'bsb': '066-102',
+            'address': '78 Hay Street, Subiaco WA 6008',
+            'study_id': 'NEURO-2024-003',
+            'study_name': 'Neurological Assessment Trial',
+            'age': 42,
+            'phone': '(08) 9234-5678',
+            'email': 'james.wilson@email.com',
+            'upcoming_visit': datetime.now() + timedelta(days=7),
+            'visit_duration': 2,
+            'hospital': 'Sir Charles Gairdner Hospital',
+            'hospital_address': 'Hospital Avenue, Nedlands WA 6009',
+            'transport_method': 'public',
+            'distance': 0,
+            'status': 'completed',
+            'receipts': []
+        },
+        {
+            'patient_id': 'PT003',
+            'name': 'Emma Thompson',
+            'account_number': '456789123',
+            'bsb': '016-789',
+            'address': '23 Ocean Drive, Cottesloe WA 6011',
+            'study_id': 'ONCOLOGY-2024-007',
+            'study_name': 'Cancer Treatment Efficacy Study',
+            'age': 56,
+            'phone': '(08) 9345-6789',
+            'email': 'emma.thompson@email.com',
+            'upcoming_visit': datetime.now() + timedelta(days=1),
+            'visit_duration': 5,
+            'hospital': 'Fiona Stanley Hospital',
+            'hospital_address': '11 Robin Warren Drive, Murdoch WA 6150',
+            'transport_method': 'car',
+            'distance': 28,
+            'status': 'upcoming',
+            'receipts': ['parking-receipt-003.pdf', 'meal-receipt-003.pdf']
+        },
+        {
+            'patient_id': 'PT004',
+            'name': 'Michael Brown',
+            'account_number': '789123456',
+            'bsb': '086-023',
+            'address': '156 Great Eastern Highway, Belmont WA 6104',
+            'study_id': 'DIABETES-2024-012',
+            'study_name': 'Diabetes Management Protocol',
+            'age': 48,
+            'phone': '(08) 9456-7890',
+            'email': 'michael.brown@email.com',
+            'upcoming_visit': datetime.now() + timedelta(days=4),
+            'visit_duration': 3,
+            'hospital': 'Royal Perth Hospital',
+            'hospital_address': '197 Wellington Street, Perth WA 6000',
+            'transport_method': 'taxi',
+            'distance': 22,
+            'fare': 48.60,
+            'status': 'completed',
+            'receipts': ['taxi-receipt-004.pdf']
+        },
+        {
+            'patient_id': 'PT005',
+            'name': 'Lisa Anderson',
+            'account_number': '321654987',
+            'bsb': '036-089',
+            'address': '89 Canning Highway, South Perth WA 6151',
+            'study_id': 'RESPIRATORY-2024-005',
+            'study_name': 'Respiratory Function Analysis',
+            'age': 39,
+            'phone': '(08) 9567-8901',
+            'email': 'lisa.anderson@email.com',
+            'upcoming_visit': datetime.now() + timedelta(days=10),
+            'visit_duration': 6,
+            'hospital': 'Sir Charles Gairdner Hospital',
+            'hospital_address': 'Hospital Avenue, Nedlands WA 6009',
+            'transport_method': 'car',
+            'distance': 18,
+            'status': 'approved',
+            'receipts': ['parking-receipt-005.pdf', 'meal-receipt-005.pdf']
+        }
+    ]
+
+PATIENT_COLUMNS = [
+    'patient_id', 'name', 'account_number', 'bsb', 'address', 'study_id', 'study_name',
+    'age', 'phone', 'email', 'upcoming_visit', 'visit_duration', 'hospital',
+    'hospital_address', 'transport_method', 'distance', 'status', 'receipts', 'fare'
+]
+DEFAULT_DB_PATH = os.path.join(PROJECT_DIR, 'reimbursed.db')
+
+# Both are read when a store is opened, not at import, so a process can point the app at another database
+def default_db_path():
+    return os.environ.get('REIMBURSED_DB', DEFAULT_DB_PATH)
+
+def synthetic_patients():
+    """How many synthetic patients seed an empty store instead of the mock data (for load testing)"""
+    return int(os.environ.get('REIMBURSED_SYNTHETIC_PATIENTS', 0))
+# A participant moves on to their next visit only once the current claim is settled
+SETTLED_STATUSES = ('paid', 'rejected')
+
+def _sql_timestamp(value):
+    # Fixed-width text so timestamps sort and compare correctly in SQLite
+    return pd.Timestamp(value).strftime('%Y-%m-%d %H:%M:%S')
+
+def _patient_number(patient_id):
+    # 6 for 'PT006'; 0 for a missing or differently formatted ID
+    patient_id = str(patient_id or '')
+    return int(patient_id[2:]) if patient_id.startswith('PT') and patient_id[2:].isdigit() else 0
+
+class PatientStore:
+    """SQLite-backed patient store, indexed on patient_id, status, study_id and upcoming_visit
+
+    Each patient row is the participant's current visit; every visit is also kept in the visit
+    history (see history.py), which outlives the patient row moving on to the next visit.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS patients (
+        patient_id TEXT PRIMARY KEY,
+        name TEXT NOT NULL,
+        account_number TEXT,
+        bsb TEXT,
+        address TEXT,
+        study_id TEXT,
+        study_name TEXT,
+        age INTEGER,
+        phone TEXT,
+        email TEXT,
+        upcoming_visit TEXT,
+        visit_duration INTEGER,
+        hospital TEXT,
+        hospital_address TEXT,
+        transport_method TEXT,
+        distance REAL,
+        status TEXT NOT NULL,
+        receipts TEXT NOT NULL DEFAULT '[]',
+        fare REAL NOT NULL DEFAULT 0
+    );
+    CREATE INDEX IF NOT EXISTS idx_patients_status ON patients (status);
+    CREATE INDEX IF NOT EXISTS idx_patients_study_id ON patients (study_id);
+    CREATE INDEX IF NOT EXISTS idx_patients_upcoming_visit ON patients (upcoming_visit);
+    CREATE TABLE IF NOT EXISTS receipt_hashes (
+        digest TEXT NOT NULL,
+        patient_id TEXT NOT NULL,
+        phash INTEGER NOT NULL,
+        PRIMARY KEY (digest, patient_id)
+    );
+    CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+    INSERT OR IGNORE INTO meta (key, value) VALUES ('version', 0);
+    """
+
+    def __init__(self, path=None):
+        path = path or default_db_path()
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(self.SCHEMA + VisitHistory.SCHEMA)
+        self.history = VisitHistory(self._conn)
+        self._migrate()
+        if self.count() == 0:
+            seed_count = synthetic_patients()
+            if seed_count:
+                for chunk in iter_patient_chunks(seed_count):
+                    self.add_patients(chunk.to_dict('records'))
+            else:
+                self.add_patients(seed_patient_data())
+
+    def _migrate(self):
+        # Stores created before taxi fares were recorded
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(patients)")}
+        if 'fare' not in columns:
+            with self._conn:
+                self._conn.execute("ALTER TABLE patients ADD COLUMN fare REAL NOT NULL DEFAULT 0")
+        # Stores written by builds that saved isoformat() timestamps, with microseconds on some rows
+        # only: rewrite them in the fixed-width format so they load, sort and compare consistently
+        if self._conn.execute("SELECT value FROM meta WHERE key = 'timestamps'").fetchone() is None:
+            with self._conn:
+                self._conn.execute(
+                    "UPDATE patients SET upcoming_visit = SUBSTR(REPLACE(upcoming_visit, 'T', ' '), 1, 19) "
+                    "WHERE LENGTH(upcoming_visit) > 19 OR INSTR(upcoming_visit, 'T') > 0"
+                )
+                self._conn.execute("INSERT INTO meta (key, value) VALUES ('timestamps', 1)")
+        # Stores created before visit history: each patient's current visit starts it
+        if self._conn.execute("SELECT value FROM meta WHERE key = 'visit_history'").fetchone() is None:
+            with self._conn:
+                cursor = self._conn.execute(f"SELECT {', '.join(PATIENT_COLUMNS)} FROM patients ORDER BY patient_id")
+                self.history.rebuild(self._scan(cursor))
+                self._conn.execute("INSERT INTO meta (key, value) VALUES ('visit_history', 1)")
+
+    @staticmethod
+    def _to_row(patient):
+        visit = patient['upcoming_visit']
+        return (
+            patient['patient_id'], patient['name'], patient['account_number'], patient['bsb'],
+            patient['address'], patient['study_id'], patient['study_name'], int(patient['age']),
+            patient['phone'], patient['email'],
+            _sql_timestamp(visit) if visit is not None else None,
+            int(patient['visit_duration']), patient['hospital'], patient['hospital_address'],
+            patient['transport_method'], float(patient['distance']), patient['status'],
+            json.dumps(list(patient.get('receipts') or [])), float(patient.get('fare') or 0)
+        )
+
+    @staticmethod
+    def _rows_to_frame(rows):
+        return apply_schema(pd.DataFrame(rows, columns=PATIENT_COLUMNS))
+
+    @classmethod
+    def _to_frame(cls, cursor):
+        return cls._rows_to_frame(cursor.fetchall())
+
+    @classmethod
+    def _scan(cls, cursor, chunk_size=5000):
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                return
+            yield cls._rows_to_frame(rows)
+
+    def add_patients(self, patients):
+        """Insert many patients, and their visits into the history, in a single transaction
+
+        Patients without a patient_id get the next free PT number, allocated inside the transaction so
+        that two writers cannot both take it. Returns the patients' IDs in the order given.
+        """
+        placeholders = ', '.join('?' * len(PATIENT_COLUMNS))
+        with self._lock, self._conn:
+            # Take the write lock before reading the highest ID, so no other process can allocate it too
+            self._conn.execute("BEGIN IMMEDIATE")
+            rows, next_number = [], None
+            for patient in patients:
+                if not patient.get('patient_id'):
+                    if next_number is None:
+                        # Past the IDs given in this batch too, which are not inserted yet
+                        given = [_patient_number(p.get('patient_id')) for p in patients]
+                        next_number = max([self._last_patient_number()] + given) + 1
+                    patient = dict(patient, patient_id=f"PT{next_number:03d}")
+                    next_number += 1
+                rows.append(self._to_row(patient))
+            self._conn.executemany(
+                f"INSERT INTO patients ({', '.join(PATIENT_COLUMNS)}) VALUES ({placeholders})", rows
+            )
+            self.history.record(self._rows_to_frame(rows))
+            self._bump_version()
+        return [row[0] for row in rows]
+
+    def update_status(self, patient_ids, status, from_status=None):
+        """Move many patients to status in one transaction; returns their rows as they were before the change
+
+        With from_status, only patients currently in that status are changed, so a stale batch cannot
+        overwrite a claim someone else has already processed.
+        """
+        patient_ids = list(patient_ids)
+        if not patient_ids:
+            return pd.DataFrame(columns=PATIENT_COLUMNS)
+        placeholders = ', '.join('?' * len(patient_ids))
+        where, params = f"patient_id IN ({placeholders})", list(patient_ids)
+        if from_status is not None:
+            where += " AND status = ?"
+            params.append(from_status)
+        with self._lock, self._conn:
+            before = self._to_frame(self._conn.execute(
+                f"SELECT {', '.join(PATIENT_COLUMNS)} FROM patients WHERE {where}", params
+            ))
+            if not before.empty:
+                self._conn.execute(f"UPDATE patients SET status = ? WHERE {where}", [status] + params)
+                self.history.replace(before, before.assign(status=status))
+                self._bump_version()
+        return before
+
+    def add_receipts(self, patient_id, receipts, phashes=None, fare=0):
+        """Append receipt references to a patient's claim, recording perceptual hashes for image receipts
+
+        fare is the fare total on these receipts, added to the claim's fare for studies that pay fares at cost.
+        Returns the patient's row (as a DataFrame) before and after.
+        """
+        hash_rows = [
+            # SQLite integers are signed 64-bit
+            (parse_receipt(ref)[0], patient_id, phash - (1 << 64) if phash >= 1 << 63 else phash)
+            for ref, phash in zip(receipts, phashes or []) if phash is not None
+        ]
+        with self._lock, self._conn:
+            before = self._to_frame(self._conn.execute(
+                f"SELECT {', '.join(PATIENT_COLUMNS)} FROM patients WHERE patient_id = ?", (patient_id,)
+            ))
+            if before.empty:
+                raise KeyError(patient_id)
+            after = before.assign(receipts=pd.Series([before['receipts'].iloc[0] + tuple(receipts)], index=before.index),
+                                  fare=before['fare'] + float(fare))
+            self._conn.execute(
+                "UPDATE patients SET receipts = ?, fare = ? WHERE patient_id = ?",
+                (json.dumps(list(after['receipts'].iloc[0])), float(after['fare'].iloc[0]), patient_id)
+            )
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO receipt_hashes (digest, patient_id, phash) VALUES (?, ?, ?)", hash_rows
+            )
+            self.history.replace(before, after)
+            self._bump_version()
+        return before, after
+
+    def schedule_visit(self, patient_id, visit_date, visit_duration=None):
+        """Move a patient on to their next visit; returns their row (as a DataFrame) before and after
+
+        The current visit stays in the history with its claim. It must be settled (paid or rejected)
+        first, unless it has not happened yet, in which case it is rescheduled instead.
+        """
+        with self._lock, self._conn:
+            before = self._to_frame(self._conn.execute(
+                f"SELECT {', '.join(PATIENT_COLUMNS)} FROM patients WHERE patient_id = ?", (patient_id,)
+            ))
+            if before.empty:
+                raise KeyError(patient_id)
+            status = before['status'].iloc[0]
+            if status != 'upcoming' and status not in SETTLED_STATUSES:
+                raise ValueError(f"{patient_id}'s current claim is {status}; it must be paid or rejected first")
+            current_visit = before['upcoming_visit'].iloc[0]
+            if status != 'upcoming' and pd.notna(current_visit) and pd.Timestamp(visit_date) <= current_visit:
+                raise ValueError(f"{patient_id}'s next visit must be after the current one, {current_visit:%Y-%m-%d}")
+            after = before.assign(
+                upcoming_visit=pd.Timestamp(visit_date), status='upcoming', fare=0.0,
+                receipts=pd.Series([NO_RECEIPTS], index=before.index),
+                visit_duration=int(visit_duration if visit_duration is not None else before['visit_duration'].iloc[0])
+            )
+            self._conn.execute(
+                "UPDATE patients SET upcoming_visit = ?, visit_duration = ?, status = 'upcoming', receipts = '[]', fare = 0 "
+                "WHERE patient_id = ?",
+                (_sql_timestamp(visit_date), int(after['visit_duration'].iloc[0]), patient_id)
+            )
+            try:
+                if status == 'upcoming':
+                    self.history.replace(before, after)
+                else:
+                    self.history.record(after)
+            except sqlite3.IntegrityError:
+                raise ValueError(f"{patient_id} already has a visit at {_sql_timestamp(visit_date)}")
+            self._bump_version()
+        return before, after
+
+    def visit_history(self, patient_id=None, visit_from=None, visit_to=None):
+        """Past and current visits, oldest first; visit_to is exclusive"""
+        with self._lock:
+            return self.history.select(patient_id=patient_id, visit_from=visit_from, visit_to=visit_to)
+
+    def visit_rollups(self, scope, key=None):
+        """Visit totals by status per 'patient', 'study' or 'month'"""
+        with self._lock:
+            return self.history.rollups(scope, key=key)
+
+    def receipt_hashes(self):
+        """(phash, digest, patient_id) for every hashed receipt"""
+        with self._lock:
+            rows = self._conn.execute("SELECT phash, digest, patient_id FROM receipt_hashes").fetchall()
+        return [(phash & ((1 << 64) - 1), digest, patient_id) for phash, digest, patient_id in rows]
+
+    def _bump_version(self):
+        # Called inside the write transaction so readers never see new rows with an old version
+        self._conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+
+    def version(self):
+        """Monotonic data version, bumped by every committed write (from any process)"""
+        with self._lock:
+            return self._conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+
+    def select(self, patient_id=None, status=None, study_id=None, visit_from=None, visit_to=None,
+               limit=None, offset=0, after_patient_id=None):
+        """Fetch patients matching the given indexed keys; ``status`` may be a single value or a list"""
+        clauses, params = [], []
+        if after_patient_id is not None:
+            clauses.append("patient_id > ?")
+            params.append(after_patient_id)
+        if patient_id is not None:
+            clauses.append("patient_id = ?")
+            params.append(patient_id)
+        if status is not None:
+            statuses = [status] if isinstance(status, str) else list(status)
+            clauses.append(f"status IN ({', '.join('?' * len(statuses))})")
+            params.extend(statuses)
+        if study_id is not None:
+            clauses.append("study_id = ?")
+            params.append(study_id)
+        if visit_from is not None:
+            clauses.append("upcoming_visit >= ?")
+            params.append(_sql_timestamp(visit_from))
+        if visit_to is not None:
+            clauses.append("upcoming_visit < ?")
+            params.append(_sql_timestamp(visit_to))
+        sql = f"SELECT {', '.join(PATIENT_COLUMNS)} FROM patients"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY patient_id"
+        if limit is not None:
+            sql += " LIMIT ? OFFSET ?"
+            params.extend([int(limit), int(offset)])
+        with self._lock:
+            return self._to_frame(self._conn.execute(sql, params))
+
+    def iter_chunks(self, chunk_size=5000, **filters):
+        """Yield matching patients as DataFrames of at most chunk_size rows, paging on patient_id"""
+        after_patient_id = None
+        while True:
+            chunk = self.select(limit=chunk_size, after_patient_id=after_patient_id, **filters)
+            if chunk.empty:
+                return
+            yield chunk
+            after_patient_id = chunk['patient_id'].iloc[-1]
+
+    def count(self, status=None):
+        sql, params = "SELECT COUNT(*) FROM patients", []
+        if status is not None:
+            sql += " WHERE status = ?"
+            params.append(status)
+        with self._lock:
+            return self._conn.execute(sql, params).fetchone()[0]
+
+    def _last_patient_number(self):
+        row = self._conn.execute(
+            "SELECT MAX(CAST(SUBSTR(patient_id, 3) AS INTEGER)) FROM patients WHERE patient_id LIKE 'PT%'"
+        ).fetchone()
+        return row[0] or 0
+
+class SharedDataset:
+    """One read-only patients frame per process, shared by every session and reloaded only when the store version changes
+
+    Copy-on-write is enabled for pandas, so frames derived from the snapshot share its memory until
+    written; callers must not modify the snapshot itself.
+    """
+
+    def __init__(self, store):
+        self._store = store
+        self._lock = threading.Lock()
+        self.version = None
+        self._frame = None
+
+    def snapshot(self):
+        version = self._store.version()
+        get_metrics().increment('cache_requests_total', cache='patients_snapshot')
+        with self._lock:
+            if version != self.version:
+                get_metrics().increment('cache_misses_total', cache='patients_snapshot')
+                self._frame = self._store.select()
+                self.version = version
+            return self._frame
+
+class DerivedIndexes:
+    """Indexes and aggregates built from the store once per process and kept current by this process's writes
+
+    Each one records the store version it was built at. This process's own writes are applied to it
+    incrementally and counted in write(); when the version has moved by more than those writes (the
+    CLI or another replica wrote), it is rebuilt from the store on next use.
+    """
+
+    def __init__(self, store):
+        self._store = store
+        self._lock = threading.RLock()
+        self._own_writes = 0
+        self._built = {}
+
+    def get(self, name, build):
+        """The index called name, from build() if it has not been built or other writers have moved the store on"""
+        with self._lock:
+            version = self._store.version()
+            index, built_version, own_writes = self._built.get(name, (None, None, None))
+            if index is None or version - built_version != self._own_writes - own_writes:
+                get_metrics().increment('cache_misses_total', cache=f'index_{name}')
+                index = build()
+                self._built[name] = (index, version, self._own_writes)
+            return index
+
+    def write(self):
+        """Lock held while a write is made and applied; call wrote() once it has bumped the store version
+
+        Fetch the indexes to update before writing, so none is built from rows that already hold the write.
+        """
+        return self._lock
+
+    def wrote(self):
+        with self._lock:
+            self._own_writes += 1
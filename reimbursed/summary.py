@@ -0,0 +1,70 @@
+import threading
+from collections import Counter
+
+import pandas as pd
+
+from .reimbursement import calculate_reimbursements
+from .schema import kilometres
+
+class PatientSummary:
+    """Materialised dashboard aggregates, maintained incrementally as patients are added or change status
+
+    Counts are kept by status, transport method, study and hospital. Reimbursement totals, eligible
+    (non-public transport) counts and eligible kilometres are kept per status so every metric card
+    is a dictionary lookup.
+    """
+
+    def __init__(self, patients=None):
+        self._lock = threading.Lock()
+        self.total = 0
+        self.by_status = Counter()
+        self.by_transport = Counter()
+        self.by_study = Counter()
+        self.by_hospital = Counter()
+        self.eligible_by_status = Counter()
+        self.km_by_status = Counter()
+        self.reimbursement_by_status = Counter()
+        if patients is not None:
+            self.add(patients)
+
+    def _apply(self, patients, sign, status=None):
+        if patients.empty:
+            return
+        statuses = patients['status'] if status is None else pd.Series(status, index=patients.index)
+        eligible = patients['transport_method'] != 'public'
+        totals = calculate_reimbursements(patients)['total']
+        with self._lock:
+            self.total += sign * len(patients)
+            for counter, values in ((self.by_status, statuses), (self.by_transport, patients['transport_method']),
+                                    (self.by_study, patients['study_name']), (self.by_hospital, patients['hospital'])):
+                # Categorical columns count every category, including ones with no patients here
+                for key, count in values.value_counts().items():
+                    if count:
+                        counter[key] += sign * count
+            for key, count in statuses[eligible].value_counts().items():
+                if count:
+                    self.eligible_by_status[key] += sign * count
+            distance = pd.Series(kilometres(patients['distance']), index=patients.index)
+            for key, km in distance[eligible].groupby(statuses[eligible], observed=True).sum().items():
+                self.km_by_status[key] += sign * km
+            for key, amount in totals.groupby(statuses, observed=True).sum().items():
+                self.reimbursement_by_status[key] += sign * amount
+
+    def add(self, patients):
+        """Count a DataFrame of newly stored patients"""
+        self._apply(patients, 1)
+
+    def remove(self, patients):
+        self._apply(patients, -1)
+
+    def update_status(self, patients, new_status):
+        """Move patients (as they were before the change) from their current status to new_status"""
+        self._apply(patients, -1)
+        self._apply(patients, 1, status=new_status)
+
+    @property
+    def active_studies(self):
+        return sum(1 for count in self.by_study.values() if count > 0)
+
+    def count(self, status):
+        return self.by_status[status]
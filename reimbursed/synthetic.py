@@ -0,0 +1,152 @@
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from .distance import HOSPITALS, POSTCODE_TABLE_PATH, get_distance_engine, haversine_km
+from .schema import apply_schema
+
+# Patients are drawn in fixed-size blocks, each from its own seeded generator
+BLOCK_SIZE = 10_000
+
+STUDIES = [
+    ('CARDIO-2024-001', 'Cardiac Prevention Study'),
+    ('NEURO-2024-003', 'Neurological Assessment Trial'),
+    ('ONCOLOGY-2024-007', 'Cancer Treatment Efficacy Study'),
+    ('DIABETES-2024-012', 'Diabetes Management Protocol'),
+    ('RESPIRATORY-2024-005', 'Respiratory Function Analysis'),
+    ('RENAL-2025-002', 'Chronic Kidney Disease Outcomes'),
+    ('ORTHO-2025-004', 'Joint Replacement Recovery Study'),
+    ('DERM-2025-009', 'Melanoma Surveillance Program'),
+]
+STUDY_WEIGHTS = [0.2, 0.1, 0.15, 0.15, 0.1, 0.1, 0.12, 0.08]
+
+HOSPITAL_WEIGHTS = [0.3, 0.25, 0.25, 0.1, 0.1]
+
+TRANSPORT_METHODS = ['car', 'taxi', 'public']
+TRANSPORT_WEIGHTS = [0.6, 0.12, 0.28]
+
+STATUSES = ['upcoming', 'completed', 'approved', 'rejected']
+STATUS_WEIGHTS = [0.5, 0.25, 0.18, 0.07]
+
+# Most participants live in metropolitan Perth; regional postcodes are drawn this much less often
+METRO_RADIUS_KM = 60
+REGIONAL_POSTCODE_WEIGHT = 0.02
+
+# Share of private-transport claims whose distance is overstated enough to trip the distance check
+OVERSTATED_DISTANCE_RATE = 0.05
+
+# Perth metered taxi tariff, for the fares on taxi receipts
+TAXI_FLAGFALL = 4.80
+TAXI_RATE_PER_KM = 1.86
+
+FIRST_NAMES = [
+    'Sarah', 'James', 'Emma', 'Michael', 'Lisa', 'David', 'Olivia', 'Daniel', 'Chloe', 'Matthew',
+    'Sophie', 'Andrew', 'Emily', 'Joshua', 'Grace', 'Thomas', 'Jessica', 'Ryan', 'Hannah', 'Liam',
+    'Mia', 'Noah', 'Charlotte', 'Jack', 'Amelia', 'William', 'Isla', 'Lucas', 'Ruby', 'Ethan',
+    'Zoe', 'Benjamin', 'Harper', 'Samuel', 'Ava', 'Nathan', 'Priya', 'Wei', 'Aisha', 'Tane',
+]
+LAST_NAMES = [
+    'Mitchell', 'Thompson', 'Chen', 'Wilson', 'Anderson', 'Smith', 'Jones', 'Williams', 'Brown', 'Taylor',
+    'Nguyen', 'Martin', 'Lee', 'White', 'Walker', 'Harris', 'Clarke', 'Robinson', 'Wright', 'Kelly',
+    'King', 'Young', 'Scott', 'Green', 'Baker', 'Hall', 'Campbell', 'Stewart', 'Murphy', 'Patel',
+    'Singh', 'Wang', 'Ryan', 'Evans', 'Turner', 'Hughes', 'Edwards', 'Collins', 'Morris', 'Ward',
+]
+STREET_NAMES = [
+    'Stirling', 'Hay', 'Murray', 'Canning', 'Albany', 'Great Eastern', 'Wanneroo', 'Scarborough Beach',
+    'Marmion', 'Riverside', 'Hampden', 'Beaufort', 'Walcott', 'Karrinyup', 'Leach', 'South',
+]
+STREET_TYPES = ['Street', 'Road', 'Avenue', 'Drive', 'Highway', 'Parade', 'Crescent', 'Way']
+BSB_PREFIXES = ['016', '036', '066', '086', '306', '484', '633']
+
+def iter_patient_chunks(n, seed=0, today=None):
+    """Deterministic synthetic WA patients as DataFrames of up to BLOCK_SIZE rows, in patient_id order
+
+    The same n, seed and today always produce the same patients; today defaults to the current date.
+    """
+    today = pd.Timestamp(today or datetime.now().date())
+    postcodes = pd.read_csv(POSTCODE_TABLE_PATH, dtype={'postcode': str})
+    perth = HOSPITALS['Royal Perth Hospital']
+    metro = haversine_km(postcodes['latitude'], postcodes['longitude'], perth['latitude'], perth['longitude']) <= METRO_RADIUS_KM
+    postcodes['weight'] = np.where(metro, 1, REGIONAL_POSTCODE_WEIGHT)
+    postcodes['weight'] /= postcodes['weight'].sum()
+    for start in range(0, n, BLOCK_SIZE):
+        yield _patient_block(start, min(BLOCK_SIZE, n - start), seed, today, postcodes)
+
+def generate_patients(n, seed=0, today=None):
+    """All n synthetic patients as one DataFrame, with the dtypes the store loads them with"""
+    return apply_schema(pd.concat(iter_patient_chunks(n, seed, today), ignore_index=True))
+
+def _patient_block(start, size, seed, today, postcodes):
+    rng = np.random.default_rng([seed, start])
+    number = np.arange(start + 1, start + size + 1)
+    patient_id = pd.Series(number).map('PT{:03d}'.format)
+
+    first = np.array(FIRST_NAMES)[rng.integers(len(FIRST_NAMES), size=size)]
+    last = np.array(LAST_NAMES)[rng.integers(len(LAST_NAMES), size=size)]
+    name = pd.Series(first) + ' ' + pd.Series(last)
+    email = (pd.Series(np.char.lower(first)) + '.' + pd.Series(np.char.lower(last))
+             + pd.Series(number).astype(str) + '@email.com')
+
+    place = postcodes.iloc[rng.choice(len(postcodes), size=size, p=postcodes['weight'])]
+    street = (pd.Series(rng.integers(1, 400, size=size)).astype(str) + ' '
+              + pd.Series(np.array(STREET_NAMES)[rng.integers(len(STREET_NAMES), size=size)]) + ' '
+              + pd.Series(np.array(STREET_TYPES)[rng.integers(len(STREET_TYPES), size=size)]))
+    address = street + ', ' + place['suburb'].to_numpy() + ' WA ' + place['postcode'].to_numpy()
+
+    study = rng.choice(len(STUDIES), size=size, p=STUDY_WEIGHTS)
+    hospital_names = list(HOSPITALS)
+    hospital = np.array(hospital_names)[rng.choice(len(hospital_names), size=size, p=HOSPITAL_WEIGHTS)]
+    transport = np.array(TRANSPORT_METHODS)[rng.choice(len(TRANSPORT_METHODS), size=size, p=TRANSPORT_WEIGHTS)]
+    status = np.array(STATUSES)[rng.choice(len(STATUSES), size=size, p=STATUS_WEIGHTS)]
+
+    # Claimed distance is the road estimate with some noise; a few claims are overstated
+    distance = get_distance_engine().estimate(address.to_numpy(), hospital)
+    distance = distance * rng.lognormal(0, 0.08, size=size)
+    distance = np.where(rng.random(size) < OVERSTATED_DISTANCE_RATE, distance * 1.8, distance)
+    distance = np.where(transport == 'public', 0, np.maximum(1, np.round(np.nan_to_num(distance, nan=10))))
+
+    visit_duration = rng.choice(np.arange(1, 9), size=size, p=[0.05, 0.2, 0.25, 0.2, 0.12, 0.1, 0.05, 0.03])
+    # Upcoming visits fall in the next quarter, everything else in the past year
+    days = np.where(status == 'upcoming', rng.integers(1, 91, size=size), -rng.integers(1, 366, size=size))
+    upcoming_visit = today + pd.to_timedelta(days, unit='D') + pd.to_timedelta(rng.choice([8, 9, 10, 11, 13, 14], size=size), unit='h')
+
+    return pd.DataFrame({
+        'patient_id': patient_id,
+        'name': name,
+        'account_number': pd.Series(rng.integers(10**8, 10**9, size=size)).astype(str),
+        'bsb': (pd.Series(np.array(BSB_PREFIXES)[rng.integers(len(BSB_PREFIXES), size=size)]) + '-'
+                + pd.Series(rng.integers(0, 1000, size=size)).map('{:03d}'.format)),
+        'address': address.to_numpy(),
+        'study_id': np.array([s[0] for s in STUDIES])[study],
+        'study_name': np.array([s[1] for s in STUDIES])[study],
+        'age': rng.integers(18, 86, size=size),
+        'phone': (pd.Series(rng.integers(9000, 10000, size=size)).astype(str).radd('(08) ') + '-'
+                  + pd.Series(rng.integers(0, 10000, size=size)).map('{:04d}'.format)),
+        'email': email,
+        'upcoming_visit': upcoming_visit,
+        'visit_duration': visit_duration,
+        'hospital': hospital,
+        'hospital_address': [HOSPITALS[h]['address'] for h in hospital],
+        'transport_method': transport,
+        'distance': distance,
+        'status': status,
+        'receipts': _receipts(number, transport, status, visit_duration),
+        # Fares are known once the trip has been taken
+        'fare': np.where((transport == 'taxi') & (status != 'upcoming'),
+                         np.round(TAXI_FLAGFALL + distance * TAXI_RATE_PER_KM, 2), 0.0)
+    })
+
+def _receipts(number, transport, status, visit_duration):
+    """Legacy filename receipts, as in the mock data: none until the visit has happened or for public transport"""
+    receipts = []
+    for n, method, state, hours in zip(number, transport, status, visit_duration):
+        if state == 'upcoming' or method == 'public':
+            receipts.append([])
+            continue
+        kind = 'taxi' if method == 'taxi' else 'parking'
+        patient_receipts = [f"{kind}-receipt-{n:03d}.pdf"]
+        if hours >= 3:
+            patient_receipts.append(f"meal-receipt-{n:03d}.pdf")
+        receipts.append(patient_receipts)
+    return receipts
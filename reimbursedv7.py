@@ -1,21 +1,32 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-import plotly.express as px
-import plotly.graph_objects as go
-from datetime import datetime, timedelta
+from datetime import datetime
 import urllib.parse
 import io
-import base64
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import inch
-from reportlab.lib import colors
-import webbrowser
+import functools
+import os
 
+from reimbursed import PROJECT_DIR
+from reimbursed.reimbursement import calculate_reimbursements
+from reimbursed.invoices import generate_invoice_pdf, invoice_filename, write_invoices_zip, write_merged_invoice_pdf
+from reimbursed.search import PatientSearchIndex
+from reimbursed.summary import PatientSummary
+from reimbursed.analytics import AnalyticsCube
+from reimbursed.distance import HOSPITALS, get_distance_engine
+from reimbursed.exports import payment_export_frame, iter_payment_csv, iter_visit_ics, spool, write_aba_file
+from reimbursed.receipts import get_receipt_store, receipt_name, parse_receipt
+from reimbursed.duplicates import ReceiptHashIndex, perceptual_hash
+from reimbursed.metrics import get_metrics
+from reimbursed.schedule import VisitSchedule
+from reimbursed.schema import format_km, kilometres
+from reimbursed.store import DerivedIndexes, PatientStore, SharedDataset
 
 
+# Derived frames share memory with the process-wide dataset until written (always on from pandas 3)
+if int(pd.__version__.split('.')[0]) < 3:
+    pd.set_option('mode.copy_on_write', True)
+
 # Configure Streamlit page
 st.set_page_config(
     page_title="Clinical Trial Management System",
@@ -70,229 +81,132 @@ if 'patients' not in st.session_state:
     st.session_state.patients = None
 if 'show_new_patient_form' not in st.session_state:
     st.session_state.show_new_patient_form = False
+if 'show_receipt_upload' not in st.session_state:
+    st.session_state.show_receipt_upload = False
+
+# Metrics file for monitoring to scrape: JSON if the path ends in .json, Prometheus text otherwise
+METRICS_FILE = os.environ.get('REIMBURSED_METRICS_FILE')
+METRICS_EXPORT_INTERVAL = 15
+
+@st.cache_resource
+def get_patient_store():
+    return PatientStore()
+
+@st.cache_resource
+def get_shared_dataset():
+    return SharedDataset(get_patient_store())
 
-# Mock data for Western Australian patients
-@st.cache_data
 def load_patient_data():
-    patients_data = [
-        {
-            'patient_id': 'PT001',
-            'name': 'Sarah Mitchell',
-            'account_number': '123456789',
-            'bsb': '036-012',
-            'address': '45 Stirling Highway, Nedlands WA 6009',
-            'study_id': 'CARDIO-2024-001',
-            'study_name': 'Cardiac Prevention Study',
-            'age': 34,
-            'phone': '(08) 9123-4567',
-            'email': 'sarah.mitchell@email.com',
-            'upcoming_visit': datetime.now() + timedelta(days=2),
-            'visit_duration': 4,
-            'hospital': 'Royal Perth Hospital',
-            'hospital_address': '197 Wellington Street, Perth WA 6000',
-            'transport_method': 'car',
-            'distance': 12,
-            'status': 'upcoming',
-            'receipts': ['parking-receipt-001.pdf', 'meal-receipt-001.pdf']
-        },
-        {
-            'patient_id': 'PT002',
-            'name': 'James Wilson',
-            'account_number': '987654321',
-            'bsb': '066-102',
-            'address': '78 Hay Street, Subiaco WA 6008',
-            'study_id': 'NEURO-2024-003',
-            'study_name': 'Neurological Assessment Trial',
-            'age': 42,
-            'phone': '(08) 9234-5678',
-            'email': 'james.wilson@email.com',
-            'upcoming_visit': datetime.now() + timedelta(days=7),
-            'visit_duration': 2,
-            'hospital': 'Sir Charles Gairdner Hospital',
-            'hospital_address': 'Hospital Avenue, Nedlands WA 6009',
-            'transport_method': 'public',
-            'distance': 0,
-            'status': 'completed',
-            'receipts': []
-        },
-        {
-            'patient_id': 'PT003',
-            'name': 'Emma Thompson',
-            'account_number': '456789123',
-            'bsb': '016-789',
-            'address': '23 Ocean Drive, Cottesloe WA 6011',
-            'study_id': 'ONCOLOGY-2024-007',
-            'study_name': 'Cancer Treatment Efficacy Study',
-            'age': 56,
-            'phone': '(08) 9345-6789',
-            'email': 'emma.thompson@email.com',
-            'upcoming_visit': datetime.now() + timedelta(days=1),
-            'visit_duration': 5,
-            'hospital': 'Fiona Stanley Hospital',
-            'hospital_address': '11 Robin Warren Drive, Murdoch WA 6150',
-            'transport_method': 'car',
-            'distance': 28,
-            'status': 'upcoming',
-            'receipts': ['parking-receipt-003.pdf', 'meal-receipt-003.pdf']
-        },
-        {
-            'patient_id': 'PT004',
-            'name': 'Michael Brown',
-            'account_number': '789123456',
-            'bsb': '086-023',
-            'address': '156 Great Eastern Highway, Belmont WA 6104',
-            'study_id': 'DIABETES-2024-012',
-            'study_name': 'Diabetes Management Protocol',
-            'age': 48,
-            'phone': '(08) 9456-7890',
-            'email': 'michael.brown@email.com',
-            'upcoming_visit': datetime.now() + timedelta(days=4),
-            'visit_duration': 3,
-            'hospital': 'Royal Perth Hospital',
-            'hospital_address': '197 Wellington Street, Perth WA 6000',
-            'transport_method': 'taxi',
-            'distance': 22,
-            'status': 'completed',
-            'receipts': ['taxi-receipt-004.pdf']
-        },
-        {
-            'patient_id': 'PT005',
-            'name': 'Lisa Anderson',
-            'account_number': '321654987',
-            'bsb': '036-089',
-            'address': '89 Canning Highway, South Perth WA 6151',
-            'study_id': 'RESPIRATORY-2024-005',
-            'study_name': 'Respiratory Function Analysis',
-            'age': 39,
-            'phone': '(08) 9567-8901',
-            'email': 'lisa.anderson@email.com',
-            'upcoming_visit': datetime.now() + timedelta(days=10),
-            'visit_duration': 6,
-            'hospital': 'Sir Charles Gairdner Hospital',
-            'hospital_address': 'Hospital Avenue, Nedlands WA 6009',
-            'transport_method': 'car',
-            'distance': 18,
-            'status': 'approved',
-            'receipts': ['parking-receipt-005.pdf', 'meal-receipt-005.pdf']
-        }
-    ]
-    return pd.DataFrame(patients_data)
+    with get_metrics().span('data_load'):
+        return get_shared_dataset().snapshot()
 
-# Helper functions
-def calculate_reimbursement(transport_method, distance, duration):
-    if transport_method == 'public':
-        return 0
-    km_reimbursement = distance * 0.44
-    meal_allowance = 25 if duration > 3 else 0
-    return km_reimbursement + meal_allowance
+def counted_cache_data(name, **cache_kwargs):
+    """st.cache_data that also counts requests and misses for the Performance view, labelled cache=name"""
+    def decorator(func):
+        @functools.wraps(func)
+        def compute(*args, **kwargs):
+            get_metrics().increment('cache_misses_total', cache=name)
+            return func(*args, **kwargs)
+        cached = st.cache_data(**cache_kwargs)(compute)
+        
+        @functools.wraps(func)
+        def lookup(*args, **kwargs):
+            get_metrics().increment('cache_requests_total', cache=name)
+            return cached(*args, **kwargs)
+        lookup.clear = cached.clear
+        return lookup
+    return decorator
+
+# Slices and counts are keyed on the store version, so a write invalidates them for every session
+@counted_cache_data('patient_page', max_entries=256)
+def load_patient_page(limit, offset, version):
+    return get_patient_store().select(limit=limit, offset=offset)
+
+@counted_cache_data('patient_count', max_entries=64)
+def count_patients(version, status=None):
+    return get_patient_store().count(status=status)
+
+@st.cache_resource
+def get_derived_indexes():
+    return DerivedIndexes(get_patient_store())
+
+# Shared by every session; rebuilt when another process writes, see DerivedIndexes
+def get_search_index():
+    return get_derived_indexes().get('search', lambda: PatientSearchIndex(get_patient_store().select()))
+
+def get_patient_summary():
+    return get_derived_indexes().get('summary', lambda: PatientSummary(get_patient_store().select()))
+
+def get_analytics_cube():
+    return get_derived_indexes().get('cube', lambda: AnalyticsCube(get_patient_store().select()))
+
+def get_visit_schedule():
+    return get_derived_indexes().get('schedule', lambda: VisitSchedule(get_patient_store().select(status='upcoming')))
+
+def get_receipt_hash_index():
+    return get_derived_indexes().get('receipt_hashes', lambda: ReceiptHashIndex(get_patient_store().receipt_hashes()))
+
+def add_patients(patients):
+    """Commit new patients to the store and fold them into every derived index and aggregate
+
+    Patients without a patient_id are given one by the store; returns the IDs in the order given.
+    """
+    indexes = get_derived_indexes()
+    with indexes.write():
+        search, aggregates = get_search_index(), (get_patient_summary(), get_analytics_cube(), get_visit_schedule())
+        patient_ids = get_patient_store().add_patients(patients)
+        indexes.wrote()
+        patients = [dict(patient, patient_id=patient_id) for patient, patient_id in zip(patients, patient_ids)]
+        new_patients = pd.DataFrame(patients)
+        search.add(patients)
+        for aggregate in aggregates:
+            aggregate.add(new_patients)
+    return patient_ids
+
+def set_claim_status(patient_ids, status, from_status=None):
+    """Apply a status change to many claims atomically and update the derived aggregates; returns the count changed"""
+    indexes = get_derived_indexes()
+    with indexes.write():
+        aggregates = (get_patient_summary(), get_analytics_cube(), get_visit_schedule())
+        before = get_patient_store().update_status(patient_ids, status, from_status=from_status)
+        # Nothing changed means no version bump either
+        if not before.empty:
+            indexes.wrote()
+            for aggregate in aggregates:
+                aggregate.update_status(before, status)
+    return len(before)
 
+def attach_receipts(patient_id, refs, phashes, fare):
+    """Add receipts (and any fare on them) to a claim, updating the receipt hash index and the aggregates, whose totals include at-cost fares"""
+    indexes = get_derived_indexes()
+    with indexes.write():
+        hash_index, aggregates = get_receipt_hash_index(), (get_patient_summary(), get_analytics_cube())
+        before, after = get_patient_store().add_receipts(patient_id, refs, phashes, fare=fare)
+        indexes.wrote()
+        for aggregate in aggregates:
+            aggregate.remove(before)
+            aggregate.add(after)
+        for ref, phash in zip(refs, phashes):
+            if phash is not None:
+                hash_index.add(phash, parse_receipt(ref)[0], patient_id)
+
+def schedule_next_visit(patient_id, visit_date, visit_duration):
+    """Move a patient on to their next visit, keeping the current one in the history, and update the aggregates"""
+    indexes = get_derived_indexes()
+    with indexes.write():
+        aggregates = (get_patient_summary(), get_analytics_cube(), get_visit_schedule())
+        before, after = get_patient_store().schedule_visit(patient_id, visit_date, visit_duration)
+        indexes.wrote()
+        for aggregate in aggregates:
+            aggregate.remove(before)
+            aggregate.add(after)
+
+# Helper functions
 def get_google_maps_link(from_address, to_address):
     encoded_from = urllib.parse.quote(from_address)
     encoded_to = urllib.parse.quote(to_address)
     return f"https://www.google.com/maps/dir/{encoded_from}/{encoded_to}"
 
-def generate_invoice_pdf(patient_data):
-    buffer = io.BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=letter)
-    styles = getSampleStyleSheet()
-    story = []
-    
-    # Title
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=24,
-        textColor=colors.purple,
-        alignment=1
-    )
-    story.append(Paragraph("CLINICAL TRIAL REIMBURSEMENT INVOICE", title_style))
-    story.append(Spacer(1, 12))
-    
-    # Patient details
-    patient_info = [
-        ['Patient ID:', patient_data['patient_id']],
-        ['Patient Name:', patient_data['name']],
-        ['Study:', patient_data['study_name']],
-        ['Visit Date:', patient_data['upcoming_visit'].strftime('%Y-%m-%d')],
-        ['Transport Method:', patient_data['transport_method'].title()],
-        ['Distance:', f"{patient_data['distance']}km"],
-        ['Duration:', f"{patient_data['visit_duration']} hours"]
-    ]
-    
-    patient_table = Table(patient_info, colWidths=[2*inch, 4*inch])
-    patient_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (0, -1), colors.lightgrey),
-        ('TEXTCOLOR', (0, 0), (-1, -1), colors.black),
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 12),
-        ('BACKGROUND', (1, 0), (1, -1), colors.beige),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black)
-    ]))
-    
-    story.append(patient_table)
-    story.append(Spacer(1, 12))
-    
-    # Reimbursement calculation
-    km_reimbursement = patient_data['distance'] * 0.44
-    meal_allowance = 25 if patient_data['visit_duration'] > 3 else 0
-    total_reimbursement = km_reimbursement + meal_allowance
-    
-    reimbursement_info = [
-        ['KM Reimbursement (44¢/km):', f"${km_reimbursement:.2f}"],
-        ['Meal Allowance (>3hrs):', f"${meal_allowance:.2f}"],
-        ['TOTAL REIMBURSEMENT:', f"${total_reimbursement:.2f}"]
-    ]
-    
-    reimbursement_table = Table(reimbursement_info, colWidths=[3*inch, 2*inch])
-    reimbursement_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (0, -1), colors.lightgrey),
-        ('BACKGROUND', (0, -1), (-1, -1), colors.purple),
-        ('TEXTCOLOR', (0, -1), (-1, -1), colors.white),
-        ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
-        ('ALIGN', (1, 0), (1, -1), 'RIGHT'),
-        ('FONTNAME', (0, 0), (-1, -2), 'Helvetica'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 12),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black)
-    ]))
-    
-    story.append(reimbursement_table)
-    story.append(Spacer(1, 12))
-    
-    # Banking details
-    story.append(Paragraph("BANKING DETAILS", styles['Heading2']))
-    banking_info = [
-        ['BSB:', patient_data['bsb']],
-        ['Account Number:', patient_data['account_number']],
-        ['Account Name:', patient_data['name']]
-    ]
-    
-    banking_table = Table(banking_info, colWidths=[2*inch, 4*inch])
-    banking_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (0, -1), colors.lightgrey),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black),
-        ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 12)
-    ]))
-    
-    story.append(banking_table)
-    
-    # Receipts section
-    story.append(Spacer(1, 12))
-    story.append(Paragraph("ATTACHED RECEIPTS", styles['Heading2']))
-    if patient_data['receipts']:
-        for receipt in patient_data['receipts']:
-            story.append(Paragraph(f"• {receipt}", styles['Normal']))
-    else:
-        story.append(Paragraph("No receipts attached", styles['Normal']))
-    
-    doc.build(story)
-    buffer.seek(0)
-    return buffer
-
 def show_new_patient_form():
     """Display the new patient form"""
     st.markdown("""
@@ -316,13 +230,7 @@ def show_new_patient_form():
             st.subheader("Study & Banking Information")
             study_id = st.text_input("Study ID*", placeholder="e.g., CARDIO-2024-001")
             study_name = st.text_input("Study Name*", placeholder="Enter study name")
-            hospital = st.selectbox("Hospital*", [
-                "Royal Perth Hospital",
-                "Sir Charles Gairdner Hospital", 
-                "Fiona Stanley Hospital",
-                "Fremantle Hospital",
-                "Princess Margaret Hospital"
-            ])
+            hospital = st.selectbox("Hospital*", list(HOSPITALS))
             bsb = st.text_input("BSB*", placeholder="XXX-XXX")
             account_number = st.text_input("Account Number*", placeholder="Account number")
             
@@ -337,7 +245,8 @@ def show_new_patient_form():
             st.subheader("Transport Information")
             transport_method = st.selectbox("Transport Method*", ["car", "taxi", "public"])
             if transport_method != "public":
-                distance = st.number_input("Distance (km)*", min_value=1, max_value=200, value=10)
+                st.caption("Distance is calculated from the address postcode")
+                distance = st.number_input("Distance (km), if postcode not recognised", min_value=1, max_value=200, value=10)
             else:
                 distance = 0
                 st.info("Public transport is not eligible for KM reimbursement")
@@ -356,23 +265,15 @@ def show_new_patient_form():
             if not all([name, age, phone, email, address, study_id, study_name, hospital, bsb, account_number]):
                 st.error("Please fill in all required fields marked with *")
             else:
-                # Generate new patient ID
-                existing_patients = load_patient_data()
-                patient_count = len(existing_patients) + 1
-                new_patient_id = f"PT{patient_count:03d}"
-                
-                # Hospital addresses mapping
-                hospital_addresses = {
-                    "Royal Perth Hospital": "197 Wellington Street, Perth WA 6000",
-                    "Sir Charles Gairdner Hospital": "Hospital Avenue, Nedlands WA 6009",
-                    "Fiona Stanley Hospital": "11 Robin Warren Drive, Murdoch WA 6150",
-                    "Fremantle Hospital": "Alma Street, Fremantle WA 6160",
-                    "Princess Margaret Hospital": "Roberts Road, Subiaco WA 6008"
-                }
+                # Offline distance estimate replaces the hand-entered value when the postcode is known
+                if transport_method != "public":
+                    estimated_distance = get_distance_engine().estimate([address], [hospital])[0]
+                    if not np.isnan(estimated_distance):
+                        distance = float(estimated_distance)
                 
                 # Create new patient data
+                # The store allocates the patient ID as it commits, so two coordinators cannot both take it
                 new_patient = {
-                    'patient_id': new_patient_id,
                     'name': name,
                     'account_number': account_number,
                     'bsb': bsb,
@@ -385,13 +286,15 @@ def show_new_patient_form():
                     'upcoming_visit': datetime.combine(visit_date, datetime.min.time()),
                     'visit_duration': visit_duration,
                     'hospital': hospital,
-                    'hospital_address': hospital_addresses[hospital],
+                    'hospital_address': HOSPITALS[hospital]['address'],
                     'transport_method': transport_method,
                     'distance': distance,
                     'status': 'upcoming',
                     'receipts': []
                 }
                 
+                new_patient_id, = add_patients([new_patient])
+                
                 st.success(f"Patient {name} added successfully with ID: {new_patient_id}")
                 st.session_state.show_new_patient_form = False
                 st.rerun()
@@ -453,7 +356,7 @@ def show_participant_dashboard(df):
         return
     
     # Next upcoming visit card
-    upcoming_patients = df[df['status'] == 'upcoming'].sort_values('upcoming_visit')
+    upcoming_patients = get_visit_schedule().next(1)
     if not upcoming_patients.empty:
         next_patient = upcoming_patients.iloc[0]
         
@@ -479,7 +382,7 @@ def show_participant_dashboard(df):
     
     with col1:
         if st.button(" Submit Claims", use_container_width=True):
-            st.success("Claims submission interface opened!")
+            st.session_state.show_receipt_upload = not st.session_state.show_receipt_upload
     
     with col2:
         if st.button(" View Claims", use_container_width=True):
@@ -493,11 +396,103 @@ def show_participant_dashboard(df):
         if st.button(" Contact Support", use_container_width=True):
             st.info("Support contact: (08) 9000-0000")
     
+    if st.session_state.show_receipt_upload:
+        show_receipt_upload_form(df)
+    
     # Patient table
     st.markdown("###  All Registered Patients")
+    show_patient_list()
+
+def show_receipt_upload_form(df):
+    """Attach receipt scans to a patient's claim"""
+    # One lookup table rather than a scan of df per option
+    names = dict(zip(df['patient_id'], df['name']))
+    with st.form("receipt_upload_form", clear_on_submit=True):
+        st.subheader("Submit Claim Receipts")
+        patient_id = st.selectbox("Patient*", df['patient_id'], format_func=lambda pid: f"{pid} - {names[pid]}")
+        uploads = st.file_uploader(
+            "Receipts*", type=['jpg', 'jpeg', 'png', 'webp', 'pdf'], accept_multiple_files=True
+        )
+        fare = st.number_input("Fare on these receipts ($), for taxi trips", min_value=0.0, value=0.0, step=0.5)
+        submitted = st.form_submit_button("Submit Receipts", use_container_width=True)
     
-    # Display patient data in a more readable format
-    for _, patient in df.iterrows():
+    if submitted:
+        if not uploads:
+            st.error("Please attach at least one receipt")
+            return
+        receipt_store = get_receipt_store()
+        refs, phashes = [], []
+        for upload in uploads:
+            data = upload.getvalue()
+            refs.append(receipt_store.put(data, upload.name))
+            phashes.append(perceptual_hash(data))
+        attach_receipts(patient_id, refs, phashes, fare)
+        st.success(f"{len(refs)} receipt(s) attached to {patient_id}")
+
+def find_duplicate_receipts(patient_id, receipts):
+    """[(receipt name, matching patient IDs)] for receipts that look like ones already submitted elsewhere"""
+    hash_index = get_receipt_hash_index()
+    flagged = []
+    for receipt in receipts:
+        digest, name = parse_receipt(receipt)
+        phash = hash_index.hash_for(digest) if digest else None
+        if phash is None:
+            continue
+        matches = hash_index.find_duplicates(phash, digest, patient_id)
+        if matches:
+            flagged.append((name, sorted({match_patient for _, _, match_patient in matches})))
+    return flagged
+
+def show_receipt_thumbnails(receipts, key):
+    """Receipt names, with thumbnails loaded only once the toggle is switched on"""
+    if st.toggle("Show receipt images", key=key):
+        receipt_store = get_receipt_store()
+        for receipt in receipts:
+            thumbnail = receipt_store.thumbnail(receipt)
+            if thumbnail:
+                st.image(thumbnail, caption=receipt_name(receipt), width=120)
+            else:
+                st.write(f"• {receipt_name(receipt)}")
+    else:
+        for receipt in receipts:
+            st.write(f"• {receipt_name(receipt)}")
+
+def mask_account_number(account_number):
+    account_number = str(account_number)
+    return f"•••{account_number[-3:]}" if len(account_number) > 3 else account_number
+
+PATIENT_LIST_PAGE_SIZE = 20
+PAYMENT_LIST_PAGE_SIZE = 20
+BANKING_LIST_PAGE_SIZE = 20
+
+def change_list_page(key, step):
+    st.session_state[f"{key}_page"] = max(0, st.session_state[f"{key}_page"] + step)
+
+def current_list_page(key, total, page_size):
+    """(page, page count) for the list called key, kept within the pages there are now"""
+    page_count = max(1, -(-total // page_size))
+    st.session_state[f"{key}_page"] = min(st.session_state.get(f"{key}_page", 0), page_count - 1)
+    return st.session_state[f"{key}_page"], page_count
+
+def show_list_page_nav(key, page, page_count, total, page_size, noun):
+    """Previous/next buttons and the range shown, for lists of more than one page"""
+    if page_count <= 1:
+        return
+    col_prev, col_page, col_next = st.columns([1, 2, 1])
+    with col_prev:
+        st.button("◀ Previous", key=f"{key}_prev", disabled=page == 0, use_container_width=True,
+                  on_click=change_list_page, args=(key, -1))
+    with col_page:
+        first = page * page_size + 1
+        last = min(total, first + page_size - 1)
+        st.markdown(f"<p style='text-align: center;'>Page {page + 1} of {page_count} · {noun} {first}–{last} of {total}</p>",
+                    unsafe_allow_html=True)
+    with col_next:
+        st.button("Next ▶", key=f"{key}_next", disabled=page >= page_count - 1, use_container_width=True,
+                  on_click=change_list_page, args=(key, 1))
+
+def show_patient_cards(patients):
+    for _, patient in patients.iterrows():
         with st.container():
             st.markdown(f"""
             <div class="patient-card">
@@ -518,42 +513,109 @@ def show_participant_dashboard(df):
                         <strong>Next Visit:</strong><br>
                         {patient['upcoming_visit'].strftime('%Y-%m-%d')}<br>
                         {patient['hospital']}<br>
-                        BSB: {patient['bsb']} | Acc: {patient['account_number']}
+                        BSB: {patient['bsb']} | Acc: {mask_account_number(patient['account_number'])}
                     </div>
                 </div>
             </div>
             """, unsafe_allow_html=True)
+    get_metrics().increment('rows_rendered_total', len(patients), view='patient_list')
+
+@st.fragment
+def show_patient_list():
+    """Render one page of patient cards; page navigation reruns only this fragment"""
+    version = get_patient_store().version()
+    total = count_patients(version)
+    page, page_count = current_list_page('patient_list', total, PATIENT_LIST_PAGE_SIZE)
+    
+    page_df = load_patient_page(PATIENT_LIST_PAGE_SIZE, page * PATIENT_LIST_PAGE_SIZE, version)
+    
+    # Display patient data in a more readable format
+    with get_metrics().span('render_patient_cards'):
+        show_patient_cards(page_df)
+    
+    show_list_page_nav('patient_list', page, page_count, total, PATIENT_LIST_PAGE_SIZE, "Patients")
 
 # Coordinator dashboard
 def show_coordinator_dashboard(df):
     st.title(" Study Coordinator Portal")
     
-    # Summary metrics
+    show_claim_management()
+    show_upcoming_visits()
+
+UPCOMING_VISITS_SHOWN = 10
+
+@st.fragment
+def show_upcoming_visits():
+    """The next upcoming visits, read from the visit schedule, and calendar feeds per hospital or study"""
+    st.markdown("###  Upcoming Visits")
+    schedule = get_visit_schedule()
+    today = pd.Timestamp(datetime.now().date())
+    
+    upcoming = schedule.next(UPCOMING_VISITS_SHOWN, after=today)
+    if upcoming.empty:
+        st.info("No upcoming visits scheduled")
+        return
+    st.dataframe(
+        pd.DataFrame({
+            'Visit': upcoming['upcoming_visit'],
+            'Patient': upcoming['name'],
+            'Patient ID': upcoming['patient_id'],
+            'Study': upcoming['study_name'],
+            'Hospital': upcoming['hospital'],
+            'Duration (hrs)': upcoming['visit_duration']
+        }),
+        hide_index=True,
+        use_container_width=True,
+        column_config={'Visit': st.column_config.DatetimeColumn(format="YYYY-MM-DD HH:mm")}
+    )
+    
+    col1, col2, col3 = st.columns([1, 2, 1])
+    with col1:
+        feed = st.radio("Calendar", ["By Hospital", "By Study"], key="visit_calendar_feed")
+    field = 'hospital' if feed == "By Hospital" else 'study_id'
+    with col2:
+        value = st.selectbox("Hospital" if field == 'hospital' else "Study", schedule.values(field),
+                             key=f"visit_calendar_{field}")
+    with col3:
+        # Built only when the download is clicked, streamed from the schedule in time order
+        st.download_button(
+            label=" Download Calendar",
+            data=lambda: spool(iter_visit_ics(schedule.iter_between(start=today, **{field: value}),
+                                              f"Study visits - {value}")),
+            file_name=f"visits_{value.replace(' ', '_')}.ics",
+            mime="text/calendar",
+            use_container_width=True
+        )
+
+@st.fragment
+def show_claim_management():
+    """Coordinator metrics and claim review; approving a batch reruns only this fragment"""
+    # Reads the shared snapshot itself: fragment arguments would be stale after an approval
+    summary = get_patient_summary()
+    df = load_patient_data()
     completed_patients = df[df['status'] == 'completed']
-    eligible_patients = completed_patients[completed_patients['transport_method'] != 'public']
     
     col1, col2, col3 = st.columns(3)
     
     with col1:
         st.markdown(f"""
         <div class="metric-container">
-            <h3>{len(eligible_patients)}</h3>
+            <h3>{summary.eligible_by_status['completed']}</h3>
             <p>Eligible Patients</p>
         </div>
         """, unsafe_allow_html=True)
     
     with col2:
-        total_km = eligible_patients['distance'].sum() if not eligible_patients.empty else 0
+        total_km = summary.km_by_status['completed']
         st.markdown(f"""
         <div class="metric-container">
-            <h3>{total_km}</h3>
+            <h3>{total_km:,.0f}</h3>
             <p>Total KM</p>
         </div>
         """, unsafe_allow_html=True)
     
     with col3:
-        total_reimbursement = sum(calculate_reimbursement(row['transport_method'], row['distance'], row['visit_duration']) 
-                                for _, row in eligible_patients.iterrows()) if not eligible_patients.empty else 0
+        total_reimbursement = summary.reimbursement_by_status['completed']
         st.markdown(f"""
         <div class="metric-container">
             <h3>${total_reimbursement:.2f}</h3>
@@ -564,153 +626,339 @@ def show_coordinator_dashboard(df):
     # Post-visit claim management
     st.markdown("###  Post-Visit Claim Management")
     
+    if 'claim_review_message' in st.session_state:
+        level, message = st.session_state.pop('claim_review_message')
+        getattr(st, level)(message)
+    
     if completed_patients.empty:
         st.info("No completed visits pending approval.")
     else:
-        for _, patient in completed_patients.iterrows():
-            reimbursement = calculate_reimbursement(patient['transport_method'], patient['distance'], patient['visit_duration'])
-            
-            with st.container():
-                col1, col2, col3, col4 = st.columns([2, 1, 1, 2])
-                
-                with col1:
-                    st.write(f"**{patient['name']}**")
-                    st.write(f"{patient['study_name']}")
-                
-                with col2:
-                    transport_emoji = {"car": "🚗", "taxi": "🚕", "public": "🚌"}
-                    st.write(f"{transport_emoji.get(patient['transport_method'], '🚗')} {patient['transport_method'].title()}")
-                    st.write(f"📏 {patient['distance']}km")
-                
-                with col3:
-                    st.write(f" {patient['visit_duration']}h")
-                    if patient['transport_method'] == 'public':
-                        st.error("Not Eligible")
-                    else:
-                        st.success(f"${reimbursement:.2f}")
-                
-                with col4:
-                    col_approve, col_reject = st.columns(2)
-                    with col_approve:
-                        if st.button(f"Approve", key=f"approve_{patient['patient_id']}", 
-                                   disabled=patient['transport_method'] == 'public'):
-                            st.success(f"Approved claim for {patient['name']}")
-                    
-                    with col_reject:
-                        if st.button(f" Reject", key=f"reject_{patient['patient_id']}"):
-                            st.error(f"Rejected claim for {patient['name']}")
-                
-                st.divider()
+        show_claim_review(completed_patients)
+
+def claim_review_frame(claims):
+    """One row per completed claim with its amount, distance estimate and review flags"""
+    engine = get_distance_engine()
+    estimated_distances = engine.estimate_patients(claims)
+    distance_flags = engine.check_claimed(claims)
+    flags = []
+    for idx, patient in claims.iterrows():
+        patient_flags = []
+        if patient['transport_method'] == 'public':
+            patient_flags.append("Not eligible")
+        if distance_flags[idx]:
+            patient_flags.append("Distance check")
+        for receipt, matched in find_duplicate_receipts(patient['patient_id'], patient['receipts']):
+            patient_flags.append(f"Possible duplicate receipt {receipt} (also on {', '.join(matched)})")
+        flags.append("; ".join(patient_flags))
+    return pd.DataFrame({
+        'Select': False,
+        'Patient ID': claims['patient_id'],
+        'Name': claims['name'],
+        'Study': claims['study_name'],
+        'Transport': claims['transport_method'].str.title(),
+        'Distance (km)': kilometres(claims['distance']),
+        'Estimated (km)': estimated_distances,
+        'Duration (hrs)': claims['visit_duration'],
+        'Reimbursement': calculate_reimbursements(claims)['total'],
+        'Receipts': claims['receipts'].str.len(),
+        'Flags': flags
+    })
+
+def apply_claim_review(status):
+    """Form-submit callback: apply the ticked rows of the review grid as one status change"""
+    rows = st.session_state.claim_review_rows
+    edits = st.session_state.get('claim_review_editor', {}).get('edited_rows', {})
+    selected = rows.iloc[[row for row, changes in edits.items() if changes.get('Select')]]
+    if selected.empty:
+        st.session_state.claim_review_message = ('warning', "Select at least one claim")
+        return
+    if status == 'approved':
+        # Public transport claims are not eligible for reimbursement
+        ineligible = selected['Transport'] == 'Public'
+        changed = set_claim_status(selected.loc[~ineligible, 'Patient ID'], 'approved', from_status='completed')
+        message = f"Approved {changed} claim(s)"
+        if ineligible.any():
+            message += f"; skipped {int(ineligible.sum())} ineligible public transport claim(s)"
+        st.session_state.claim_review_message = ('success', message)
+    else:
+        changed = set_claim_status(selected['Patient ID'], 'rejected', from_status='completed')
+        st.session_state.claim_review_message = ('error', f"Rejected {changed} claim(s)")
+
+def show_claim_review(completed_patients):
+    """Batch review grid: tick claims, then approve or reject them all in one transaction"""
+    col1, col2 = st.columns(2)
+    with col1:
+        studies = st.multiselect("Study", sorted(completed_patients['study_name'].unique()), key="claim_filter_study")
+    with col2:
+        transports = st.multiselect("Transport", sorted(completed_patients['transport_method'].unique()),
+                                    format_func=str.title, key="claim_filter_transport")
+    claims = completed_patients
+    if studies:
+        claims = claims[claims['study_name'].isin(studies)]
+    if transports:
+        claims = claims[claims['transport_method'].isin(transports)]
+    
+    with get_metrics().span('claim_review_frame'):
+        review = claim_review_frame(claims)
+    # The callback maps edited row positions back to claims through the grid as it was shown
+    st.session_state.claim_review_rows = review[['Patient ID', 'Transport']]
+    
+    with st.form("claim_review_form"):
+        st.data_editor(
+            review,
+            hide_index=True,
+            use_container_width=True,
+            disabled=[column for column in review.columns if column != 'Select'],
+            column_config={
+                'Select': st.column_config.CheckboxColumn("Select"),
+                'Estimated (km)': st.column_config.NumberColumn(format="%.1f"),
+                'Reimbursement': st.column_config.NumberColumn(format="$%.2f"),
+                'Flags': st.column_config.TextColumn(width="large")
+            },
+            key="claim_review_editor"
+        )
+        get_metrics().increment('rows_rendered_total', len(review), view='claim_review')
+        col_approve, col_reject = st.columns(2)
+        with col_approve:
+            st.form_submit_button("Approve Selected", use_container_width=True,
+                                  on_click=apply_claim_review, args=('approved',))
+        with col_reject:
+            st.form_submit_button(" Reject Selected", use_container_width=True,
+                                  on_click=apply_claim_review, args=('rejected',))
+    
+# Per-claim actions run as fragments so a click re-executes only its own card, not the whole dashboard
+@st.fragment
+def show_invoice_action(patient, label, download_label, file_name, key):
+    """Render the invoice for one claim on demand and offer it for download"""
+    if st.button(label, key=key):
+        pdf_buffer = generate_invoice_pdf(patient)
+        st.download_button(
+            label=download_label,
+            data=pdf_buffer.getvalue(),
+            file_name=file_name,
+            mime="application/pdf",
+            on_click="ignore",
+            key=f"{key}_download"
+        )
+
+@st.fragment
+def show_mark_paid_action(patient):
+    if st.button(f" Mark as Paid", key=f"paid_{patient['patient_id']}"):
+        if set_claim_status([patient['patient_id']], 'paid', from_status='approved'):
+            st.success(f"Payment processed for {patient['name']}")
+        else:
+            st.info(f"{patient['name']}'s claim is no longer awaiting payment")
 
 # Admin dashboard
+SEARCH_RESULT_LIMIT = 100
+
+ADMIN_SECTIONS = ["Patient Management", "Reimbursement Management", "Analytics", "Banking", "Performance"]
+
 def show_admin_dashboard(df):
     st.title(" Admin/Finance Portal")
     
-    # Tabs
-    tab1, tab2, tab3, tab4 = st.tabs(["Patient Management", "Reimbursement Management", "Analytics", "Banking"])
+    # Unlike st.tabs, which builds every tab on each rerun, only the selected section is computed
+    section = st.radio("Section", ADMIN_SECTIONS, horizontal=True, label_visibility="collapsed", key="admin_section")
     
-    with tab1:
-        st.markdown("### 👥 Patient Management")
-        
-        # Search functionality
-        search_term = st.text_input(" Search patients...", placeholder="Enter name, ID, or study name")
-        
-        filtered_df = df
-        if search_term:
-            filtered_df = df[
-                df['name'].str.contains(search_term, case=False) |
-                df['patient_id'].str.contains(search_term, case=False) |
-                df['study_name'].str.contains(search_term, case=False)
-            ]
-        
-        # Display patient table
-        st.dataframe(
-            filtered_df[['patient_id', 'name', 'age', 'study_name', 'phone', 'email', 'status']],
-            use_container_width=True
-        )
+    if section == "Patient Management":
+        show_patient_management(df)
+    elif section == "Reimbursement Management":
+        show_reimbursement_management()
+    elif section == "Analytics":
+        show_analytics()
+    elif section == "Banking":
+        show_banking()
+    else:
+        show_performance()
+
+# Section data is keyed on the store version, so it is rebuilt only after a write
+PAYABLE_STATUSES = ['approved', 'completed']
+
+@counted_cache_data('payment_queue', max_entries=64)
+def load_payment_queue(limit, offset, version):
+    """One page of approved claims and their amounts and distance checks, indexed alike"""
+    approved_patients = get_patient_store().select(status='approved', limit=limit, offset=offset)
+    engine = get_distance_engine()
+    payment_checks = pd.DataFrame({
+        'total': calculate_reimbursements(approved_patients)['total'],
+        'estimated_distance': engine.estimate_patients(approved_patients),
+        'distance_flag': engine.check_claimed(approved_patients)
+    }, index=approved_patients.index)
+    return approved_patients, payment_checks
+
+@counted_cache_data('visit_rollups', max_entries=64)
+def load_visit_rollups(scope, version, key=None):
+    return get_patient_store().visit_rollups(scope, key=key)
+
+@counted_cache_data('visit_history', max_entries=64)
+def load_visit_history(patient_id, version):
+    return get_patient_store().visit_history(patient_id=patient_id)
+
+@counted_cache_data('banking_frame', max_entries=64)
+def load_banking_frame(limit, offset, version):
+    """One page of payable claims and the banking table built from them, indexed alike"""
+    payable = get_patient_store().select(status=PAYABLE_STATUSES, limit=limit, offset=offset)
+    banking_df = pd.DataFrame({
+        'Patient ID': payable['patient_id'],
+        'Patient Name': payable['name'],
+        'BSB': payable['bsb'],
+        'Account Number': payable['account_number'],
+        'Amount': calculate_reimbursements(payable)['total'],
+        'Status': payable['status'].str.title(),
+        'Study': payable['study_name'],
+        'Hospital': payable['hospital'],
+        'Route': [get_google_maps_link(a, h) for a, h in zip(payable['address'], payable['hospital_address'])],
+        'From Address': payable['address'],
+        'To Address': payable['hospital_address'],
+        'Distance': kilometres(payable['distance']),
+        'Transport': payable['transport_method'],
+        'Receipts': payable['receipts'].str.len()
+    })
+    return payable, banking_df
+
+def show_patient_management(df):
+    st.markdown("### 👥 Patient Management")
     
-    with tab2:
-        st.markdown("###  Reimbursement Management")
-        
-        # Summary metrics
-        approved_patients = df[df['status'] == 'approved']
-        completed_patients = df[df['status'] == 'completed']
-        
-        col1, col2, col3, col4 = st.columns(4)
-        
+    # Search functionality
+    search_term = st.text_input(" Search patients...", placeholder="Enter name, ID, or study name")
+    
+    filtered_df = df
+    if search_term:
+        matches = get_search_index().search(search_term, limit=SEARCH_RESULT_LIMIT)
+        rank = {patient_id: i for i, patient_id in enumerate(matches)}
+        filtered_df = df[df['patient_id'].isin(rank)].sort_values('patient_id', key=lambda ids: ids.map(rank))
+        st.caption(f"Top {len(filtered_df)} match(es)" if len(matches) == SEARCH_RESULT_LIMIT
+                   else f"{len(filtered_df)} match(es)")
+    
+    # Display patient table
+    st.dataframe(
+        filtered_df[['patient_id', 'name', 'age', 'study_name', 'phone', 'email', 'status']],
+        use_container_width=True
+    )
+    
+    show_visit_history(filtered_df)
+
+def show_visit_history(patients):
+    """One patient's visits and running totals, read from the visit history rollups, and their next-visit booking"""
+    st.markdown("###  Visit History")
+    
+    if 'visit_history_message' in st.session_state:
+        level, message = st.session_state.pop('visit_history_message')
+        getattr(st, level)(message)
+    
+    patient_id = st.selectbox("Patient", patients['patient_id'], index=None, placeholder="Choose a patient",
+                              key="visit_history_patient")
+    if patient_id is None:
+        return
+    
+    version = get_patient_store().version()
+    totals = load_visit_rollups('patient', version, key=patient_id)
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Visits", int(totals['visits'].sum()))
+    with col2:
+        st.metric("Paid", f"${totals.loc[totals['status'] == 'paid', 'amount'].sum():.2f}")
+    with col3:
+        st.metric("Total KM", f"{totals['km'].sum():.0f}")
+    
+    visits = load_visit_history(patient_id, version)
+    st.dataframe(
+        pd.DataFrame({
+            'Visit Date': visits['visit_date'],
+            'Status': visits['status'].str.title(),
+            'Hospital': visits['hospital'],
+            'Transport': visits['transport_method'].str.title(),
+            'Distance (km)': kilometres(visits['distance']),
+            'Duration (hrs)': visits['visit_duration'],
+            'Amount': visits['amount'],
+            'Receipts': visits['receipts'].str.len()
+        }),
+        hide_index=True,
+        use_container_width=True,
+        column_config={'Amount': st.column_config.NumberColumn(format="$%.2f")}
+    )
+    
+    current_visit = patients.loc[patients['patient_id'] == patient_id, 'upcoming_visit'].iloc[0]
+    today = datetime.now().date()
+    next_visit = today if pd.isna(current_visit) else max(today, (current_visit + pd.Timedelta(days=1)).date())
+    with st.form("schedule_visit_form"):
+        st.caption("The current visit stays in the history; its claim must be paid or rejected first")
+        col1, col2 = st.columns(2)
         with col1:
-            st.markdown(f"""
-            <div class="metric-container">
-                <h3>{len(approved_patients)}</h3>
-                <p>Approved Claims</p>
-            </div>
-            """, unsafe_allow_html=True)
-        
+            visit_date = st.date_input("Next Visit Date", min_value=today, value=next_visit)
         with col2:
-            pending_amount = sum(calculate_reimbursement(row['transport_method'], row['distance'], row['visit_duration']) 
-                               for _, row in approved_patients.iterrows()) if not approved_patients.empty else 0
-            st.markdown(f"""
-            <div class="metric-container">
-                <h3>${pending_amount:.2f}</h3>
-                <p>Pending Payments</p>
-            </div>
-            """, unsafe_allow_html=True)
-        
-        with col3:
-            total_completed = sum(calculate_reimbursement(row['transport_method'], row['distance'], row['visit_duration']) 
-                                for _, row in completed_patients.iterrows()) if not completed_patients.empty else 0
-            st.markdown(f"""
-            <div class="metric-container">
-                <h3>${total_completed:.2f}</h3>
-                <p>Total Completed</p>
-            </div>
-            """, unsafe_allow_html=True)
-        
-        with col4:
-            avg_claim = (pending_amount / len(approved_patients)) if len(approved_patients) > 0 else 0
-            st.markdown(f"""
-            <div class="metric-container">
-                <h3>${avg_claim:.2f}</h3>
-                <p>Average Claim</p>
-            </div>
-            """, unsafe_allow_html=True)
-        
-        # Enhanced reimbursement table with Google Maps and Invoice functionality
-        st.markdown("###  Payment Processing")
-        
-        if approved_patients.empty:
-            st.info("No approved claims pending payment.")
-        else:
-            # Create enhanced dataframe for display
-            payment_data = []
-            for _, patient in approved_patients.iterrows():
-                reimbursement = calculate_reimbursement(patient['transport_method'], patient['distance'], patient['visit_duration'])
-                km_cost = patient['distance'] * 0.44 if patient['transport_method'] != 'public' else 0
-                meal_allowance = 25 if patient['visit_duration'] > 3 else 0
-                
-                payment_data.append({
-                    'Patient ID': patient['patient_id'],
-                    'Name': patient['name'],
-                    'Study': patient['study_name'],
-                    'Transport': patient['transport_method'].title(),
-                    'Distance (km)': patient['distance'],
-                    'Duration (hrs)': patient['visit_duration'],
-                    'KM Cost': f"${km_cost:.2f}",
-                    'Meal Allowance': f"${meal_allowance:.2f}",
-                    'Total Reimbursement': f"${reimbursement:.2f}",
-                    'BSB': patient['bsb'],
-                    'Account': patient['account_number'],
-                    'Hospital': patient['hospital'],
-                    'Patient Address': patient['address'],
-                    'Hospital Address': patient['hospital_address'],
-                    'Receipts': len(patient['receipts'])
-                })
-            
-            payment_df = pd.DataFrame(payment_data)
-            
-            # Display each payment with enhanced functionality
-            for i, (_, patient) in enumerate(approved_patients.iterrows()):
-                reimbursement = calculate_reimbursement(patient['transport_method'], patient['distance'], patient['visit_duration'])
+            visit_duration = st.number_input("Visit Duration (hours)", min_value=1, max_value=8, value=3)
+        if st.form_submit_button("Schedule Next Visit"):
+            try:
+                schedule_next_visit(patient_id, datetime.combine(visit_date, datetime.min.time()), visit_duration)
+            except ValueError as e:
+                st.error(str(e))
+            else:
+                st.session_state.visit_history_message = (
+                    'success', f"Next visit for {patient_id} booked for {visit_date:%B %d, %Y}"
+                )
+                st.rerun()
+
+def show_reimbursement_management():
+    st.markdown("###  Reimbursement Management")
+    
+    # Summary metrics
+    summary = get_patient_summary()
+    approved_count = summary.count('approved')
+    page, page_count = current_list_page('payment_list', approved_count, PAYMENT_LIST_PAGE_SIZE)
+    approved_patients, payment_checks = load_payment_queue(
+        PAYMENT_LIST_PAGE_SIZE, page * PAYMENT_LIST_PAGE_SIZE, get_patient_store().version()
+    )
+    
+    col1, col2, col3, col4 = st.columns(4)
+    
+    with col1:
+        st.markdown(f"""
+        <div class="metric-container">
+            <h3>{approved_count}</h3>
+            <p>Approved Claims</p>
+        </div>
+        """, unsafe_allow_html=True)
+    
+    with col2:
+        pending_amount = summary.reimbursement_by_status['approved']
+        st.markdown(f"""
+        <div class="metric-container">
+            <h3>${pending_amount:.2f}</h3>
+            <p>Pending Payments</p>
+        </div>
+        """, unsafe_allow_html=True)
+    
+    with col3:
+        total_completed = summary.reimbursement_by_status['completed']
+        st.markdown(f"""
+        <div class="metric-container">
+            <h3>${total_completed:.2f}</h3>
+            <p>Total Completed</p>
+        </div>
+        """, unsafe_allow_html=True)
+    
+    with col4:
+        avg_claim = (pending_amount / approved_count) if approved_count > 0 else 0
+        st.markdown(f"""
+        <div class="metric-container">
+            <h3>${avg_claim:.2f}</h3>
+            <p>Average Claim</p>
+        </div>
+        """, unsafe_allow_html=True)
+    
+    # Enhanced reimbursement table with Google Maps and Invoice functionality
+    st.markdown("###  Payment Processing")
+    
+    if approved_count == 0:
+        st.info("No approved claims pending payment.")
+    else:
+        # Display each payment with enhanced functionality
+        estimated_distances = payment_checks['estimated_distance']
+        distance_flags = payment_checks['distance_flag']
+        with get_metrics().span('render_payment_cards'):
+            for idx, patient in approved_patients.iterrows():
+                reimbursement = payment_checks.at[idx, 'total']
                 
                 with st.expander(f" {patient['name']} - ${reimbursement:.2f}", expanded=False):
                     col1, col2, col3 = st.columns([2, 2, 1])
@@ -731,7 +979,11 @@ def show_admin_dashboard(df):
                         st.write("**Visit Details:**")
                         st.write(f"• Hospital: {patient['hospital']}")
                         st.write(f"• Transport: {patient['transport_method'].title()}")
-                        st.write(f"• Distance: {patient['distance']}km")
+                        st.write(f"• Distance: {format_km(patient['distance'])}km")
+                        if not np.isnan(estimated_distances[idx]):
+                            st.write(f"• Estimated Distance: {estimated_distances[idx]:.1f}km")
+                        if distance_flags[idx]:
+                            st.warning("Claimed distance differs from the estimate")
                         st.write(f"• Duration: {patient['visit_duration']} hours")
                     
                     with col3:
@@ -746,146 +998,193 @@ def show_admin_dashboard(df):
                         """, unsafe_allow_html=True)
                         
                         # Download invoice button
-                        if st.button(f" Generate Invoice", key=f"invoice_{patient['patient_id']}"):
-                            pdf_buffer = generate_invoice_pdf(patient)
-                            
-                            # Create download button
-                            st.download_button(
-                                label=" Download Invoice PDF",
-                                data=pdf_buffer.getvalue(),
-                                file_name=f"invoice_{patient['patient_id']}_{patient['name'].replace(' ', '_')}.pdf",
-                                mime="application/pdf",
-                                key=f"download_{patient['patient_id']}"
-                            )
+                        show_invoice_action(patient, " Generate Invoice", " Download Invoice PDF",
+                                            invoice_filename(patient), key=f"invoice_{patient['patient_id']}")
                         
                         # View receipts
                         if patient['receipts']:
                             st.write(f"📎 {len(patient['receipts'])} Receipt(s)")
-                            for receipt in patient['receipts']:
-                                st.write(f"• {receipt}")
+                            show_receipt_thumbnails(patient['receipts'], key=f"receipt_images_{patient['patient_id']}")
                         else:
                             st.write("📎 No receipts")
                         
                         # Payment status
-                        if st.button(f" Mark as Paid", key=f"paid_{patient['patient_id']}"):
-                            st.success(f"Payment processed for {patient['name']}")
-            
-            # Bulk export functionality
-            st.markdown("### Bulk Export Options")
-            col1, col2, col3 = st.columns(3)
-            
-            with col1:
-                if st.button(" Export Payment Data", use_container_width=True):
-                    csv_buffer = io.StringIO()
-                    payment_df.to_csv(csv_buffer, index=False)
-                    st.download_button(
-                        label=" Download CSV",
-                        data=csv_buffer.getvalue(),
-                        file_name=f"payment_data_{datetime.now().strftime('%Y%m%d')}.csv",
-                        mime="text/csv"
-                    )
-            
-            with col2:
-                if st.button(" Banking Summary", use_container_width=True):
-                    banking_summary = payment_df[['Name', 'BSB', 'Account', 'Total Reimbursement']].copy()
-                    st.dataframe(banking_summary, use_container_width=True)
-            
-            with col3:
-                if st.button(" All Routes", use_container_width=True):
-                    st.markdown("**Google Maps Links for All Patients:**")
-                    for _, patient in approved_patients.iterrows():
-                        maps_link = get_google_maps_link(patient['address'], patient['hospital_address'])
-                        st.markdown(f"• [{patient['name']}]({maps_link}) - {patient['hospital']}")
-    
-    with tab3:
-        st.markdown("###  Analytics Dashboard")
+                        show_mark_paid_action(patient)
+        get_metrics().increment('rows_rendered_total', len(approved_patients), view='payments')
+        show_list_page_nav('payment_list', page, page_count, approved_count, PAYMENT_LIST_PAGE_SIZE, "Claims")
         
-        # Transport method distribution
-        col1, col2 = st.columns(2)
+        # Bulk export functionality
+        st.markdown("### Bulk Export Options")
+        col1, col2, col3 = st.columns(3)
         
         with col1:
-            transport_counts = df['transport_method'].value_counts()
-            fig_transport = px.pie(
-                values=transport_counts.values,
-                names=transport_counts.index,
-                title="Transport Method Distribution",
-                color_discrete_sequence=['#667eea', '#764ba2', '#8e24aa']
+            # Built only when the download is clicked, streamed from the store in chunks
+            st.download_button(
+                label=" Export Payment Data",
+                data=lambda: spool(iter_payment_csv(get_patient_store().iter_chunks(status='approved'))),
+                file_name=f"payment_data_{datetime.now().strftime('%Y%m%d')}.csv",
+                mime="text/csv",
+                use_container_width=True
             )
-            st.plotly_chart(fig_transport, use_container_width=True)
         
         with col2:
-            # Eligibility chart
-            eligible_count = len(df[df['transport_method'] != 'public'])
-            ineligible_count = len(df[df['transport_method'] == 'public'])
-            
-            fig_eligibility = px.bar(
-                x=['Eligible', 'Not Eligible'],
-                y=[eligible_count, ineligible_count],
-                title="Reimbursement Eligibility",
-                color=['Eligible', 'Not Eligible'],
-                color_discrete_map={'Eligible': '#4CAF50', 'Not Eligible': '#f44336'}
-            )
-            st.plotly_chart(fig_eligibility, use_container_width=True)
+            # Every approved claim, not just the page shown, so read from the store only when asked for
+            if st.button(" Banking Summary", use_container_width=True):
+                banking_summary = payment_export_frame(get_patient_store().select(status='approved'))[['Name', 'BSB', 'Account', 'Total Reimbursement']]
+                st.dataframe(
+                    banking_summary,
+                    use_container_width=True,
+                    column_config={'Total Reimbursement': st.column_config.NumberColumn(format="$%.2f")}
+                )
         
-        # Distance distribution
-        eligible_df = df[df['transport_method'] != 'public']
-        if not eligible_df.empty:
-            fig_distance = px.histogram(
-                eligible_df,
-                x='distance',
-                title="Distance Distribution (Eligible Patients)",
-                nbins=20,
-                color_discrete_sequence=['#764ba2']
-            )
-            fig_distance.update_layout(
-                xaxis_title="Distance (km)",
-                yaxis_title="Number of Patients"
-            )
-            st.plotly_chart(fig_distance, use_container_width=True)
+        with col3:
+            if st.button(" All Routes", use_container_width=True):
+                st.markdown("**Google Maps Links for All Patients:**")
+                for _, patient in get_patient_store().select(status='approved').iterrows():
+                    maps_link = get_google_maps_link(patient['address'], patient['hospital_address'])
+                    st.markdown(f"• [{patient['name']}]({maps_link}) - {patient['hospital']}")
         
-        # Study participation
-        study_counts = df['study_name'].value_counts()
-        fig_studies = px.bar(
-            x=study_counts.index,
-            y=study_counts.values,
-            title="Patients per Study",
-            color_discrete_sequence=['#8e24aa']
-        )
-        fig_studies.update_layout(xaxis_tickangle=-45)
-        st.plotly_chart(fig_studies, use_container_width=True)
-    
-    with tab4:
-        st.markdown("###  Banking & Payment Details")
+        # Bulk invoice generation
+        st.markdown("### Bulk Invoices")
+        col1, col2 = st.columns([2, 1])
+        
+        with col1:
+            bulk_format = st.radio("Format", ["ZIP of PDFs", "Merged PDF"], horizontal=True, key="bulk_invoice_format")
         
-        # Banking summary table
-        banking_data = []
-        for _, patient in df.iterrows():
-            if patient['status'] in ['approved', 'completed']:
-                reimbursement = calculate_reimbursement(patient['transport_method'], patient['distance'], patient['visit_duration'])
+        with col2:
+            if st.button(f" Generate All Invoices ({approved_count})", use_container_width=True):
+                approved_patients = get_patient_store().select(status='approved')
+                progress_bar = st.progress(0.0, text="Generating invoices...")
                 
-                banking_data.append({
-                    'Patient ID': patient['patient_id'],
-                    'Patient Name': patient['name'],
-                    'BSB': patient['bsb'],
-                    'Account Number': patient['account_number'],
-                    'Amount': reimbursement,
-                    'Status': patient['status'].title(),
-                    'Study': patient['study_name'],
-                    'Hospital': patient['hospital'],
-                    'Route': get_google_maps_link(patient['address'], patient['hospital_address']),
-                    'From Address': patient['address'],
-                    'To Address': patient['hospital_address'],
-                    'Distance': patient['distance'],
-                    'Transport': patient['transport_method'],
-                    'Receipts': len(patient['receipts'])
-                })
+                def update_progress(done, total):
+                    progress_bar.progress(done / total, text=f"Generated {done} of {total} invoices")
+                
+                buffer = io.BytesIO()
+                stamp = datetime.now().strftime('%Y%m%d')
+                if bulk_format == "ZIP of PDFs":
+                    write_invoices_zip(approved_patients, buffer, progress=update_progress)
+                    file_name, mime = f"invoices_{stamp}.zip", "application/zip"
+                else:
+                    write_merged_invoice_pdf(approved_patients, buffer, progress=update_progress)
+                    file_name, mime = f"invoices_{stamp}.pdf", "application/pdf"
+                
+                st.download_button(
+                    label=" Download Invoices",
+                    data=buffer.getvalue(),
+                    file_name=file_name,
+                    mime=mime,
+                    key="bulk_invoice_download"
+                )
+
+@counted_cache_data('analytics_figures', max_entries=8)
+def build_analytics_figures(version):
+    """The Analytics charts, drawn from the cube once per store version"""
+    store = get_patient_store()
+    with get_metrics().span('plotly_figures'):
+        return _analytics_figures(get_analytics_cube(), store.visit_rollups('month'), store.visit_rollups('study'))
+
+def _analytics_figures(cube, monthly, by_study):
+    # Plotly is loaded on the first visit to Analytics rather than at app startup
+    import plotly.express as px
+    
+    figures = {}
+    
+    # Transport method distribution
+    transport_counts = cube.totals('transport_method')
+    figures['transport'] = px.pie(
+        values=transport_counts.values,
+        names=transport_counts.index,
+        title="Transport Method Distribution",
+        color_discrete_sequence=['#667eea', '#764ba2', '#8e24aa']
+    )
+    
+    # Eligibility chart
+    ineligible_count = int(transport_counts.get('public', 0))
+    eligible_count = int(transport_counts.sum()) - ineligible_count
+    figures['eligibility'] = px.bar(
+        x=['Eligible', 'Not Eligible'],
+        y=[eligible_count, ineligible_count],
+        title="Reimbursement Eligibility",
+        color=['Eligible', 'Not Eligible'],
+        color_discrete_map={'Eligible': '#4CAF50', 'Not Eligible': '#f44336'}
+    )
+    
+    # Distance distribution, binned server-side
+    bin_edges, bin_counts = cube.distance_histogram(exclude_transport='public')
+    if bin_counts.any():
+        bin_labels = [f"{lo}–{hi}" for lo, hi in zip(bin_edges[:-2], bin_edges[1:-1])] + [f"{bin_edges[-2]}+"]
+        figures['distance'] = px.bar(
+            x=bin_labels,
+            y=bin_counts,
+            title="Distance Distribution (Eligible Patients)",
+            color_discrete_sequence=['#764ba2']
+        )
+        figures['distance'].update_layout(
+            xaxis_title="Distance (km)",
+            yaxis_title="Number of Patients",
+            bargap=0
+        )
+    
+    # Study participation
+    study_counts = cube.totals('study_name')
+    figures['studies'] = px.bar(
+        x=study_counts.index,
+        y=study_counts.values,
+        title="Patients per Study",
+        color_discrete_sequence=['#8e24aa']
+    )
+    figures['studies'].update_layout(xaxis_tickangle=-45)
+    
+    # Visit history, from the month and study rollups rather than the visits themselves
+    figures['monthly'] = px.bar(
+        monthly, x='key', y='amount', color='status',
+        title="Reimbursement by Visit Month",
+        labels={'key': 'Month', 'amount': 'Reimbursement ($)', 'status': 'Status'}
+    )
+    figures['study_amounts'] = px.bar(
+        by_study, x='key', y='amount', color='status',
+        title="Reimbursement by Study",
+        labels={'key': 'Study', 'amount': 'Reimbursement ($)', 'status': 'Status'}
+    )
+    figures['study_amounts'].update_layout(xaxis_tickangle=-45)
+    return figures
+
+def show_analytics():
+    st.markdown("###  Analytics Dashboard")
+    
+    figures = build_analytics_figures(get_patient_store().version())
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        st.plotly_chart(figures['transport'], use_container_width=True)
+    with col2:
+        st.plotly_chart(figures['eligibility'], use_container_width=True)
+    
+    if 'distance' in figures:
+        st.plotly_chart(figures['distance'], use_container_width=True)
+    
+    st.plotly_chart(figures['studies'], use_container_width=True)
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        st.plotly_chart(figures['monthly'], use_container_width=True)
+    with col2:
+        st.plotly_chart(figures['study_amounts'], use_container_width=True)
+
+def show_banking():
+    st.markdown("###  Banking & Payment Details")
+    
+    # Banking summary table
+    summary = get_patient_summary()
+    payable_count = sum(summary.count(status) for status in PAYABLE_STATUSES)
+    page, page_count = current_list_page('banking_list', payable_count, BANKING_LIST_PAGE_SIZE)
+    payable, banking_df = load_banking_frame(BANKING_LIST_PAGE_SIZE, page * BANKING_LIST_PAGE_SIZE, get_patient_store().version())
+    
+    if payable_count:
+        # Enhanced banking table with clickable links
+        st.markdown("**Payment-Ready Accounts:**")
         
-        if banking_data:
-            banking_df = pd.DataFrame(banking_data)
-            
-            # Enhanced banking table with clickable links
-            st.markdown("**Payment-Ready Accounts:**")
-            
+        with get_metrics().span('render_banking_rows'):
             for _, row in banking_df.iterrows():
                 with st.container():
                     col1, col2, col3, col4 = st.columns([2, 2, 1, 1])
@@ -909,32 +1208,154 @@ def show_admin_dashboard(df):
                         st.write(f"📎 {row['Receipts']} Receipt(s)")
                     
                     with col4:
-                        patient_data = df[df['patient_id'] == row['Patient ID']].iloc[0]
-                        if st.button(f" Invoice", key=f"banking_invoice_{row['Patient ID']}"):
-                            pdf_buffer = generate_invoice_pdf(patient_data)
-                            st.download_button(
-                                label=" Download",
-                                data=pdf_buffer.getvalue(),
-                                file_name=f"invoice_{row['Patient ID']}.pdf",
-                                mime="application/pdf",
-                                key=f"banking_download_{row['Patient ID']}"
-                            )
+                        show_invoice_action(payable.loc[row.name], " Invoice", " Download",
+                                            f"invoice_{row['Patient ID']}.pdf", key=f"banking_invoice_{row['Patient ID']}")
                     
                     st.divider()
-            
-            # Payment summary
-            total_payments = banking_df['Amount'].sum()
-            st.markdown(f"""
-            <div class="highlight-card">
-                <h3> Payment Summary</h3>
-                <p><strong>Total Pending Payments:</strong> ${total_payments:.2f}</p>
-                <p><strong>Number of Accounts:</strong> {len(banking_df)}</p>
-                <p><strong>Average Payment:</strong> ${total_payments/len(banking_df):.2f}</p>
-            </div>
-            """, unsafe_allow_html=True)
+        get_metrics().increment('rows_rendered_total', len(banking_df), view='banking')
+        show_list_page_nav('banking_list', page, page_count, payable_count, BANKING_LIST_PAGE_SIZE, "Accounts")
         
+        # Payment summary, over every payable claim rather than the page shown
+        total_payments = sum(summary.reimbursement_by_status[status] for status in PAYABLE_STATUSES)
+        st.markdown(f"""
+        <div class="highlight-card">
+            <h3> Payment Summary</h3>
+            <p><strong>Total Pending Payments:</strong> ${total_payments:.2f}</p>
+            <p><strong>Number of Accounts:</strong> {payable_count}</p>
+            <p><strong>Average Payment:</strong> ${total_payments/payable_count:.2f}</p>
+        </div>
+        """, unsafe_allow_html=True)
+        
+        show_aba_export()
+    
+    else:
+        st.info("No banking details available for current patients.")
+
+# Every generated ABA file is kept here before its claims are marked paid
+PAYMENT_FILE_DIR = os.environ.get('REIMBURSED_PAYMENT_FILES', os.path.join(PROJECT_DIR, 'payment_files'))
+
+def save_payment_file(data, processing_date):
+    """Write an ABA file to PAYMENT_FILE_DIR under a new name and return its path"""
+    os.makedirs(PAYMENT_FILE_DIR, exist_ok=True)
+    path = os.path.join(PAYMENT_FILE_DIR, f"payments_{processing_date:%Y%m%d}_{datetime.now():%H%M%S%f}.aba")
+    with open(path, 'xb') as f:
+        f.write(data)
+    return path
+
+def show_aba_export():
+    """Bulk direct-entry (ABA) payment file for every approved claim; claims in the file are marked paid"""
+    st.markdown("###  Bulk Payment File (ABA)")
+    st.caption(f"Pays every approved claim. Each file is saved to {PAYMENT_FILE_DIR} before its claims are marked paid.")
+    
+    with st.form("aba_export_form"):
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            user_name = st.text_input("Payer Name*", value=os.environ.get('ABA_USER_NAME', ''))
+            apca_id = st.text_input("APCA User ID*", value=os.environ.get('ABA_APCA_ID', ''), max_chars=6)
+        with col2:
+            bank_code = st.text_input("Bank Code*", value=os.environ.get('ABA_BANK_CODE', ''), max_chars=3, placeholder="e.g., CBA")
+            remitter = st.text_input("Remitter Name*", value=os.environ.get('ABA_REMITTER', ''), max_chars=16)
+        with col3:
+            trace_bsb = st.text_input("Payer BSB*", value=os.environ.get('ABA_TRACE_BSB', ''), placeholder="XXX-XXX")
+            trace_account = st.text_input("Payer Account*", value=os.environ.get('ABA_TRACE_ACCOUNT', ''))
+        processing_date = st.date_input("Processing Date", value=datetime.now().date())
+        submitted = st.form_submit_button("Generate ABA File", use_container_width=True)
+    
+    if submitted:
+        if not all([user_name, apca_id, bank_code, remitter, trace_bsb, trace_account]):
+            st.error("Please fill in all required fields marked with *")
+            return
+        fileobj = io.BytesIO()
+        try:
+            count, total_cents, rejects, paid_ids = write_aba_file(
+                get_patient_store().iter_chunks(status='approved'), fileobj,
+                user_name=user_name, apca_id=apca_id, bank_code=bank_code, trace_bsb=trace_bsb,
+                trace_account=trace_account, remitter=remitter, processing_date=processing_date
+            )
+        except ValueError as e:
+            st.error(str(e))
+            return
+        
+        if not paid_ids:
+            st.info("No approved claims to pay; no file was saved.")
         else:
-            st.info("No banking details available for current patients.")
+            # Claims are marked paid only once the file that pays them is safely on disk
+            data = fileobj.getvalue()
+            try:
+                path = save_payment_file(data, processing_date)
+            except OSError as e:
+                st.error(f"Could not save the ABA file, so no claims were marked paid: {e}")
+                return
+            # Only claims still approved are marked, so a concurrent change is not overwritten
+            marked = set_claim_status(paid_ids, 'paid', from_status='approved')
+            st.success(f"{count} payment(s) totalling ${total_cents / 100:.2f}; {marked} claim(s) marked paid. Saved to {path}")
+            st.download_button(
+                label=" Download ABA File",
+                data=data,
+                file_name=os.path.basename(path),
+                mime="text/plain",
+                key="aba_download"
+            )
+        if not rejects.empty:
+            st.warning(f"{len(rejects)} claim(s) rejected")
+            st.dataframe(rejects, use_container_width=True, hide_index=True)
+
+def show_performance():
+    st.markdown("###  Performance")
+    
+    metrics = get_metrics()
+    st.caption(f"Process-wide, across all sessions, since {datetime.fromtimestamp(metrics.started):%Y-%m-%d %H:%M:%S}")
+    
+    # Timing spans
+    spans = pd.DataFrame(metrics.spans(), columns=['name', 'count', 'total', 'mean', 'max', 'last'])
+    spans[['total', 'mean', 'max', 'last']] *= 1000
+    st.markdown("**Timing Spans (ms)**")
+    st.dataframe(
+        spans.sort_values('total', ascending=False),
+        hide_index=True,
+        use_container_width=True,
+        column_config={column: st.column_config.NumberColumn(format="%.1f") for column in ['total', 'mean', 'max', 'last']}
+    )
+    
+    counters = pd.DataFrame(metrics.counters(), columns=['name', 'labels', 'value'])
+    is_cache = counters['name'].isin(['cache_requests_total', 'cache_misses_total'])
+    
+    # Cache effectiveness
+    caches = counters[is_cache].assign(cache=counters['labels'].str.get('cache'))
+    caches = caches.pivot_table(index='cache', columns='name', values='value', aggfunc='sum', fill_value=0)
+    caches = caches.reindex(columns=['cache_requests_total', 'cache_misses_total'], fill_value=0)
+    caches.columns = ['Requests', 'Misses']
+    caches['Hits'] = caches['Requests'] - caches['Misses']
+    caches['Hit Rate'] = (caches['Hits'] / caches['Requests'].where(caches['Requests'] > 0)).fillna(0)
+    st.markdown("**Caches**")
+    st.dataframe(caches, use_container_width=True,
+                 column_config={'Hit Rate': st.column_config.ProgressColumn(format="percent", min_value=0, max_value=1)})
+    
+    # Everything else: PDFs generated, rows rendered
+    other = counters[~is_cache]
+    st.markdown("**Counters**")
+    st.dataframe(
+        pd.DataFrame({
+            'Counter': other['name'],
+            'Labels': other['labels'].map(lambda labels: ', '.join(f"{key}={value}" for key, value in labels.items())),
+            'Value': other['value']
+        }),
+        hide_index=True,
+        use_container_width=True
+    )
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.download_button(" Prometheus Metrics", data=metrics.to_prometheus, file_name="reimbursed_metrics.prom",
+                           mime="text/plain", on_click="ignore", use_container_width=True)
+    with col2:
+        st.download_button(" JSON Metrics", data=metrics.to_json, file_name="reimbursed_metrics.json",
+                           mime="application/json", on_click="ignore", use_container_width=True)
+    with col3:
+        st.button("Reset Metrics", on_click=metrics.reset, use_container_width=True)
+    
+    if METRICS_FILE:
+        st.caption(f"Also written to {METRICS_FILE} at most every {METRICS_EXPORT_INTERVAL}s")
 
 # Main application
 def main():
@@ -957,10 +1378,11 @@ def main():
             st.divider()
             
             # System stats
+            summary = get_patient_summary()
             st.markdown("###  System Overview")
-            st.metric("Total Patients", len(df))
-            st.metric("Active Studies", df['study_name'].nunique())
-            st.metric("Upcoming Visits", len(df[df['status'] == 'upcoming']))
+            st.metric("Total Patients", summary.total)
+            st.metric("Active Studies", summary.active_studies)
+            st.metric("Upcoming Visits", summary.count('upcoming'))
             
             # Recent activity
             st.markdown("###  Recent Activity")
@@ -977,4 +1399,7 @@ def main():
             show_admin_dashboard(df)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    with get_metrics().span('rerun'):
+        main()
+    if METRICS_FILE:
+        get_metrics().export(METRICS_FILE, min_interval=METRICS_EXPORT_INTERVAL)
\ No newline at end of file
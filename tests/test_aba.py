@@ -0,0 +1,120 @@
+import io
+import json
+from datetime import date, timedelta
+
+import pandas as pd
+import pytest
+
+from reimbursed.cli import main
+from reimbursed.exports import ABA_RECORD_LENGTH, write_aba_file
+from reimbursed.store import PatientStore
+
+PAYER = dict(user_name='ARA CLINICAL', apca_id='123456', bank_code='CBA', trace_bsb='062-000',
+             trace_account='12345678', remitter='ARA TRIALS')
+
+def claim(patient_id, name='Sarah Mitchell', bsb='036-012', account='123456789', transport='car',
+          distance=18, duration=6):
+    # At the default rates: 18 km at 44c plus the $25 meal allowance for visits over 3 hours
+    return {
+        'patient_id': patient_id, 'name': name, 'bsb': bsb, 'account_number': account,
+        'study_id': 'CARDIO-2024-001', 'transport_method': transport, 'distance': distance,
+        'visit_duration': duration, 'fare': 0.0, 'upcoming_visit': pd.Timestamp('2026-01-05 09:00'),
+    }
+
+def write(claims, **overrides):
+    fileobj = io.BytesIO()
+    result = write_aba_file([pd.DataFrame(claims)], fileobj, processing_date='2026-01-31', **{**PAYER, **overrides})
+    return fileobj.getvalue().decode('ascii'), result
+
+def test_records_are_fixed_width_and_the_footer_totals_the_credits():
+    text, (count, total_cents, rejects, paid_ids) = write([claim('PT001'), claim('PT002', distance=10, duration=2)])
+
+    assert text.endswith('\r\n')
+    lines = text.split('\r\n')[:-1]
+    assert [len(line) for line in lines] == [ABA_RECORD_LENGTH] * 4
+    assert [line[0] for line in lines] == ['0', '1', '1', '7']
+
+    header = lines[0]
+    assert header[18:20] == '01' and header[20:23] == 'CBA'
+    assert header[30:56] == PAYER['user_name'].ljust(26) and header[56:62] == '123456'
+    assert header[74:80] == '310126'
+
+    detail = lines[1]
+    assert detail[1:8] == '036-012' and detail[8:17] == '123456789' and detail[18:20] == '50'
+    assert detail[20:30] == '0000003292'
+    assert detail[30:62] == 'SARAH MITCHELL'.ljust(32)
+    assert detail[62:80] == 'REIMB PT001'.ljust(18)
+    assert detail[80:87] == '062-000' and detail[87:96] == ' 12345678'
+    assert lines[2][20:30] == '0000000440'
+
+    footer = lines[3]
+    assert footer[:8] == '7999-999'
+    assert footer[20:30] == footer[30:40] == '0000003732'
+    assert footer[40:50] == '0' * 10
+    assert footer[74:80] == '000002'
+    assert (count, total_cents, paid_ids) == (2, 3732, ['PT001', 'PT002'])
+    assert rejects.empty
+
+def test_invalid_claims_are_rejected_with_a_reason_and_left_out():
+    text, (count, total_cents, rejects, paid_ids) = write([
+        claim('PT001'),
+        claim('PT002', bsb='12-345'),
+        claim('PT003', account='12ab'),
+        claim('PT004', name=' '),
+        claim('PT005', transport='public', distance=0, duration=2),
+    ])
+
+    assert dict(zip(rejects['Patient ID'], rejects['Reason'])) == {
+        'PT002': 'Invalid BSB',
+        'PT003': 'Invalid account number',
+        'PT004': 'Missing account name',
+        'PT005': 'Nothing to pay',
+    }
+    assert (count, total_cents, paid_ids) == (1, 3292, ['PT001'])
+    assert text.split('\r\n')[-2][74:80] == '000001'
+
+def test_payer_account_must_be_valid():
+    with pytest.raises(ValueError):
+        write([claim('PT001')], trace_account='12-34x')
+    with pytest.raises(ValueError):
+        write([claim('PT001')], trace_bsb='0620')
+
+def test_batch_total_over_the_file_limit_is_refused():
+    # $13,225 a claim, so 8,000 of them pass $100m
+    with pytest.raises(ValueError):
+        write([claim(f'PT{n:04d}', distance=30000) for n in range(8000)])
+
+def pay_run_args(db):
+    today = date.today()
+    return ['--db', db, 'pay-run', '--from', today.isoformat(), '--to', (today + timedelta(days=30)).isoformat(),
+            '--invoices', 'none', '--aba'] + [f"--{setting.replace('_', '-')}={value}" for setting, value in PAYER.items()]
+
+def test_payment_run_marks_claims_paid_so_they_are_not_paid_twice(tmp_path):
+    # A new store is seeded with the mock patients, of whom PT005 is approved
+    db = str(tmp_path / 'patients.db')
+    PatientStore(db)
+    args = pay_run_args(db)
+
+    assert main(args + ['--output-dir', str(tmp_path / 'first')]) == 0
+    first = json.loads((tmp_path / 'first' / 'summary.json').read_text())
+    assert first['aba']['payments'] == 1 and first['aba']['marked_paid'] == 1
+    assert PatientStore(db).select(patient_id='PT005')['status'].iloc[0] == 'paid'
+
+    assert main(args + ['--output-dir', str(tmp_path / 'second')]) == 0
+    second = json.loads((tmp_path / 'second' / 'summary.json').read_text())
+    assert second['claims'] == 0 and second['aba']['payments'] == 0
+
+@pytest.mark.parametrize('status', ['completed', 'paid'])
+def test_payment_run_will_not_pay_claims_that_are_not_approved(tmp_path, status):
+    # PT004 is completed but not approved; once paid it must never be paid again
+    db = str(tmp_path / 'patients.db')
+    store = PatientStore(db)
+    if status == 'paid':
+        store.update_status(['PT004'], 'paid')
+
+    with pytest.raises(SystemExit) as exit:
+        main(pay_run_args(db) + ['--status', status, '--output-dir', str(tmp_path / 'run')])
+
+    assert exit.value.code == 2
+    assert not (tmp_path / 'run').exists()
+    assert PatientStore(db).select(patient_id='PT004')['status'].iloc[0] == status
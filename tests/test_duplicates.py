@@ -0,0 +1,40 @@
+import random
+
+from reimbursed.duplicates import DUPLICATE_MAX_DISTANCE, HASH_BITS, ReceiptHashIndex, hamming
+
+def flip(phash, bits):
+    for bit in bits:
+        phash ^= 1 << bit
+    return phash
+
+def spread_bits(distance, chunks=ReceiptHashIndex.CHUNKS):
+    # Flipped bits dealt round the chunks in turn, the worst case for multi-index hashing
+    chunk_bits = HASH_BITS // chunks
+    return [(i % chunks) * chunk_bits + i // chunks for i in range(distance)]
+
+def test_every_hash_within_the_radius_is_found_however_its_bits_are_spread():
+    base = 0x0123456789ABCDEF
+    for distance in range(DUPLICATE_MAX_DISTANCE + 2):
+        for bits in (spread_bits(distance), list(range(distance)), random.Random(distance).sample(range(HASH_BITS), distance)):
+            index = ReceiptHashIndex([(flip(base, bits), 'other', 'PT002')])
+            expected = [(distance, 'other', 'PT002')] if distance <= DUPLICATE_MAX_DISTANCE else []
+            assert index.query(base) == expected, (distance, bits)
+
+def test_query_matches_a_brute_force_scan():
+    rng = random.Random(7)
+    base = rng.getrandbits(HASH_BITS)
+    # Near misses around the radius, plus unrelated hashes
+    entries = [(flip(base, rng.sample(range(HASH_BITS), rng.randint(0, 12))), f'digest-{i}', f'PT{i:03d}') for i in range(300)]
+    entries += [(rng.getrandbits(HASH_BITS), f'random-{i}', f'PT{i:03d}') for i in range(300)]
+    index = ReceiptHashIndex(entries)
+
+    for max_distance in (0, 4, DUPLICATE_MAX_DISTANCE, 11):
+        expected = sorted((hamming(base, phash), digest, patient_id) for phash, digest, patient_id in entries
+                          if hamming(base, phash) <= max_distance)
+        assert index.query(base, max_distance) == expected
+
+def test_a_receipt_is_not_its_own_duplicate_but_the_same_file_on_another_claim_is():
+    index = ReceiptHashIndex([(0xFF, 'receipt', 'PT001'), (0xFF, 'receipt', 'PT002'), (0x1FF, 'rescan', 'PT001')])
+
+    assert index.find_duplicates(0xFF, 'receipt', 'PT001') == [(0, 'receipt', 'PT002'), (1, 'rescan', 'PT001')]
+    assert index.hash_for('rescan') == 0x1FF
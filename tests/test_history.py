@@ -0,0 +1,60 @@
+import pandas as pd
+import pytest
+
+from reimbursed.history import ROLLUP_SCOPES, UNDATED
+from reimbursed.store import PatientStore
+
+def scanned_rollups(store, scope):
+    # The rollups recomputed from a full scan of the history
+    visits = store.visit_history()
+    keys = visits['visit_date'].dt.strftime('%Y-%m').fillna(UNDATED) if scope == 'month' else visits[ROLLUP_SCOPES[scope]]
+    totals = visits.assign(key=keys.astype(str), status=visits['status'].astype(str), km=visits['distance'].astype(float))
+    totals = totals.groupby(['key', 'status']).agg(visits=('patient_id', 'size'), km=('km', 'sum'), amount=('amount', 'sum'))
+    return totals.reset_index().sort_values(['key', 'status'], ignore_index=True)
+
+def assert_rollups_match_history(store):
+    for scope in ROLLUP_SCOPES:
+        rolled = store.visit_rollups(scope).sort_values(['key', 'status'], ignore_index=True)
+        scanned = scanned_rollups(store, scope)
+        assert rolled[['key', 'status', 'visits']].values.tolist() == scanned[['key', 'status', 'visits']].values.tolist()
+        assert rolled['km'].tolist() == pytest.approx(scanned['km'].tolist())
+        assert rolled['amount'].tolist() == pytest.approx(scanned['amount'].tolist())
+
+def assert_history_holds_current_visits(store):
+    patients = store.select().set_index(['patient_id', 'upcoming_visit'])
+    visits = store.visit_history().set_index(['patient_id', 'visit_date']).loc[patients.index]
+    assert visits['status'].tolist() == patients['status'].tolist()
+    assert visits['receipts'].tolist() == patients['receipts'].tolist()
+    assert visits['fare'].tolist() == patients['fare'].tolist()
+
+def check(store):
+    assert_history_holds_current_visits(store)
+    assert_rollups_match_history(store)
+
+def test_history_and_rollups_keep_up_with_approvals_receipts_and_scheduling(tmp_path):
+    store = PatientStore(str(tmp_path / 'patients.db'))
+    check(store)
+
+    patients = store.select().set_index('patient_id')
+    upcoming = patients.index[patients['status'] == 'upcoming'][0]
+    completed = patients.index[patients['status'] == 'completed'][0]
+
+    # Approve a completed claim
+    store.update_status([completed], 'approved')
+    check(store)
+
+    # Receipts with a fare on them
+    store.add_receipts(completed, ['receipt-a.pdf'], fare=12.5)
+    check(store)
+
+    # Pay it and move on to the next visit, which keeps the paid one in the history
+    store.update_status([completed], 'paid')
+    next_visit = patients.loc[completed, 'upcoming_visit'] + pd.DateOffset(months=2)
+    store.schedule_visit(completed, next_visit)
+    check(store)
+    assert len(store.visit_history(patient_id=completed)) == 2
+
+    # Rescheduling a visit that has not happened yet replaces it
+    store.schedule_visit(upcoming, patients.loc[upcoming, 'upcoming_visit'] + pd.DateOffset(days=40), visit_duration=5)
+    check(store)
+    assert len(store.visit_history(patient_id=upcoming)) == 1
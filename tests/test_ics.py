@@ -0,0 +1,47 @@
+import pandas as pd
+import pytest
+
+from reimbursed.exports import ICS_LINE_OCTETS, _ics_line, iter_visit_ics
+
+def physical_lines(data):
+    assert data.endswith(b'\r\n')
+    return data[:-2].split(b'\r\n')
+
+def unfold(data):
+    return data.replace(b'\r\n ', b'').decode('utf-8')
+
+def test_short_lines_are_not_folded():
+    line = 'SUMMARY:' + 'x' * (ICS_LINE_OCTETS - len('SUMMARY:'))
+    assert _ics_line(line) == line.encode('ascii') + b'\r\n'
+
+@pytest.mark.parametrize('char', ['a', 'é', '日', '🚕'])
+def test_long_lines_fold_at_75_octets_without_splitting_a_character(char):
+    # Offset by a few ASCII octets so multibyte characters straddle the fold points
+    line = 'DESCRIPTION:' + 'ab' + char * 120
+    folded = _ics_line(line)
+    lines = physical_lines(folded)
+
+    assert len(lines) > 1
+    assert all(len(physical) <= ICS_LINE_OCTETS for physical in lines)
+    assert all(physical.startswith(b' ') for physical in lines[1:])
+    # Each physical line is valid UTF-8 by itself, and filled as far as a whole character allows
+    for physical in lines:
+        physical.decode('utf-8')
+    width = len(char.encode('utf-8'))
+    assert all(len(physical) > ICS_LINE_OCTETS - width for physical in lines[:-1])
+    assert unfold(folded) == line + '\r\n'
+
+def test_feed_lines_are_folded_and_unfold_to_the_escaped_text():
+    visit = {
+        'patient_id': 'PT001', 'name': 'Zoë Ngữ-Nguyễn; ' * 6, 'upcoming_visit': pd.Timestamp('2026-03-02 09:30'),
+        'visit_duration': 2, 'hospital': 'Fiona Stanley Hospital', 'hospital_address': '11 Robin Warren Dr, Murdoch',
+        'study_name': 'Heart, Lung & Kidney', 'study_id': 'CARDIO-2024-001',
+    }
+    feed = b''.join(iter_visit_ics([visit], 'Visits'))
+
+    assert all(len(physical) <= ICS_LINE_OCTETS for physical in physical_lines(feed))
+    text = unfold(feed)
+    assert 'SUMMARY:Study visit: ' + 'Zoë Ngữ-Nguyễn\\; ' * 6 + ' (PT001)\r\n' in text
+    assert 'LOCATION:Fiona Stanley Hospital\\, 11 Robin Warren Dr\\, Murdoch\r\n' in text
+    assert 'DTSTART;TZID=Australia/Perth:20260302T093000\r\n' in text
+    assert 'DTEND;TZID=Australia/Perth:20260302T113000\r\n' in text
@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from reimbursed.rates import RateRules
+
+RULES = pd.DataFrame([
+    # study_id, transport_method, effective_from, km_rate, meal_allowance, meal_min_hours, fare_at_cost
+    ('*', '*', '2000-01-01', 0.44, 25, 3, 'false'),
+    ('*', 'taxi', '2000-01-01', 0.00, 30, 3, 'true'),
+    ('*', 'public', '2000-01-01', 0.00, 25, 3, 'false'),
+    ('ONCOLOGY', '*', '2000-01-01', 0.50, 25, 3, 'false'),
+    ('ONCOLOGY', 'taxi', '2026-07-01', 0.10, 40, 3, 'true'),
+    ('CARDIO', 'car', '2026-01-01', 0.60, 25, 3, 'false'),
+    ('CARDIO', 'car', '2026-07-01', 0.70, 25, 3, 'false'),
+], columns=['study_id', 'transport_method', 'effective_from', 'km_rate', 'meal_allowance', 'meal_min_hours',
+            'fare_at_cost'])
+
+def claims(*rows):
+    return pd.DataFrame([
+        {'study_id': study, 'transport_method': transport, 'upcoming_visit': pd.Timestamp(visit),
+         'distance': 10.0, 'visit_duration': 4, 'fare': 12.5}
+        for study, transport, visit in rows
+    ])
+
+def km_rates(*rows):
+    return RateRules(RULES).rates_for(claims(*rows))['km_rate'].tolist()
+
+def test_fallback_tries_study_and_transport_then_default_study_then_study_wide_then_default():
+    assert km_rates(
+        ('ONCOLOGY', 'taxi', '2026-08-01'),  # its own study and transport rule
+        ('OTHER', 'taxi', '2026-08-01'),     # the default study's taxi rule
+        ('ONCOLOGY', 'car', '2026-08-01'),   # its study-wide rule
+        ('OTHER', 'car', '2026-08-01'),      # the default rule
+    ) == [0.10, 0.00, 0.50, 0.44]
+
+def test_default_study_transport_rule_outranks_a_study_wide_rule():
+    # A study-wide km rate must not start paying public transport
+    assert km_rates(('ONCOLOGY', 'public', '2026-08-01')) == [0.00]
+
+def test_rule_applies_from_its_effective_date_and_falls_back_before_it():
+    assert km_rates(
+        ('ONCOLOGY', 'taxi', '2026-06-30'),
+        ('ONCOLOGY', 'taxi', '2026-07-01'),
+        ('CARDIO', 'car', '2025-12-31'),
+        ('CARDIO', 'car', '2026-01-01'),
+        ('CARDIO', 'car', '2026-06-30'),
+        ('CARDIO', 'car', '2026-07-01'),
+    ) == [0.00, 0.10, 0.44, 0.60, 0.60, 0.70]
+
+def test_claims_before_any_rule_is_in_effect_are_priced_at_zero():
+    rules = RateRules(RULES)
+    early = claims(('OTHER', 'car', '1999-12-31'))
+
+    assert rules.lookup(early).tolist() == [-1]
+    assert np.isnan(rules.rates_for(early)['km_rate'].iloc[0])
+    assert rules.price(early)['total'].tolist() == [0.0]
+
+def test_fares_are_paid_at_cost_only_under_a_fare_at_cost_rule():
+    priced = RateRules(RULES).price(claims(('ONCOLOGY', 'taxi', '2026-08-01'), ('ONCOLOGY', 'car', '2026-08-01')))
+
+    assert priced['fare_cost'].tolist() == [12.5, 0.0]
+    assert priced['total'].tolist() == pytest.approx([1.0 + 40 + 12.5, 5.0 + 25])
+
+def test_rules_without_a_default_are_rejected():
+    with pytest.raises(ValueError, match="default rule"):
+        RateRules(RULES[RULES['study_id'] != '*'])
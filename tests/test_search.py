@@ -0,0 +1,55 @@
+from reimbursed.search import PatientSearchIndex
+
+def patient(patient_id, name, study_name='Heart Health Study'):
+    return {'patient_id': patient_id, 'name': name, 'study_name': study_name}
+
+def test_exact_token_matches_rank_above_prefix_matches():
+    index = PatientSearchIndex([patient('PT001', 'Annabel Smith'), patient('PT002', 'Ann Lee'), patient('PT003', 'Bob Ng')])
+
+    assert index.search('ann') == ['PT002', 'PT001']
+    assert index.search('anna') == ['PT001']
+
+def test_matches_on_more_important_fields_rank_higher():
+    # patient_id outranks name, which outranks study_name
+    index = PatientSearchIndex([
+        patient('PT001', 'Alex Diabetes', study_name='Oncology'),
+        patient('PT002', 'Sam Jones', study_name='Diabetes Study'),
+        patient('PT003', 'Kim Park', study_name='Oncology'),
+    ])
+
+    assert index.search('diabetes') == ['PT001', 'PT002']
+    assert index.search('3') == ['PT003']
+
+def test_every_term_must_match_and_scores_add_up():
+    index = PatientSearchIndex([
+        patient('PT001', 'Mary Jones'), patient('PT002', 'Mary Smith'), patient('PT003', 'Maryanne Smith'),
+    ])
+
+    assert index.search('mary smith') == ['PT002', 'PT003']
+    assert index.search('mary nobody') == []
+
+def test_ids_are_found_with_or_without_leading_zeros():
+    index = PatientSearchIndex([patient('PT007', 'Jo Bloggs'), patient('PT070', 'Al Bloggs')])
+
+    assert index.search('PT007') == ['PT007']
+    # '7' is also a prefix of '70', which ranks below the exact match
+    assert index.search('7') == ['PT007', 'PT070']
+    assert index.search('007') == ['PT007']
+
+def test_results_are_limited_to_the_best_ranked_then_insertion_order():
+    # Samantha, added first, is only a prefix match for 'sam', so ranks below every exact one
+    patients = [patient('PT099', 'Samantha Early')] + [patient(f'PT{i:03d}', f'Sam Person{i}') for i in range(1, 31)]
+    index = PatientSearchIndex(patients)
+
+    assert index.search('sam', limit=5) == ['PT001', 'PT002', 'PT003', 'PT004', 'PT005']
+    assert index.search('sam', limit=50)[-1] == 'PT099'
+    assert len(index.search('sam', limit=50)) == 31
+    assert index.search('sam', limit=0) == []
+
+def test_changed_and_removed_patients_are_reindexed():
+    index = PatientSearchIndex([patient('PT001', 'Lee Chan'), patient('PT002', 'Lee Wong')])
+    index.add([patient('PT001', 'Ray Chan')])
+    index.remove('PT002')
+
+    assert index.search('lee') == []
+    assert index.search('ray') == ['PT001']
@@ -0,0 +1,26 @@
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Run in a fresh interpreter, as other tests may already have imported these
+LOGIN_SCRIPT = """
+import json, sys
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file(sys.argv[1], default_timeout=120)
+at.run()
+print(json.dumps({'exception': bool(at.exception), 'modules': sorted(sys.modules)}))
+"""
+
+def test_login_screen_does_not_import_invoice_or_chart_libraries(tmp_path):
+    env = dict(os.environ, REIMBURSED_DB=str(tmp_path / 'patients.db'))
+    output = subprocess.run([sys.executable, '-c', LOGIN_SCRIPT, os.path.join(ROOT, 'reimbursedv7.py')],
+                            capture_output=True, text=True, check=True, cwd=ROOT, env=env).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+
+    assert not result['exception']
+    loaded = [module for module in result['modules']
+              if module.split('.')[0] == 'reportlab' or module == 'plotly.express' or module.startswith('plotly.express.')]
+    assert loaded == []
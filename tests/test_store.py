@@ -0,0 +1,20 @@
+from reimbursed.store import PatientStore, seed_patient_data
+
+def new_patient(name):
+    # A mock patient without an ID, as the new-patient form submits it
+    patient = {key: value for key, value in seed_patient_data()[0].items() if key != 'patient_id'}
+    return dict(patient, name=name)
+
+def test_add_patients_allocates_ids_that_other_writers_cannot_take(tmp_path):
+    # Two stores on one file stand in for two app replicas; the mock seed holds PT001 to PT005
+    db = str(tmp_path / 'patients.db')
+    first, second = PatientStore(db), PatientStore(db)
+
+    assert first.add_patients([new_patient('Ada'), new_patient('Grace')]) == ['PT006', 'PT007']
+    assert second.add_patients([new_patient('Alan')]) == ['PT008']
+    assert first.add_patients([dict(new_patient('Edsger'), patient_id='PT100'), new_patient('Barbara')]) == ['PT100', 'PT101']
+
+    patients = PatientStore(db).select()
+    assert patients.set_index('patient_id').loc[['PT006', 'PT007', 'PT008', 'PT101'], 'name'].tolist() == [
+        'Ada', 'Grace', 'Alan', 'Barbara'
+    ]